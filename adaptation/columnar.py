@@ -0,0 +1,236 @@
+"""Array-backed covariate state for all regions.
+
+The standard covariators keep a separate running-average object for
+every region, and the parallel drivers pass around a dictionary of
+covariates for every region. The classes here instead store one float
+array per quantity across all regions:
+
+ - `ColumnarAverager` subclasses are running averages (mean, median,
+   Bartlett kernel, and bucket/exponential) for every region, which
+   can be updated for all regions in a single array operation per
+   year, or one region at a time through `AveragerView` objects that
+   provide the same `get`/`update` interface as the
+   `impactcommon.math.averages` averagers.
+
+ - `ColumnarCovariateStore` holds the current covariates as one array
+   per covariate, with `get_current(region)` returning the familiar
+   {covariate: value} dictionary as a view.
+
+The columnar averagers are used in place of the per-region averagers
+when the `columnar-covariates` configuration option is set.
+"""
+
+import numpy as np
+from datastore import irregions
+
+class ColumnarAverager(object):
+    """Base class for running averages stored as (length x regions) arrays.
+
+    Each region keeps up to `length` of its most recent values in a
+    ring buffer; regions may have different numbers of values.
+
+    Parameters
+    ----------
+    valueses : sequence of sequence of float
+        The initial values for each region, oldest first. Only the
+        last `length` values are kept.
+    length : int
+        The number of values included in the average.
+    """
+    def __init__(self, valueses, length):
+        self.length = int(length)
+        numregions = len(valueses)
+        self.values = np.full((self.length, numregions), np.nan)
+        self.counts = np.zeros(numregions, dtype=int)
+        for ii in range(numregions):
+            recent = np.asarray(valueses[ii], dtype=float).flatten()[-self.length:]
+            self.values[:len(recent), ii] = recent
+            self.counts[ii] = len(recent)
+        self.positions = self.counts % self.length # next slot to write
+
+    def __len__(self):
+        return self.values.shape[1]
+
+    def update(self, ii, value):
+        """Add a new value for the region at position `ii`."""
+        self.values[self.positions[ii], ii] = value
+        self.positions[ii] = (self.positions[ii] + 1) % self.length
+        self.counts[ii] = min(self.counts[ii] + 1, self.length)
+
+    def update_all(self, values, mask=None):
+        """Add a new value for every region (or those where `mask` is True)."""
+        indices = np.arange(len(self)) if mask is None else np.flatnonzero(mask)
+        values = np.asarray(values, dtype=float)
+        if mask is not None and values.shape != indices.shape:
+            values = values[indices]
+        self.values[self.positions[indices], indices] = values
+        self.positions[indices] = (self.positions[indices] + 1) % self.length
+        self.counts[indices] = np.minimum(self.counts[indices] + 1, self.length)
+
+    def get_recent(self, ii):
+        """Return the stored values for region `ii`, newest first."""
+        return self.values[(self.positions[ii] - 1 - np.arange(self.counts[ii])) % self.length, ii]
+
+    def get_recent_all(self):
+        """Return (length x regions) values, newest first, and a mask of which are present."""
+        lags = np.arange(self.length)[:, np.newaxis]
+        rows = (self.positions[np.newaxis, :] - 1 - lags) % self.length
+        recent = self.values[rows, np.arange(len(self))[np.newaxis, :]]
+        return recent, lags < self.counts[np.newaxis, :]
+
+    def get(self, ii):
+        """Return the current average for region `ii`."""
+        raise NotImplementedError
+
+    def get_all(self):
+        """Return the current average for every region, as an array."""
+        raise NotImplementedError
+
+    def view(self, ii):
+        """Return an object with the per-region averager interface for region `ii`."""
+        return AveragerView(self, ii)
+
+class AveragerView(object):
+    """The `get`/`update` interface of a single-region averager, backed by a ColumnarAverager."""
+    __slots__ = ('averager', 'index')
+
+    def __init__(self, averager, index):
+        self.averager = averager
+        self.index = index
+
+    def get(self):
+        return self.averager.get(self.index)
+
+    def update(self, value):
+        self.averager.update(self.index, value)
+
+class ColumnarMeanAverager(ColumnarAverager):
+    """Running mean of the last `length` values."""
+    def get(self, ii):
+        return np.mean(self.get_recent(ii)[::-1])
+
+    def get_all(self):
+        recent, present = self.get_recent_all()
+        return np.sum(np.where(present, recent, 0), axis=0) / self.counts
+
+class ColumnarMedianAverager(ColumnarAverager):
+    """Running median of the last `length` values."""
+    def get(self, ii):
+        return np.median(self.get_recent(ii)[::-1])
+
+    def get_all(self):
+        recent, present = self.get_recent_all()
+        return np.nanmedian(np.where(present, recent, np.nan), axis=0)
+
+class ColumnarBartlettAverager(ColumnarAverager):
+    """Running Bartlett (triangular) kernel over the last `length` values.
+
+    The newest value has weight `length`, the one before it `length -
+    1`, and so on, normalized by the sum of the weights present.
+    """
+    def __init__(self, valueses, length):
+        super(ColumnarBartlettAverager, self).__init__(valueses, length)
+        self.weights = (self.length - np.arange(self.length)) / float(self.length) # newest first
+
+    def get(self, ii):
+        weights = self.weights[:self.counts[ii]]
+        return np.sum(weights * self.get_recent(ii)) / np.sum(weights)
+
+    def get_all(self):
+        recent, present = self.get_recent_all()
+        weights = np.where(present, self.weights[:, np.newaxis], 0)
+        return np.sum(weights * np.where(present, recent, 0), axis=0) / np.sum(weights, axis=0)
+
+class ColumnarBucketAverager(ColumnarAverager):
+    """Exponentially-decaying (Bayesian updating) average, with decay `1 / length`.
+
+    Starts at the mean of all initial values.
+    """
+    def __init__(self, valueses, length):
+        self.length = length
+        self.means = np.array([np.mean(values) for values in valueses], dtype=float)
+
+    def __len__(self):
+        return len(self.means)
+
+    def update(self, ii, value):
+        self.means[ii] = (self.means[ii] * (self.length - 1) + value) / self.length
+
+    def update_all(self, values, mask=None):
+        values = np.asarray(values, dtype=float)
+        if mask is None:
+            self.means = (self.means * (self.length - 1) + values) / self.length
+        else:
+            if values.shape != self.means.shape:
+                full = np.full(self.means.shape, np.nan)
+                full[np.flatnonzero(mask)] = values
+                values = full
+            self.means = np.where(mask, (self.means * (self.length - 1) + values) / self.length, self.means)
+
+    def get(self, ii):
+        return self.means[ii]
+
+    def get_all(self):
+        return self.means.copy()
+
+class ColumnarCovariateStore(object):
+    """Current covariate values for all regions, stored as one array per covariate.
+
+    Parameters
+    ----------
+    regions : sequence of str
+        The regions, in column order.
+    """
+    def __init__(self, regions):
+        self.regions = irregions.RegionIndex.of(regions)
+        self.indices = self.regions.get_indices_dict()
+        self.columns = {} # {covarname: array over regions}
+        self.years = np.full(len(self.regions), np.nan) # covariate year, possibly rescaled
+        self.current = {} # {region: covariates dictionary}, as returned by get_current
+
+    def set(self, region, covariates, year=None):
+        """Record the covariates for `region` (and, optionally, its covariate year)."""
+        ii = self.indices[region]
+        self.current.pop(region, None)
+        if any(covar not in self.columns for covar in covariates):
+            self.current.clear() # every region gains a column
+        for covar, value in covariates.items():
+            if covar not in self.columns:
+                self.columns[covar] = np.full(len(self.regions), np.nan)
+            if self.columns[covar].dtype != object and not np.isscalar(value):
+                self.columns[covar] = self.columns[covar].astype(object)
+            self.columns[covar][ii] = value
+        if year is not None:
+            self.years[ii] = year
+
+    def set_column(self, covar, values):
+        """Replace a covariate for all regions at once."""
+        assert len(values) == len(self.regions)
+        self.columns[covar] = np.asarray(values)
+        self.current.clear()
+
+    def get_current(self, region):
+        """Return the {covariate: value} dictionary for `region`.
+
+        The dictionary is made on the first call after the region's
+        covariates are set, and the same one is returned until then.
+        """
+        covariates = self.current.get(region)
+        if covariates is None:
+            ii = self.indices[region]
+            covariates = {covar: self.columns[covar][ii] for covar in self.columns}
+            self.current[region] = covariates
+        return covariates
+
+    def get_yearcovar(self, region):
+        return self.years[self.indices[region]]
+
+    def get_matrix(self, covarnames):
+        """Return the regions x covariates matrix for `covarnames`."""
+        return np.stack([np.asarray(self.columns[covar], dtype=float) for covar in covarnames], axis=1)
+
+    def __getitem__(self, region):
+        return self.get_current(region)
+
+    def __contains__(self, region):
+        return region in self.indices
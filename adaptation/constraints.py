@@ -58,8 +58,37 @@ def get_curve_maxima(regions, curvegen, covariator, mint, maxt, analytic):
     return get_curve_extrema(regions, curvegen, covariator, mint, maxt, analytic, 'downdog', 'maxpath')
 
 
-def get_curve_extrema(regions, curvegen, covariator, mint, maxt, analytic, direction, extpathkey):
+def get_baseline_curves(regions, curvegen, covariator, year=2005):
+    """Return {region: curve} for the regions with covariates available.
+
+    Uses the curve generator's `get_curves`, if it has one, to compute
+    the coefficients for all regions in a single batch. If any region's
+    covariates are incomplete or not scalars, makes each curve
+    separately, leaving out the regions that cannot be made.
+    """
+    available = []
+    covariateses = []
+    for region in regions:
+        try:
+            covariateses.append(covariator.get_current(region))
+        except KeyError:  # If region isn't available (e.g. for diagnostic runs)...
+            continue
+        available.append(region)
+
+    if hasattr(curvegen, 'get_curves') and curvegen.has_scalar_covariates(covariateses):
+        return dict(zip(available, curvegen.get_curves(available, year, covariateses)))
+
     baselinecurves = {}
+    for region, covariates in zip(available, covariateses):
+        try:
+            baselinecurves[region] = curvegen.get_curve(region, year, covariates)
+        except KeyError:
+            continue
+    return baselinecurves
+
+
+def get_curve_extrema(regions, curvegen, covariator, mint, maxt, analytic, direction, extpathkey):
+    baselinecurves = get_baseline_curves(regions, curvegen, covariator)
     baselineexts = {}
 
     if caller.callinfo and extpathkey in caller.callinfo:
@@ -71,11 +100,9 @@ def get_curve_extrema(regions, curvegen, covariator, mint, maxt, analytic, direc
             writer = csv.writer(fp)
             writer.writerow(['region', 'brute', 'analytic'])
             for region in regions:
-                try:
-                    curve = curvegen.get_curve(region, 2005, covariator.get_current(region))
-                except KeyError:  # If current region isn't available...
+                if region not in baselinecurves:  # If current region isn't available...
                     continue
-                baselinecurves[region] = curve
+                curve = baselinecurves[region]
                 if isinstance(mint, dict):
                     temps = np.arange(np.floor(mint[region]), np.ceil(maxt[region])+1)
                 else:
@@ -92,12 +119,9 @@ def get_curve_extrema(regions, curvegen, covariator, mint, maxt, analytic, direc
         os.chmod(caller.callinfo[extpathkey], 0o664)
     else:
         for region in regions:
-            try:
-                curve = curvegen.get_curve(region, 2005, covariator.get_current(region))
-            except KeyError:  # If region isn't available (e.g. for diagnostic runs)...
+            if region not in baselinecurves:  # If region isn't available (e.g. for diagnostic runs)...
                 continue
-            baselinecurves[region] = curve
-            exttemp2 = analytic(curve)
+            exttemp2 = analytic(baselinecurves[region])
             baselineexts[region] = exttemp2
 
     return baselinecurves, baselineexts
@@ -35,6 +35,7 @@ from .econmodel import *
 from datastore import agecohorts, irvalues, irregions
 from climate.yearlyreader import RandomYearlyAccess
 from interpret import averages, configs
+from generate import baselinecache
 
 
 ## Class constructor with arguments (initial values, running length)
@@ -200,13 +201,58 @@ class EconomicCovariator(Covariator):
         self.numeconyears = config.get('length', standard_economic_config['length'])
         self.country_level = bool(country_level)
 
-        self.econ_predictors = economicmodel.baseline_prepared(maxbaseline, self.numeconyears, lambda values: averages.interpret(config, standard_economic_config, values), country_level_gdppc=country_level)
+        self.columns = None # {covariate: ColumnarAverager}, under `columnar-covariates`
+        if config.get('columnar-covariates', False):
+            self.econ_predictors = self.prepare_columnar(economicmodel, maxbaseline, country_level, config)
+        else:
+            self.econ_predictors = economicmodel.baseline_prepared(maxbaseline, self.numeconyears, lambda values: averages.interpret(config, standard_economic_config, values), country_level_gdppc=country_level)
         self.economicmodel = economicmodel
 
         self.covariates_scalar = configs.get_covariate_rate(config, 'income')
         if self.covariates_scalar != 1:
-            self.baseline_loggdppc = {region: self.econ_predictors[region]['loggdppc'].get() for region in self.econ_predictors}
-            self.baseline_loggdppc['mean'] = np.mean(list(self.baseline_loggdppc.values()))
+            if self.columns is not None:
+                self.baseline_loggdppc = dict(zip(self.columnar_regions, self.columns['loggdppc'].get_all()))
+            else:
+                self.baseline_loggdppc = {region: self.econ_predictors[region]['loggdppc'].get() for region in self.econ_predictors}
+            if getattr(economicmodel, 'filter_region', None) is None:
+                self.baseline_loggdppc['mean'] = np.mean(list(self.baseline_loggdppc.values()))
+            else:
+                # The mean is over all regions, not only those filtered by `filter-region`
+                allpredictors = economicmodel.baseline_prepared(maxbaseline, self.numeconyears, lambda values: averages.interpret(config, standard_economic_config, values), country_level_gdppc=country_level, filtered=False)
+                self.baseline_loggdppc['mean'] = np.mean([allpredictors[region]['loggdppc'].get() for region in allpredictors])
+
+    def prepare_columnar(self, economicmodel, maxbaseline, country_level, config):
+        """Construct the econ_predictors dictionary, backed by columnar averagers.
+
+        Sets `columns` to {covariate: ColumnarAverager}, over the
+        regions in `columnar_regions`, and returns {region: {covariate:
+        AveragerView}}.
+        """
+        histories = economicmodel.baseline_prepared(maxbaseline, self.numeconyears, lambda values: values, country_level_gdppc=country_level)
+        self.columnar_regions = list(histories.keys())
+        self.columnar_year = maxbaseline # last year included in the averages
+        self.columns = {}
+        for covar in ['loggdppc', 'popop']:
+            self.columns[covar] = averages.interpret_columnar(config, standard_economic_config, [histories[region][covar] for region in self.columnar_regions])
+
+        return {region: {covar: self.columns[covar].view(ii) for covar in self.columns} for ii, region in enumerate(self.columnar_regions)}
+
+    def update_columnar(self, year):
+        """Add `year` to the averages of every region at once, if it is not yet included.
+
+        Called when the first region is updated for `year`, so the
+        projection must reach each year for all regions before any
+        region continues to the next (as the projection loops do).
+        """
+        if year <= self.columnar_year:
+            return
+        self.columnar_year = year
+
+        query_regions = [self._get_root_region(region) for region in self.columnar_regions] if self.country_level else self.columnar_regions
+        for covar, get_year in [('loggdppc', self.economicmodel.get_loggdppc_year), ('popop', self.economicmodel.get_popop_year)]:
+            values = [get_year(query_region, year) for query_region in query_regions]
+            present = np.array([value is not None for value in values], dtype=bool)
+            self.columns[covar].update_all(np.array([value for value in values if value is not None], dtype=float), mask=present)
 
     @staticmethod
     def _get_root_region(x):
@@ -279,7 +325,10 @@ class EconomicCovariator(Covariator):
         query_region = self._get_root_region(region) if self.country_level else region
         self.lastyear[region] = year
 
-        if region in self.econ_predictors:
+        if self.columns is not None:
+            if year > self.startupdateyear:
+                self.update_columnar(year)
+        elif region in self.econ_predictors:
             loggdppc = self.economicmodel.get_loggdppc_year(query_region, year)
             if loggdppc is not None and year > self.startupdateyear:
                 self.econ_predictors[region]['loggdppc'].update(loggdppc)
@@ -436,25 +485,39 @@ class MeanWeatherCovariator(Covariator):
             print("Collecting baseline information: Mean of " + variable)
         self.dsvar = variable # Save this to be consistent
             
+        # Annual means through maxbaseline, possibly from the baseline cache
+        try:
+            self.dsvar, values = baselinecache.baseline_matrix(weatherbundle, maxbaseline, ['daily' + variable, variable] if usedaily else [variable],
+                                                               self.numtempyears, config, quiet=quiet)
+        except Exception as ex:
+            print(("Cannot retrieve baseline data for %s" % variable))
+            raise ex
+
+        columnar_regions = list(configs.get_regions(weatherbundle.regions, config.get('filter-region')))
+        regionindex = irregions.RegionIndex.of(weatherbundle.regions)
+        columnar_values = [values[:, regionindex.index(region)] for region in columnar_regions]
+
         temp_predictors = {}
-        for region, ds in weatherbundle.baseline_values(maxbaseline, quiet=quiet, only_region=config.get('filter-region')): # baseline through maxbaseline
-            self.dsvar = 'daily' + variable if usedaily and 'daily' + variable in ds._variables else variable
-            try:
-                temp_predictors[region] = averages.interpret(config, standard_climate_config, ds[self.dsvar][-self.numtempyears:])
-            except Exception as ex:
-                print(("Cannot retrieve baseline data for %s" % variable))
-                print(ds)
-                raise ex
+        self.column = None # ColumnarAverager, under `columnar-covariates`
+        if not config.get('columnar-covariates', False):
+            for region, regionvalues in zip(columnar_regions, columnar_values):
+                temp_predictors[region] = averages.interpret(config, standard_climate_config, regionvalues)
+        else:
+            self.column = averages.interpret_columnar(config, standard_climate_config, columnar_values)
+            temp_predictors = {region: self.column.view(ii) for ii, region in enumerate(columnar_regions)}
 
         self.temp_predictors = temp_predictors
         self.weatherbundle = weatherbundle
 
         self.covariates_scalar = configs.get_covariate_rate(config, 'climate')
         if self.covariates_scalar != 1:
-            baseline_predictors = {}
-            for region in temp_predictors:
-                baseline_predictors[region] = temp_predictors[region].get()
-            self.baseline_predictors = baseline_predictors
+            if self.column is not None:
+                self.baseline_predictors = dict(zip(columnar_regions, self.column.get_all()))
+            else:
+                baseline_predictors = {}
+                for region in temp_predictors:
+                    baseline_predictors[region] = temp_predictors[region].get()
+                self.baseline_predictors = baseline_predictors
 
         self.usedaily = usedaily
 
@@ -694,6 +757,7 @@ class YearlyWeatherCovariator(Covariator):
         self.is_historical = is_historical
 
         self.random_year_access = RandomYearlyAccess(yearlyreader)
+        self.regionindex = irregions.RegionIndex.of(regions)
 
     def get_current(self, region):
         """
@@ -727,8 +791,8 @@ class YearlyWeatherCovariator(Covariator):
 
         assert year < 10000
 
-        values = self.random_year_access.get_year(year).sel(region=region)
-        self.predictors[region].update(values)
+        values = self.random_year_access.get_values(year, self.yearlyreader.variables[0])
+        self.predictors[region].update(values[self.regionindex.index(region)])
 
         return {self.yearlyreader.get_dimension()[0]: self.predictors[region].get()}
 
@@ -7,7 +7,7 @@ Specification.pdf.
 
 """
 
-import csv, copy, re
+import csv, copy, re, hashlib
 import numpy as np
 import metacsv
 from . import csvvfile_legacy
@@ -233,6 +233,26 @@ def filtered(csvv, func):
     toinclude = [ii for ii in range(len(csvv['prednames'])) if func(csvv['prednames'][ii], csvv['covarnames'][ii])]
     return subset(csvv, toinclude)
 
+def fingerprint(csvv):
+    """Return a digest identifying a CSVV, given as a path or as returned by `read`.
+
+    Used to check that a checkpointed run is resumed with the same
+    coefficients.
+    """
+    digest = hashlib.sha1()
+    if isinstance(csvv, str):
+        with open(csvv, 'rb') as fp:
+            digest.update(fp.read())
+        return digest.hexdigest()
+
+    for key in sorted(csvv):
+        digest.update(key.encode('utf-8'))
+        if isinstance(csvv[key], np.ndarray):
+            digest.update(csvv[key].tobytes())
+        else:
+            digest.update(repr(csvv[key]).encode('utf-8'))
+    return digest.hexdigest()
+
 def get_gamma(csvv, predname, covarname):
     """Return a single coefficient for the interaction between a predictor and a covariate."""
     for ii in range(len(csvv['gamma'])):
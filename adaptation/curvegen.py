@@ -155,6 +155,154 @@ class CSVVCurveGenerator(CurveGenerator):
             marginals[predname] = self.predgammas[predname][self.predcovars[predname].index(covar)]
         return marginals
 
+    def fill_covariate_columns(self):
+        """Index the covariates of each predictor as columns of a covariates matrix.
+
+        Called automatically by `get_coefficients_matrix` whenever the
+        marginals have been (re-)filled, so it follows any changes made
+        by `fill_marginals` or by subclasses that fill the marginals
+        differently.
+
+        Sets `covarorder` (the covariate names, in column order),
+        `predcolumns` (for each predictor, the columns of its
+        covariates, in the order of its gammas), and `constantvector`
+        (the uninteracted gamma for each predictor, NaN if missing).
+        For sum-by-time marginals, with T gammas for each covariate,
+        `constantvector` is predictors x T.
+        """
+        self.covarorder = []
+        numtimes = None
+        for predname in self.prednames:
+            if np.ndim(self.predgammas[predname]) > 1:
+                numtimes = np.shape(self.predgammas[predname])[0]
+            elif np.ndim(self.constant.get(predname, 0)) > 0:
+                numtimes = len(self.constant[predname])
+            for covar in self.predcovars[predname]:
+                if covar not in self.covarorder:
+                    self.covarorder.append(covar)
+
+        timeshape = (numtimes,) if numtimes is not None else ()
+        self.predcolumns = [[self.covarorder.index(covar) for covar in self.predcovars[predname]] for predname in self.prednames]
+        self.constantvector = np.zeros((len(self.prednames),) + timeshape)
+        for ii, predname in enumerate(self.prednames):
+            if len(self.predgammas[predname]) == 0 and predname not in self.constant:
+                self.constantvector[ii] = np.nan
+            else:
+                self.constantvector[ii] = self.constant.get(predname, 0)
+
+        self._covariate_columns_source = (self.predgammas, tuple(self.prednames))
+
+    def _ensure_covariate_columns(self):
+        """Re-index the covariates if the marginals have changed since they were indexed."""
+        source = getattr(self, '_covariate_columns_source', None)
+        if source is None or source[0] is not self.predgammas or source[1] != tuple(self.prednames):
+            self.fill_covariate_columns()
+
+    def get_covariate_sums(self, covariates):
+        """Sum the gammas times the covariates of each predictor, for many regions.
+
+        Each predictor's sum includes only its own covariates, added
+        in the order of its gammas, so a missing value for a covariate
+        that a predictor does not use has no effect on it.
+
+        Parameters
+        ----------
+        covariates : ndarray
+            Float matrix of regions x covariates, in `covarorder`.
+
+        Returns
+        -------
+        ndarray
+            Float matrix of regions x predictors, in the order of
+            `prednames`, or regions x predictors x T for sum-by-time
+            marginals.
+        """
+        sums = np.zeros((covariates.shape[0],) + self.constantvector.shape)
+        for ii, predname in enumerate(self.prednames):
+            gammas = np.asarray(self.predgammas[predname])
+            for kk, column in enumerate(self.predcolumns[ii]):
+                # One gamma per covariate, or a column of T gammas
+                sums[:, ii] += np.multiply.outer(covariates[:, column], gammas[..., kk])
+
+        return sums
+
+    def get_coefficients_matrix(self, covariates, covarnames=None):
+        """Calculate the beta coefficients for many regions at once.
+
+        The batched equivalent of `get_coefficients`: sums each
+        predictor's gammas times its covariates for all regions
+        together, with the same clipping to `betalimits`.
+
+        Parameters
+        ----------
+        covariates : array_like
+            Float matrix of regions x covariates.
+        covarnames : sequence of str, optional
+            The covariate for each column of `covariates`. If None,
+            columns must follow `covarorder`. Unused columns are ignored.
+
+        Returns
+        -------
+        ndarray
+            Float matrix of regions x predictors, in the order of
+            `prednames`, or regions x predictors x T for sum-by-time
+            marginals.
+        """
+        covariates = self.order_covariates_matrix(covariates, covarnames)
+
+        for ii, predname in enumerate(self.prednames):
+            if np.any(np.isnan(self.constantvector[ii])):
+                print("ERROR: Cannot find the uninteracted value for %s; is it in the CSVV?" % predname)
+                raise KeyError(predname)
+
+        coefficients = self.constantvector + self.get_covariate_sums(covariates)
+
+        for ii, predname in enumerate(self.prednames):
+            if predname in self.betalimits and len(self.predgammas[predname]) > 0:
+                coefficients[:, ii] = np.minimum(np.maximum(self.betalimits[predname][0], coefficients[:, ii]), self.betalimits[predname][1])
+
+        return coefficients
+
+    def order_covariates_matrix(self, covariates, covarnames=None):
+        """Select and order the columns of `covariates` to match `covarorder`."""
+        self._ensure_covariate_columns()
+
+        covariates = np.asarray(covariates, dtype=float)
+        if covarnames is None:
+            return covariates
+
+        try:
+            return covariates[:, [list(covarnames).index(covar) for covar in self.covarorder]]
+        except ValueError:
+            print("Available covariates:")
+            print(covarnames)
+            print("Requested covariates:")
+            print(self.covarorder)
+            raise
+
+    def covariates_matrix(self, covariateses):
+        """Stack per-region covariate dictionaries into a matrix for `get_coefficients_matrix`.
+
+        Parameters
+        ----------
+        covariateses : sequence of dict
+            One covariates dictionary per region.
+
+        Returns
+        -------
+        ndarray
+            Float matrix of regions x covariates, in `covarorder`.
+        """
+        self._ensure_covariate_columns()
+
+        return np.array([[covariates[covar] for covar in self.covarorder] for covariates in covariateses], dtype=float).reshape((len(covariateses), len(self.covarorder)))
+
+    def has_scalar_covariates(self, covariateses):
+        """Can `covariates_matrix` stack these covariates, with a scalar for each covariate used?"""
+        self._ensure_covariate_columns()
+
+        return all(covar in covariates and np.ndim(covariates[covar]) == 0 for covariates in covariateses for covar in self.covarorder)
+
     def get_curve(self, region, year, covariates=None):
         if covariates is None:
             covariates = {}
@@ -179,6 +327,39 @@ class CSVVCurveGenerator(CurveGenerator):
 
         return np.array(terms)
     
+def zero_clipped_coefficients(prederiv_curvegen, curvegen, prederiv_coeffs, coeffs):
+    """Zero the derivative coefficients where the original betas were clipped to their limits.
+
+    The batched equivalent of the logic in the BetaLimitsDerivative
+    curve generators: once a beta is held at a limit, its derivative
+    with respect to any covariate is 0.
+
+    Parameters
+    ----------
+    prederiv_curvegen : CSVVCurveGenerator
+        The curve generator before the derivative, with `betalimits`.
+    curvegen : CSVVCurveGenerator
+        The derivative curve generator.
+    prederiv_coeffs : ndarray
+        Regions x predictors coefficients from `prederiv_curvegen`.
+    coeffs : ndarray
+        Regions x predictors coefficients from `curvegen`.
+
+    Returns
+    -------
+    ndarray
+        `coeffs`, with clipped entries set to 0.
+    """
+    coeffs = np.array(coeffs)
+    for ii, predname in enumerate(curvegen.prednames):
+        if predname in prederiv_curvegen.betalimits:
+            jj = prederiv_curvegen.prednames.index(predname)
+            limits = prederiv_curvegen.betalimits[predname]
+            clipped = (prederiv_coeffs[:, jj] == limits[0]) | (prederiv_coeffs[:, jj] == limits[1])
+            coeffs[clipped, ii] = 0
+
+    return coeffs
+
 class FarmerCurveGenerator(DelayedCurveGenerator):
     """Handles different adaptation assumptions.
 
@@ -259,7 +440,7 @@ class FarmerCurveGenerator(DelayedCurveGenerator):
 
         return FarmerCurveGenerator(self.curvegen.get_partial_derivative_curvegen(covariate, covarunit),
                                     self.covariator, self.farmer, self.save_curve)
-        
+
     def get_lincom_terms(self, region, year, predictors=None, origds=None):
         # Get last covariates
         if predictors is None:
@@ -187,6 +187,12 @@ class BetaLimitsDerivativeSumCoefficientsCurveGenerator(SumCoefficientsCurveGene
 
         return [coeffs[predname] for predname in self.prednames]
 
+    def get_coefficients_matrix(self, covariates, covarnames=None):
+        """Batched coefficients, zeroed wherever the underlying beta was clipped."""
+        return curvegen.zero_clipped_coefficients(self.prederiv_curvegen, self,
+                                                  self.prederiv_curvegen.get_coefficients_matrix(covariates, covarnames),
+                                                  super(BetaLimitsDerivativeSumCoefficientsCurveGenerator, self).get_coefficients_matrix(covariates, covarnames))
+
 class SumByTimeCoefficientsCurveGenerator(curvegen.SumByTimeMixin, LinearCSVVCurveGenerator):
     def __init__(self, csvv, coeffcurvegen, coeffsuffixes, diagprefix='coeff-'):
         super().__init__(coeffcurvegen.prednames, coeffcurvegen.indepunits, coeffcurvegen.depenunit, csvv, betalimits=coeffcurvegen.betalimits)
@@ -244,3 +250,13 @@ class MLECoefficientsCurveGenerator(CoefficientsCurveGenerator):
                     raise e
 
         return coefficients
+
+    def get_coefficients_matrix(self, covariates, covarnames=None):
+        """Batched equivalent of `get_coefficients`, for regions x covariates."""
+        covariates = self.order_covariates_matrix(covariates, covarnames)
+        coefficients = self.constantvector * np.exp(self.get_covariate_sums(covariates))
+        for ii, predname in enumerate(self.prednames):
+            if len(self.predgammas[predname]) == 0:
+                coefficients[:, ii] = np.nan
+
+        return coefficients
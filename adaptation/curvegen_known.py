@@ -57,7 +57,39 @@ class SmartCSVVCurveGenerator(curvegen.CSVVCurveGenerator):
         openest.generate.smart_curve.SmartCurve
         """
         coefficients = self.get_coefficients(covariates)
+        return self.get_coefficients_curve(region, year, coefficients, recorddiag=recorddiag)
 
+    def get_curves(self, regions, year, covariateses, recorddiag=True):
+        """Return the curves for many regions, computing their coefficients in one batch.
+
+        Equivalent to calling `get_curve` for each region, but the
+        coefficients come from `get_coefficients_matrix`. Subclasses
+        that make their curves differently are called region by region.
+
+        Parameters
+        ----------
+        regions : sequence of str
+            Target regions.
+        year : int
+            Target year.
+        covariateses : sequence of dict
+            Input covariates for each region.
+        recorddiag : bool
+            Should a record be sent to ``diagnostic``?
+
+        Returns
+        -------
+        list of openest.generate.smart_curve.SmartCurve
+        """
+        if type(self).get_curve is not SmartCSVVCurveGenerator.get_curve or type(self).get_coefficients is not curvegen.CSVVCurveGenerator.get_coefficients:
+            return [self.get_curve(region, year, covariates, recorddiag=recorddiag) for region, covariates in zip(regions, covariateses)]
+
+        matrix = self.get_coefficients_matrix(self.covariates_matrix(covariateses))
+        return [self.get_coefficients_curve(region, year, dict(zip(self.prednames, matrix[ii])), recorddiag=recorddiag)
+                for ii, region in enumerate(regions)]
+
+    def get_coefficients_curve(self, region, year, coefficients, recorddiag=True):
+        """Make the curve for `region` from its {predname: coefficient} dictionary."""
         yy = [coefficients[predname] for predname in self.prednames]
         if len(yy) > 0 and isinstance(yy[0], np.ndarray) and len(yy[0]) == 1:
             yy = np.array(yy).flatten().tolist() # list of values, not of np.arrays
@@ -138,6 +170,12 @@ class BetaLimitsDerivativeSmartCSVVCurveGenerator(CurveGenerator):
                     diagnostic.record(region, year, self.curvegen.diagprefix + predname, coeffs[predname])
 
         return self.curvegen.get_smartcurve(yy)
+
+    def get_coefficients_matrix(self, covariates, covarnames=None):
+        """Batched coefficients, zeroed wherever the underlying beta was clipped."""
+        return curvegen.zero_clipped_coefficients(self.prederiv_curvegen, self.curvegen,
+                                                  self.prederiv_curvegen.get_coefficients_matrix(covariates, covarnames),
+                                                  self.curvegen.get_coefficients_matrix(covariates, covarnames))
         
 class PolynomialCurveGenerator(SmartCSVVCurveGenerator):
     """A CurveGenerator for a series of polynomial terms. For a weather
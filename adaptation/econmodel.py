@@ -13,6 +13,7 @@ from impactlab_tools.utils import files
 from impactcommon.exogenous_economy import provider, gdppc
 from helpers import header
 from datastore import population, popdensity
+from interpret import configs
 
 def iterate_econmodels(config=None):
     """Discover and yield each known scenario as a SSPEconomicModel.
@@ -60,13 +61,17 @@ class SSPEconomicModel(object):
         self.pop_future_years = {} # {hierid: {year: value}}
         self.densities = {}
         self.endbaseline = config.get('endbaseline', 2015)
+        self.filter_region = config.get('filter-region', None) # only prepare these regions
 
     def reset(self):
         self.income_model.reset()
 
-    def baseline_prepared(self, maxbaseline, numeconyears, func, country_level_gdppc=False):
+    def baseline_prepared(self, maxbaseline, numeconyears, func, country_level_gdppc=False, filtered=True):
         """
         Return a dictionary {region: {loggdppc: loggdppc, popop: popop}
+
+        Under `filter-region`, only the filtered regions are included,
+        unless `filtered` is False.
         """
         # Prepare population future
         for region, year, value in population.each_future_population(self.model, self.scenario, self.dependencies):
@@ -85,7 +90,10 @@ class SSPEconomicModel(object):
         econ_predictors = {} # {region: {loggdppc: loggdppc, popop: popop}
 
         # Iterate through pop_baseline, since it has all regions
-        for region in list(pop_baseline.keys()):
+        regions = list(pop_baseline.keys())
+        if filtered and self.filter_region is not None:
+            regions = configs.get_regions(regions, self.filter_region)
+        for region in regions:
             query_region = str(region.split(".")[0]) if country_level_gdppc else region
             
             # Get the income timeseries
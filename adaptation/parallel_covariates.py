@@ -4,7 +4,7 @@ Covariator object used by workers during parallel processing runs.
 
 import numpy as np
 from generate import parallel_weather
-from . import covariates
+from . import covariates, columnar
     
 def create_covariator(specconf, weatherbundle, economicmodel, farmer):
     """Ask the driver create the covariator."""
@@ -26,17 +26,52 @@ class WorkerParallelCovariator(covariates.Covariator):
         for region in driver.regions:
             self.curr_covars[region] = self.source.get_current(region)
             self.curr_years[region] = self.source.get_yearcovar(region)
+        self.curr_store = None # ColumnarCovariateStore, once updated by a process-based driver
 
     def get_yearcovar(self, region):
+        if self.curr_store is not None:
+            return self.curr_store.get_yearcovar(region)
         return self.curr_years[region]
 
     def get_current(self, region):
+        if self.curr_store is not None:
+            return self.curr_store.get_current(region)
         return self.curr_covars[region]
         
     def offer_update(self, region, year, ds):
         if self.last_offer_year != year: # only do once per year
             outputs = self.driver.request_action(self.local, 'covariate_update', self.source, self.farmer)
-            self.curr_covars = outputs['curr_covars']
-            self.curr_years = outputs['curr_years']
+            if 'curr_store' in outputs:
+                self.curr_store = outputs['curr_store']
+            else:
+                self.curr_covars = outputs['curr_covars']
+                self.curr_years = outputs['curr_years']
             self.last_offer_year = year
         return self.get_current(region)
+
+class SharedCovariatorSource(object):
+    """Stand-in for the driver's covariator, sent to worker processes.
+
+    Carries the attributes and initial covariates that a
+    WorkerParallelCovariator needs, and is resolved back to the
+    driver's covariator by `key` when workers request updates.
+    """
+    def __init__(self, key, covariator, regions):
+        self.key = key
+        self.startupdateyear = covariator.startupdateyear
+        self.yearcovarscale = covariator.yearcovarscale
+        self.curr_covars = columnar.ColumnarCovariateStore(regions)
+        for region in regions:
+            self.curr_covars.set(region, covariator.get_current(region), covariator.get_yearcovar(region))
+
+    def get_yearcovar(self, region):
+        return self.curr_covars.get_yearcovar(region)
+
+    def get_current(self, region):
+        return self.curr_covars.get_current(region)
+
+    def __eq__(self, other):
+        return isinstance(other, SharedCovariatorSource) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
@@ -16,12 +16,23 @@ def impactcalculations_cli():
 
 @impactcalculations_cli.command(help="Post-process aggregation of impact projections")
 @click.argument("confpath", type=click.Path())
-def aggregate(confpath):
+@click.option(
+    "--workers",
+    type=int,
+    default=None,
+    help="Number of processes aggregating target directories in parallel.",
+)
+def aggregate(confpath, workers):
     """Run the impact projection aggregation system with configuration file"""
+    confpath = Path(confpath)
     file_configs = get_file_config(confpath)
     # Interpret "import" in configs here while we have file path info.
     file_configs = merge_import_config(file_configs, confpath.parent)
-    gamain(file_configs)
+
+    if workers is not None:
+        file_configs["workers"] = workers
+
+    gamain(file_configs, str(confpath.stem))
 
 
 @impactcalculations_cli.command(
@@ -6,7 +6,6 @@ import xarray as xr
 import pandas as pd
 from . import netcdfs
 from openest.generate.fast_dataset import FastDataset
-from impactcommon.math import gddkdd
 from .reader import YearlySplitWeatherReader, ConversionWeatherReader
 
 class DailyWeatherReader(YearlySplitWeatherReader):
@@ -42,9 +41,13 @@ class DailyWeatherReader(YearlySplitWeatherReader):
     def read_year(self, year):
         return self.prepare_ds(self.file_for_year(year))
 
+    def get_load_variables(self):
+        """Return the variables to read from each file: the weather variables and regions."""
+        return list(self.variable) + [self.regionvar]
+
     def prepare_ds(self, filename):
         try:
-            ds = netcdfs.load_netcdf(filename)
+            ds = netcdfs.load_netcdf(filename, variables=self.get_load_variables(), regions=self.get_region_selection())
             if 'time' in ds.coords:
                 ds = ds.rename({'time': 'yyyyddd', self.regionvar: 'region'})
                 ds['time'] = (('yyyyddd'), pd.date_range('%d-01-01' % (ds.yyyyddd[0] // 1000), periods=365))
@@ -79,6 +82,7 @@ class MonthlyDimensionedWeatherReader(YearlySplitWeatherReader):
             print(("WARNING: Cannot find %s variable in %s." % (regionvar, self.file_for_year(year1))))
         if dimvariable is None:
             dimvariable = dim
+        self.dimvariable = dimvariable
         self.dim_values = netcdfs.readncdf_single(self.file_for_year(year1), dimvariable)
         
     def get_regions(self):
@@ -97,12 +101,16 @@ class MonthlyDimensionedWeatherReader(YearlySplitWeatherReader):
     def get_dimension(self):
         return [self.variable + '-' + str(self.dim_values[bb]) for bb in range(len(self.dim_values))]
 
+    def get_load_variables(self):
+        """Return the variables to read from each file: the weather variable, regions, and dimension."""
+        return [self.variable, self.regionvar, self.dimvariable]
+
     def read_iterator(self):
         # Yield data in yearly chunks
         years = self.get_years()
         yy = 0
         for filename in self.file_iterator():
-            ds = netcdfs.load_netcdf(filename)
+            ds = netcdfs.load_netcdf(filename, variables=self.get_load_variables(), regions=self.get_region_selection())
             if 'month' in ds.coords:
                 ds = ds.rename({'month': 'time', self.regionvar: 'region'})
             else:
@@ -114,7 +122,7 @@ class MonthlyDimensionedWeatherReader(YearlySplitWeatherReader):
 
     def read_year(self, year):
         """Read variable for ``year`` from file"""
-        ds = netcdfs.load_netcdf(self.file_for_year(year))
+        ds = netcdfs.load_netcdf(self.file_for_year(year), variables=self.get_load_variables(), regions=self.get_region_selection())
         if 'month' in ds.coords:
             ds = ds.rename({'month': 'time', self.regionvar: 'region'})
         else:
@@ -147,6 +155,12 @@ class YearlyBinnedWeatherReader(YearlySplitWeatherReader):
     def get_dimension(self):
         return self.monthlyreader.get_dimension()
 
+    def can_subset_regions(self):
+        return self.monthlyreader.can_subset_regions()
+
+    def subset_regions(self, indices):
+        self.monthlyreader.subset_regions(indices)
+
     def read_iterator(self):
         # Yield data summed across years
         for ds in self.monthlyreader.read_iterator():
@@ -168,14 +182,49 @@ class GDDKDDReader(ConversionWeatherReader):
         super(GDDKDDReader, self).__init__(reader, lambda x: x, lambda ds: self.convert(ds, lower, upper))
          
     def convert(self, ds, lower, upper):
-        allgdd = np.zeros((len(ds.time), len(ds.region)))
-        allkdd = np.zeros((len(ds.time), len(ds.region)))
-        for ii in range(len(ds.region)):
-            allgdd[:, ii], allkdd[:, ii] = gddkdd.get_gddkdd(ds[self.tminvar][:, ii],
-                                                             ds[self.tmaxvar][:, ii], lower, upper)
+        allgdd, allkdd = get_gddkdd(ds[self.tminvar].values, ds[self.tmaxvar].values, lower, upper)
 
         gddname = 'gdd-%d-%d' % (lower, upper)
         kddname = 'kdd-%d' % upper
-        return fast_dataset.FastDataset({gddname: (('time', 'region'), allgdd),
-                                         kddname: (('time', 'region'), allkdd)},
-                                        {'time': ds.time, 'region': ds.region}, attrs=ds.attrs)
+        return FastDataset({gddname: (('time', 'region'), allgdd),
+                            kddname: (('time', 'region'), allkdd)},
+                           {'time': ds.time, 'region': ds.region}, attrs=ds.attrs)
+
+def degree_days_above(tmin, tmax, threshold):
+    """Degree-days above `threshold`, under a single sine approximation of each day's temperatures.
+
+    The temperature over each day is taken to follow a sine curve from
+    `tmin` to `tmax`, and the degree-days are its integral above
+    `threshold`. Works elementwise on arrays of any shape, such as
+    (days x regions). Days with a missing `tmin` or `tmax` are NaN.
+    """
+    tmin = np.asarray(tmin, dtype=float)
+    tmax = np.asarray(tmax, dtype=float)
+    middle = (tmax + tmin) / 2
+    halfrange = (tmax - tmin) / 2
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Phase at which the curve crosses the threshold, for days partly above it
+        crossing = np.arcsin(np.clip((threshold - middle) / halfrange, -1, 1))
+        partial = ((middle - threshold) * (np.pi / 2 - crossing) + halfrange * np.cos(crossing)) / np.pi
+
+    degreedays = np.where(tmin >= threshold, middle - threshold, np.where(tmax <= threshold, 0., partial))
+    return np.where(np.isnan(middle), np.nan, degreedays)
+
+def get_gddkdd(tmin, tmax, lower, upper):
+    """Growing degree-days between `lower` and `upper`, and killing degree-days above `upper`.
+
+    Parameters
+    ----------
+    tmin, tmax : array_like
+        Daily minimum and maximum temperatures, of the same shape (e.g., days x regions).
+    lower, upper : float
+
+    Returns
+    -------
+    gdd, kdd : ndarray
+        Arrays of the same shape as `tmin`, NaN where `tmin` or `tmax` is.
+    """
+    ddlower = degree_days_above(tmin, tmax, lower)
+    kdd = degree_days_above(tmin, tmax, upper)
+    return ddlower - kdd, kdd
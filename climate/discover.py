@@ -8,7 +8,7 @@ import numpy as np
 from impactlab_tools.utils import files
 from openest.generate import fast_dataset
 from interpret import configs
-from datastore import population
+from datastore import population, irregions
 from .reader import *
 from .dailyreader import DailyWeatherReader, YearlyBinnedWeatherReader, MonthlyBinnedWeatherReader, MonthlyDimensionedWeatherReader, GDDKDDReader
 from .yearlyreader import YearlyWeatherReader, YearlyDayLikeWeatherReader
@@ -214,75 +214,67 @@ def interpret_transform(var, transform):
                             lambda xs: (aftval - befval) * (xs > stepval) + befval, var)
 
     if transform == 'country':
-        irpops = population.population_baseline_data(2010, 2010, []) # to be consistent with sub-IR weights
-        subcountries = None
+        def get_weights(regions):
+            irpops = population.population_baseline_data(2010, 2010, []) # to be consistent with sub-IR weights
+            return [irpops.get(region, {2010: 1})[2010] for region in regions]
+
         countries = None
         country_weights = None
         def ds_conversion(ds):
-            nonlocal subcountries, countries, country_weights
-            # Construct aggregations
-            if subcountries is None:
-                subcountries = np.array([region[:3] for region in ds.region.values])
-                countries = np.unique(subcountries)
-            def get_subcountryii(country):
-                return np.nonzero(subcountries == country)[0]
+            nonlocal countries, country_weights
+            # Construct aggregations, shared by all readers with the same regions
             if country_weights is None:
-                country_weights = {country: np.array([irpops.get(ds.region.values[ii], {2010: 1})[2010] for ii in get_subcountryii(country)]) for country in countries}
-                for country in country_weights:
-                    if np.sum(country_weights[country]) == 0:
-                        country_weights[country] = country_weights[country] + 1
-            def accumfunc(region, values, dimnum):
-                return np.average(values, axis=dimnum, weights=country_weights[region])
-            
-            vars_only = list(ds.variables.keys())
-            for name in ds.coords:
-                if name in vars_only:
-                    vars_only.remove(name)
-            used_coords = ds.coords
-            ds = fast_dataset.FastDataset({name: data_vars_space_conversion(countries, get_subcountryii, name, ds, 'vars', accumfunc) for name in vars_only},
-                                      coords={name: data_vars_space_conversion(countries, get_subcountryii, name, ds, 'coords', accumfunc) for name in used_coords},
-                                      attrs=ds.attrs)
-            return ds
+                countries, country_weights = irregions.get_country_matrix('population-2010', list(ds.region.values), get_weights)
 
-        return discover_convert(var, None, ds_conversion)
+            data_vars, coords = data_vars_space_conversion(countries, country_weights, ds)
+            return fast_dataset.FastDataset(data_vars, coords=coords, attrs=ds.attrs)
 
-    assert False, "Cannot interpret transformation %s" % transform
+        return discover_convert(var, None, ds_conversion, preserves_regions=False)
 
-def data_vars_space_conversion(newregions, get_oldii, name, ds, varset, accumfunc):
-    if isinstance(ds, fast_dataset.FastDataset):
-        if varset == 'vars':
-            vardef = ds.original_data_vars[name]
-        elif varset == 'coords':
-            vardef = ds.original_coords[name]
-        else:
-            assert False, "Unknown varset."
-    else:
-        if varset == 'vars':
-            vardef = (ds.variables[name].dims, ds.variables[name].values)
-        elif varset == 'coords':
-            vardef = ds.coords[name]
-        else:
-            assert False, "Unknown varset."
+    assert False, "Cannot interpret transformation %s" % transform
 
-    if isinstance(vardef, tuple):
-        dimnum = vardef[0].index('region')
+def data_vars_space_conversion(newregions, matrix, ds):
+    """Aggregate the variables of `ds` across regions.
 
-        myshape = list(vardef[1].shape)
-        myshape[dimnum] = len(newregions)
-        result = np.zeros(tuple(myshape))
-        for ii in range(len(newregions)):
-            beforeindex = [slice(None)] * len(vardef[0])
-            beforeindex[dimnum] = get_oldii(newregions[ii])
-            afterindex = [slice(None)] * len(vardef[0])
-            afterindex[dimnum] = ii
-            result[tuple(afterindex)] = accumfunc(newregions[ii], vardef[1][tuple(beforeindex)], dimnum)
-            
-        return (vardef[0], result)
-
-    if name != 'region':
-        return vardef
+    All variables with a region dimension are stacked and aggregated
+    together, with a single product by the sparse (new regions x
+    regions) `matrix`.
 
-    return np.array(newregions)
+    Returns
+    -------
+    data_vars, coords : dict
+        Arguments for constructing the aggregated FastDataset.
+    """
+    if isinstance(ds, fast_dataset.FastDataset):
+        vardefs = dict(ds.original_data_vars)
+        coords = dict(ds.original_coords)
+    else:
+        vardefs = {name: (ds.variables[name].dims, ds.variables[name].values) for name in ds.variables if name not in ds.coords}
+        coords = {name: ds.coords[name] for name in ds.coords}
+
+    columns = [] # (regions x N) arrays to aggregate
+    shapes = {} # {name: (dims, dimnum, shape with regions moved first)}
+    for name, vardef in vardefs.items():
+        if isinstance(vardef, tuple) and 'region' in vardef[0]:
+            dimnum = list(vardef[0]).index('region')
+            values = np.moveaxis(np.asarray(vardef[1]), dimnum, 0)
+            shapes[name] = (vardef[0], dimnum, values.shape)
+            columns.append(values.reshape(values.shape[0], -1))
+
+    data_vars = dict(vardefs)
+    if columns:
+        results = matrix @ np.hstack(columns)
+        start = 0
+        for name, (dims, dimnum, shape) in shapes.items():
+            count = int(np.prod(shape[1:]))
+            result = results[:, start:start + count].reshape((len(newregions),) + shape[1:])
+            data_vars[name] = (dims, np.moveaxis(result, 0, dimnum))
+            start += count
+
+    if 'region' in coords:
+        coords['region'] = np.array(newregions)
+
+    return data_vars, coords
 
 def discover_models(basedir, **config):
     """
@@ -354,7 +346,7 @@ def discover_variable(basedir, variable, withyear=True, **config):
             else:
                 pasttemplate = os.path.join(pastdir, variable, variable + '_day_aggregated_historical_r1i1p1_' + model + '_%d.nc')
             futuretemplate = os.path.join(futuredir, variable, variable + '_day_aggregated_' + scenario + '_r1i1p1_' + model + '_%d.nc')
-            if not os.path.exists(futuretemplate % 2006):
+            if not listings.exists(futuretemplate % 2006):
                 continue
 
             pastreader = DailyWeatherReader(pasttemplate, config.get('startyear', 1981), 'SHAPENUM', variable)
@@ -381,7 +373,7 @@ def discover_derived_variable(basedir, variable, suffix, withyear=True, **config
             pasttemplate = os.path.join(pastdir, variable + '_' + suffix, variable + '_day_aggregated_historical_r1i1p1_' + model + '_%d.nc')
             futuretemplate = os.path.join(futuredir, variable + '_' + suffix, variable + '_day_aggregated_' + scenario + '_r1i1p1_' + model + '_%d.nc')
 
-            if os.path.exists(pasttemplate % (config.get('startyear', 1981))) and os.path.exists(futuretemplate % (2006)):
+            if listings.exists(pasttemplate % (config.get('startyear', 1981))) and listings.exists(futuretemplate % (2006)):
                 pastreader = DailyWeatherReader(pasttemplate, config.get('startyear', 1981), 'SHAPENUM', variable)
                 futurereader = DailyWeatherReader(futuretemplate, 2006, 'SHAPENUM', variable)
 
@@ -446,11 +438,11 @@ def discover_yearly_corresponding(basedir, scenario, vardir, model, variable):
                 # Reorder these results, which use hierid, to SHAPENUM order
                 return RegionReorderWeatherReader(YearlyWeatherReader(filepath, variable, timevar='time'))
 
-def discover_convert(discover_iterator, time_conversion, ds_conversion):
+def discover_convert(discover_iterator, time_conversion, ds_conversion, preserves_regions=True):
     """Convert the readers coming out of a discover iterator."""
     for scenario, model, pastreader, futurereader in discover_iterator:
-        newpastreader = ConversionWeatherReader(pastreader, time_conversion, ds_conversion)
-        newfuturereader = ConversionWeatherReader(futurereader, time_conversion, ds_conversion)
+        newpastreader = ConversionWeatherReader(pastreader, time_conversion, ds_conversion, preserves_regions=preserves_regions)
+        newfuturereader = ConversionWeatherReader(futurereader, time_conversion, ds_conversion, preserves_regions=preserves_regions)
         yield scenario, model, newpastreader, newfuturereader
 
 def discover_versioned_models(basedir, version=None, **config):
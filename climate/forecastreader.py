@@ -142,31 +142,23 @@ class CountryDuplicatedReader(TransformedReader):
         for ii in range(len(self.source.regions)):
             countryindex[self.source.regions[ii]] = ii
         self.countryindex = countryindex
+        self.regioncountries = np.array([countryindex[region[:3]] for region in self.regions])
             
     def read_iterator(self):
         for ds in self.source.read_iterator():
-            weathers = np.zeros((ds[self.variable].shape[0], len(self.regions)))
-            for ii in range(len(self.regions)):
-                weathers[:, ii] = ds[self.variable][:, self.countryindex[self.regions[ii][:3]]]
-
-            ds[self.variable] = weathers
+            ds[self.variable] = np.asarray(ds[self.variable])[:, self.regioncountries].astype(float)
             yield ds
             
 class CountryAveragedReader(TransformedReader):
     def __init__(self, source, variable):
         super(CountryAveragedReader, self).__init__(source)
 
-        self.regions = np.unique([region[:3] for region in source.regions])
+        self.regions, self.matrix = irregions.get_country_matrix(None, source.regions)
         self.variable = variable
 
     def read_iterator(self):
         for ds in self.source.read_iterator():
-            bycountry = forecasts.get_means(self.source.regions, lambda ii: ds[self.variable][:, ii])
-
-            weathers = np.zeros((ds[self.variable].shape[0], len(self.regions)))
-            for ii in range(len(self.regions)): # Just countries
-                weathers[:, ii] = bycountry[self.regions[ii]]
-                
+            weathers = forecasts.get_country_means(self.source.regions, ds[self.variable], self.matrix)
             yield ForecastMonthlyDs(ds.month, ds.ahead, weathers, ignore_regionnum=True)
 
 class CountryDeviationsReader(TransformedReader):
@@ -174,13 +166,13 @@ class CountryDeviationsReader(TransformedReader):
         super(CountryDeviationsReader, self).__init__(source)
         self.variable = variable
 
+        countries, self.matrix = irregions.get_country_matrix(None, source.regions)
+        self.regioncountries = np.searchsorted(countries, [region[:3] for region in source.regions])
+
     def read_iterator(self):
         for ds in self.source.read_iterator():
             weathers = ds[self.variable]
-            bycountry = forecasts.get_means(self.source.regions, lambda ii: weathers[:, ii])
-
-            regions = self.source.regions
-            for ii in range(len(regions)):
-                ds[self.variable][:, ii] = ds[self.variable][:, ii] - bycountry[regions[ii][:3]]
+            bycountry = forecasts.get_country_means(self.source.regions, weathers, self.matrix)
+            weathers[:, :] = np.asarray(weathers) - bycountry[:, self.regioncountries]
 
             yield ds
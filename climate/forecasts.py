@@ -2,6 +2,7 @@
 
 import numpy as np
 from netCDF4 import Dataset
+from datastore import irregions
 
 temp_path = "/shares/gcp/climate/IRI/final_v2/tas_aggregated_forecast_Feb-Jun2017.nc"
 prcp_path = "/shares/gcp/climate/IRI/final_v2/prcp_aggregated_forecast_Feb-Jun2017.nc"
@@ -61,3 +62,28 @@ def get_means(regions, getvalues):
             bycountry[country] = np.mean(bycountry2[country], axis=0)
 
     return bycountry
+
+def get_country_means(regions, values, matrix=None):
+    """Country means of the (time x regions) `values`, as a (time x countries) array.
+
+    Equivalent to `get_means`, for all countries at once: regions with
+    any non-finite values are left out of their country's mean, unless
+    every region in the country has non-finite values. The countries
+    are in sorted order. `matrix` is the unweighted
+    `irregions.country_matrix` for `regions`, if already known.
+    """
+    if matrix is None:
+        countries, matrix = irregions.get_country_matrix(None, regions)
+
+    values = np.asarray(values)
+    finite = np.all(np.isfinite(values), axis=0)
+    finite_matrix = matrix.multiply(finite[np.newaxis, :]).tocsr()
+    totals = np.asarray(finite_matrix.sum(axis=1)).ravel()
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = (finite_matrix @ np.where(finite[np.newaxis, :], values, 0).T).T / totals[np.newaxis, :]
+    if np.any(totals == 0):
+        allmeans = (matrix @ values.T).T
+        means[:, totals == 0] = allmeans[:, totals == 0]
+
+    return means
@@ -1,25 +1,37 @@
 """Helper functions for working with NetCDF files."""
 
 import os, re, py
-import logging
+import logging, threading
 import numpy as np
 from netCDF4 import Dataset
 from xarray import open_dataset
 
 logger = logging.getLogger(__name__)
 
+# The netCDF4 and HDF5 libraries are not thread-safe: hold this lock
+# for any netCDF access that may overlap another thread's (e.g., under
+# `generate.prefetch`).
+netcdf_lock = threading.RLock()
 
-def load_netcdf(filename_or_obj, **kwargs):
-    """Open, load NetCDF file, close file - with thread global thread lock.
+
+def load_netcdf(filename_or_obj, variables=None, regions=None, **kwargs):
+    """Open, load NetCDF file, close file - holding `netcdf_lock`.
 
     This is a thin wrapper around ``xarray.open_dataset``, behaving like
     ``xarray.load_dataset`` (in xarray >= 0.12) in that it ensures data is
-    read into memory, returns the data, and then closes the file. This
-    function also ensures the global thread lock is set.
+    read into memory, returns the data, and then closes the file, all
+    while holding `netcdf_lock`.
 
     Parameters
     ----------
     filename_or_obj
+    variables : sequence of str or None, optional
+        If given, only these data variables (along with all coordinates)
+        are read from the file; others are dropped before loading.
+    regions : dict of str -> array_like or slice, optional
+        If given, only these positions along each dimension are read
+        from the file, e.g., ``{'hierid': [3, 4, 5]}``. Dimensions not
+        in the file are ignored.
     kwargs :
         Passed to ``xarray.open_dataset``.
 
@@ -41,10 +53,24 @@ def load_netcdf(filename_or_obj, **kwargs):
     except (KeyError, AttributeError) as ex:
         pass # this seems to happen erratically
 
-    with open_dataset(filename_or_obj, **kwargs) as ds:
+    with netcdf_lock, open_dataset(filename_or_obj, **kwargs) as ds:
+        if variables is not None:
+            ds = ds.drop_vars([name for name in ds.data_vars if name not in variables])
+        if regions is not None:
+            ds = ds.isel({dim: as_hyperslab(indices) for dim, indices in regions.items() if dim in ds.dims})
         return ds.load()
 
 
+def as_hyperslab(indices):
+    """Return a slice for contiguous increasing `indices`, so they can be read as a single block."""
+    if isinstance(indices, slice):
+        return indices
+    indices = np.asarray(indices, dtype=int)
+    if len(indices) > 0 and np.all(np.diff(indices) == 1):
+        return slice(int(indices[0]), int(indices[-1]) + 1)
+    return indices
+
+
 def get_arbitrary_variables(path):
     variables = {} # result of the function
 
@@ -10,13 +10,195 @@ WeatherReader classes if the file and directory structures have been
 used before. Otherwise, that logic is encapsulated here.
 """
 
-import os, glob
+import os, glob, fnmatch, json, time
+from collections import OrderedDict
 import numpy as np
 import xarray as xr
 import pandas as pd
 from . import netcdfs
 from datastore import irregions
 
+class DirectoryListings(object):
+    """Memoized listings of the directories containing weather files.
+
+    Checking for each year's file, and globbing for versioned
+    filenames, requires a file system request per year and reader,
+    which is slow on network file systems. Instead, each directory is
+    listed once, and later checks use the saved listing.
+
+    The listings can also be saved to a manifest file, shared between
+    runs; each directory's listing in the manifest is reused as long
+    as the directory's modification time is unchanged.
+    """
+    def __init__(self):
+        self.listings = {} # {dirpath: set of filenames}
+        self.resolved = {} # {(template, year): path}
+        self.manifest = {} # {dirpath: [mtime, filenames]}
+        self.manifest_path = None
+
+    def use_manifest(self, path):
+        """Load listings from the manifest at `path`, and save new listings to it."""
+        self.manifest_path = path
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as fp:
+                    self.manifest = json.load(fp)
+            except Exception as ex:
+                print("WARNING: Could not read weather manifest %s." % path)
+                print(ex)
+                self.manifest = {}
+
+    def list(self, dirpath):
+        """Return the set of filenames in `dirpath` (empty if it does not exist)."""
+        if dirpath in self.listings:
+            return self.listings[dirpath]
+
+        try:
+            mtime = os.stat(dirpath or '.').st_mtime
+        except OSError:
+            self.listings[dirpath] = set()
+            return self.listings[dirpath]
+
+        if dirpath in self.manifest and self.manifest[dirpath][0] == mtime:
+            self.listings[dirpath] = set(self.manifest[dirpath][1])
+            return self.listings[dirpath]
+
+        self.listings[dirpath] = set(os.listdir(dirpath or '.'))
+        if self.manifest_path is not None:
+            self.manifest[dirpath] = [mtime, sorted(self.listings[dirpath])]
+            self.save_manifest()
+
+        return self.listings[dirpath]
+
+    def save_manifest(self):
+        # Replace the manifest only once the new one is complete
+        tmppath = self.manifest_path + '.%d.tmp' % os.getpid()
+        try:
+            with open(tmppath, 'w') as fp:
+                json.dump(self.manifest, fp)
+            os.replace(tmppath, self.manifest_path)
+        except Exception as ex:
+            print("WARNING: Could not write weather manifest %s." % self.manifest_path)
+            print(ex)
+
+    def exists(self, path):
+        """Does the file at `path` exist, according to its directory's listing?"""
+        dirpath, filename = os.path.split(path)
+        return filename in self.list(dirpath)
+
+    def find_templated(self, template, year):
+        """Resolve a template with a year (`%d`) and possibly a version (`%v`) to a path."""
+        if (template, year) in self.resolved:
+            return self.resolved[(template, year)]
+
+        pattern = template.replace("%v", "*") % (year)
+        dirpath, filepattern = os.path.split(pattern)
+        if glob.has_magic(dirpath):
+            options = glob.glob(pattern)
+        else:
+            options = [os.path.join(dirpath, filename) for filename in fnmatch.filter(self.list(dirpath), filepattern)]
+
+        if len(options) == 0:
+            path = template.replace("%v", "unknown") % (year)
+        else:
+            options = [os.path.splitext(os.path.basename(s))[0] for s in options]
+            options.sort(key=lambda s: list(map(int, s.split('.'))))
+            path = template.replace("%v", options[-1]) % (year)
+
+        self.resolved[(template, year)] = path
+        return path
+
+    def clear(self):
+        """Forget all listings, for example if files have been added."""
+        self.listings = {}
+        self.resolved = {}
+
+## Listings shared by all readers
+listings = DirectoryListings()
+
+class YearCache(object):
+    """Bounded least-recently-used cache of prepared year datasets.
+
+    Historical climate runs draw the same past years many times (by
+    cycling through the historical record, or sampling it at random),
+    so the prepared dataset for each past year is kept, up to a total
+    of `limit_mb` megabytes, and re-served rather than read again.
+    Each request returns a shallow copy, so that callers can relabel
+    its times without altering the cached dataset.
+
+    Parameters
+    ----------
+    name : str
+        Name used when reporting hits and misses.
+    limit_mb : float, optional
+        Size limit, in MB; by default, `YearCache.default_limit_mb`,
+        set from the `histclim-cache-mb` option. If 0, nothing is cached.
+    """
+    default_limit_mb = 0
+
+    def __init__(self, name, limit_mb=None):
+        self.name = name
+        self.limit_mb = limit_mb
+        self.entries = OrderedDict() # {key: (ds, nbytes)}
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_limit(self):
+        return (YearCache.default_limit_mb if self.limit_mb is None else self.limit_mb) * 1e6
+
+    def get(self, key, load):
+        """Return the dataset for `key`, calling `load()` to produce it if it is not cached."""
+        limit = self.get_limit()
+        if limit <= 0:
+            return load()
+
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return copy_dataset(self.entries[key][0])
+
+        self.misses += 1
+        ds = load()
+        if ds is None:
+            return ds
+
+        nbytes = dataset_nbytes(ds)
+        if nbytes <= limit:
+            self.entries[key] = (ds, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > limit:
+                oldkey, (oldds, oldbytes) = self.entries.popitem(last=False)
+                self.nbytes -= oldbytes
+
+        return copy_dataset(ds)
+
+    def clear(self):
+        self.entries = OrderedDict()
+        self.nbytes = 0
+
+    def report(self):
+        """Print the hit and miss counts."""
+        if self.hits + self.misses > 0:
+            print("Year cache %s: %d hits, %d misses (%.1f MB held)." % (self.name, self.hits, self.misses, self.nbytes / 1e6))
+
+def copy_dataset(ds):
+    """Shallow copy of an xarray Dataset or FastDataset, sharing its arrays."""
+    coords = getattr(ds, 'original_coords', None)
+    if coords is None:
+        coords = {name: ds.coords[name] for name in ds.coords}
+    data_vars = {}
+    for name in ds.variables:
+        if name in ds.coords:
+            continue
+        variable = ds.variables[name]
+        data_vars[name] = (tuple(variable.dims), variable._values if hasattr(variable, '_values') else variable.values)
+    return type(ds)(data_vars, coords=dict(coords), attrs=dict(ds.attrs))
+
+def dataset_nbytes(ds):
+    """Total size of the arrays in `ds`, in bytes."""
+    return sum(np.asarray(ds.variables[name].values).nbytes for name in ds.variables)
+
 class WeatherReader(object):
     """Handles reading from weather files."""
 
@@ -44,6 +226,19 @@ class WeatherReader(object):
         """
         raise NotImplementedError
 
+    def can_subset_regions(self):
+        """Returns True if `subset_regions` is supported."""
+        return False
+
+    def subset_regions(self, indices):
+        """Limit all further reads to the regions at `indices`.
+
+        The indices are positions in the full list of regions (as
+        returned by `get_regions` before any subsetting), so calling
+        this again replaces the subset rather than narrowing it.
+        """
+        raise NotImplementedError
+
 class YearlySplitWeatherReader(WeatherReader):
     """Exposes weather data, split into yearly files."""
 
@@ -59,6 +254,7 @@ class YearlySplitWeatherReader(WeatherReader):
 
         self.year1 = year1
         self.variable = variable
+        self.region_indices = None # if not None, only read these regions
 
     def __repr__(self):
         return "%s(%s)" % (self.__class__, self.template)
@@ -70,7 +266,7 @@ class YearlySplitWeatherReader(WeatherReader):
 
         # Look for available yearly files
         year = self.year1
-        while os.path.exists(self.find_templated(year)):
+        while listings.exists(self.find_templated(year)):
             years.append(year)
             year += 1
 
@@ -79,7 +275,7 @@ class YearlySplitWeatherReader(WeatherReader):
     def file_iterator(self):
         # Yield data in yearly chunks
         year = self.year1
-        while os.path.exists(self.find_templated(year)):
+        while listings.exists(self.find_templated(year)):
             yield self.find_templated(year)
             year += 1
 
@@ -89,6 +285,24 @@ class YearlySplitWeatherReader(WeatherReader):
             if ds['time.year'][0] >= maxyear:
                 break
 
+    # Region subsetting, for readers with a `regionvar` dimension
+
+    def can_subset_regions(self):
+        return hasattr(self, 'regionvar')
+
+    def subset_regions(self, indices):
+        if not hasattr(self, 'all_regions'):
+            self.all_regions = getattr(self, 'regions', None)
+        self.region_indices = np.asarray(indices, dtype=int)
+        if self.all_regions is not None:
+            self.regions = self.all_regions[self.region_indices]
+
+    def get_region_selection(self):
+        """Returns the `regions` argument for `netcdfs.load_netcdf`."""
+        if self.region_indices is None:
+            return None
+        return {self.regionvar: self.region_indices}
+
     # Random access
 
     def file_for_year(self, year):
@@ -108,13 +322,7 @@ class YearlySplitWeatherReader(WeatherReader):
         if "%v" not in template:
             return template % (year)
 
-        options = glob.glob(template.replace("%v", "*") % (year))
-        if len(options) == 0:
-            return template.replace("%v", "unknown") % (year)
-
-        options = [os.path.splitext(os.path.basename(s))[0] for s in options]
-        options.sort(key=lambda s: list(map(int, s.split('.'))))
-        return template.replace("%v", options[-1]) % (year)
+        return listings.find_templated(template, year)
 
     @staticmethod
     def precheck(template, year1, variables):
@@ -123,11 +331,18 @@ class YearlySplitWeatherReader(WeatherReader):
 class ConversionWeatherReader(WeatherReader):
     """Wraps another weather reader, applying conversion to its weather."""
 
-    def __init__(self, reader, time_conversion, ds_conversion):
+    def __init__(self, reader, time_conversion, ds_conversion, preserves_regions=True):
         super(ConversionWeatherReader, self).__init__(reader.version, reader.units, reader.time_units)
         self.reader = reader
         self.time_conversion = time_conversion
         self.ds_conversion = ds_conversion
+        self.preserves_regions = preserves_regions # False if ds_conversion changes the regions
+
+    def can_subset_regions(self):
+        return self.preserves_regions and self.reader.can_subset_regions()
+
+    def subset_regions(self, indices):
+        self.reader.subset_regions(indices)
 
     def get_times(self):
         """Returns a list of all times available."""
@@ -180,10 +395,22 @@ class RegionReorderWeatherReader(WeatherReader):
         mapping = {} ## mapping maps from region to index in observed_regions
         for ii in range(len(observed_regions)):
             mapping[''.join(observed_regions[ii])] = ii
-            
-        self.reorder = np.array([mapping[region] for region in desired_regions])
+
+        self.set_reorder(np.array([mapping[region] for region in desired_regions]), len(observed_regions))
         self.reordered_regions = desired_regions
 
+        # Time spent reordering, reported separately from reading
+        self.reorder_count = 0
+        self.reorder_time = 0.
+
+    def set_reorder(self, reorder, numobserved):
+        """Set the take-index from the observed regions to the desired order.
+
+        If the desired order is the observed order, reordering is skipped.
+        """
+        self.reorder = reorder
+        self.is_identity = len(reorder) == numobserved and np.array_equal(reorder, np.arange(numobserved))
+
     def get_times(self):
         """Returns a list of all times available."""
         return self.reader.get_times()
@@ -192,6 +419,21 @@ class RegionReorderWeatherReader(WeatherReader):
         """Returns a list of all regions available."""
         return self.reordered_regions
 
+    def can_subset_regions(self):
+        return self.reader.can_subset_regions()
+
+    def subset_regions(self, indices):
+        if not hasattr(self, 'all_reorder'):
+            self.all_reorder = self.reorder
+            self.all_reordered_regions = self.reordered_regions
+
+        # Read the underlying regions in file order, then reorder as before
+        observed = self.all_reorder[indices]
+        sortedobserved = np.sort(observed)
+        self.reader.subset_regions(sortedobserved)
+        self.set_reorder(np.searchsorted(sortedobserved, observed), len(sortedobserved))
+        self.reordered_regions = [self.all_reordered_regions[ii] for ii in indices]
+
     def get_years(self):
         return self.reader.get_years()
 
@@ -217,37 +459,43 @@ class RegionReorderWeatherReader(WeatherReader):
         return self.reorder_regions(ds)
 
     def reorder_regions(self, ds):
-        newvars = {}
-        for var in ds.variables:
-            if var in [self.timevar, 'region']:
-                continue
-            #newds[var] = ds[var] # Automatically reordered
-            # Don't use automatic reordering: too slow later (XXX: is this true?)
-            try:
-                if len(ds[var].dims) == 1:
-                    if 'region' not in ds[var].dims:
-                        newvars[var] = ds[var]
-                    else:
-                        newvars[var] = (['region'], ds[var].values[self.reorder])
-                elif len(ds[var].dims) == 2:
-                    if ds[var].dims.index(self.timevar) == 0:
-                        newvars[var] = ([self.timevar, 'region'], ds[var].values[:, self.reorder])
-                    else:
-                        newvars[var] = (['region', self.timevar], ds[var].values[self.reorder, :])
-                else:
-                    tindex = list(ds[var].dims).index('region')
-                    indices = [slice(None)] * len(ds[var].dims)
-                    indices[tindex] = self.reorder
-                    newvars[var] = (ds[var].dims, ds[var].values[tuple(indices)])
-            except Exception as ex:
-                print(("Failed to reorder %s for %s" % (var, self.reader)))
-                raise
-
-        newds = xr.Dataset(newvars, coords={self.timevar: ds[self.timevar], 'region': ds.region[self.reorder]})
-        newds.load()
+        """Return `ds` with its regions in the desired order.
 
+        Each variable is reordered with a single `take` along its
+        region axis; if the regions are already in order, `ds` is
+        returned without copying.
+        """
+        time0 = time.perf_counter()
+        if self.is_identity:
+            newds = ds.load()
+        else:
+            newvars = {}
+            for var in ds.variables:
+                if var in [self.timevar, 'region']:
+                    continue
+                dims = ds[var].dims
+                if 'region' not in dims:
+                    newvars[var] = ds[var]
+                    continue
+                try:
+                    newvars[var] = (dims, np.take(ds[var].values, self.reorder, axis=dims.index('region')))
+                except Exception as ex:
+                    print(("Failed to reorder %s for %s" % (var, self.reader)))
+                    raise
+
+            newds = xr.Dataset(newvars, coords={self.timevar: ds[self.timevar], 'region': ds.region.values[self.reorder]})
+            newds.load()
+
+        self.reorder_count += 1
+        self.reorder_time += time.perf_counter() - time0
         return newds
 
+    def report(self):
+        """Print the time spent reordering regions."""
+        if self.reorder_count > 0:
+            print("Region reorder %s: %d datasets in %.2f s%s." % (self.reader.__class__.__name__, self.reorder_count, self.reorder_time,
+                                                                  " (already in order)" if self.is_identity else ""))
+
 class RenameReader(WeatherReader):
     """Wraps another weatherReader, renaming all variables."""
     def __init__(self, reader, renamer):
@@ -257,6 +505,12 @@ class RenameReader(WeatherReader):
         if isinstance(self.renamer, str):
             assert len(self.reader.get_dimension()) == 1
 
+    def can_subset_regions(self):
+        return self.reader.can_subset_regions()
+
+    def subset_regions(self, indices):
+        self.reader.subset_regions(indices)
+
     def get_times(self):
         """Returns a list of all times available."""
         return self.reader.get_times()
@@ -305,11 +559,21 @@ class HistoricalCycleReader(WeatherReader):
         super(HistoricalCycleReader, self).__init__(reader.version, reader.units, reader.time_units)
         self.reader = reader
         self.futurereader = futurereader
+        self.yearcache = YearCache(reader.__class__.__name__ + ' histclim')
 
     def get_times(self):
         """Returns a list of all times available."""
         return self.futurereader.get_times()
 
+    def can_subset_regions(self):
+        return self.reader.can_subset_regions() and self.futurereader.can_subset_regions()
+
+    def subset_regions(self, indices):
+        self.reader.subset_regions(indices)
+        if self.futurereader is not self.reader:
+            self.futurereader.subset_regions(indices)
+        self.yearcache.clear()
+
     def get_years(self):
         return self.futurereader.get_years()
 
@@ -333,16 +597,23 @@ class HistoricalCycleReader(WeatherReader):
 
         if fromstart < len(histyears):
             if year <= histyears[-1]:
-                return self.reader.read_year(histyears[fromstart]).rename(renames)
+                return self.read_histyear(histyears[fromstart]).rename(renames)
             else:
-                ds = self.reader.read_year(histyears[fromstart]).rename(renames)
+                ds = self.read_histyear(histyears[fromstart]).rename(renames)
         else:
-            ds = self.reader.read_year(histyears[-(fromstart - len(histyears) + 2)]).rename(renames)
+            ds = self.read_histyear(histyears[-(fromstart - len(histyears) + 2)]).rename(renames)
 
         ds['yyyyddd'].values = ds['yyyyddd'].values % 1000 + year * 1000
         ds['time'].values = pd.date_range('%d-01-01' % year, periods=365)
         return ds
 
+    def read_histyear(self, histyear):
+        """Read a year of the historical record, through the year cache."""
+        return self.yearcache.get(histyear, lambda: self.reader.read_year(histyear))
+
+    def report(self):
+        self.yearcache.report()
+
 class MapReader(WeatherReader):
     """Applies a function to all combinations of component readers."""
     def __init__(self, name, unit, func, *readers):
@@ -358,6 +629,13 @@ class MapReader(WeatherReader):
         """Returns a list of all times available."""
         return self.readers[0].get_times()
 
+    def can_subset_regions(self):
+        return all(reader.can_subset_regions() for reader in self.readers)
+
+    def subset_regions(self, indices):
+        for reader in self.readers:
+            reader.subset_regions(indices)
+
     def get_years(self):
         return self.readers[0].get_years()
 
@@ -412,6 +690,13 @@ class FakeRepeaterReader(WeatherReader):
     def get_dimension(self):
         return self.reader.get_dimension()
 
+    def can_subset_regions(self):
+        return self.reader.can_subset_regions() and self.source_fakeweather is self
+
+    def subset_regions(self, indices):
+        self.reader.subset_regions(indices)
+        self.saved_ds = None
+
     def read_iterator(self):
         """Yields an xarray Dataset in whatever chunks are convenient."""
         for year in self.get_years():
@@ -429,3 +714,11 @@ class FakeRepeaterReader(WeatherReader):
             self.saved_ds = self.reader.read_year(self.get_years()[0])
         return self.saved_ds
         
+
+def iterate_wrapped(reader):
+    """Yield `reader` and every reader that it wraps."""
+    yield reader
+    subreaders = [getattr(reader, attr) for attr in ['reader', 'source', 'monthlyreader'] if hasattr(reader, attr)]
+    for subreader in subreaders + list(getattr(reader, 'readers', [])):
+        if isinstance(subreader, WeatherReader):
+            yield from iterate_wrapped(subreader)
@@ -8,17 +8,26 @@ from . import netcdfs
 from .reader import WeatherReader, YearlySplitWeatherReader
 
 class YearlyWeatherReader(WeatherReader):
-    """Exposes yearly weather data, with one file per GCM."""
+    """Exposes yearly weather data, with one file per GCM.
+
+    The file is loaded on first use and kept in memory, along with a
+    mapping from each year to its position, so `read_year` selects a
+    single year directly rather than iterating through the file.
+    """
 
     def __init__(self, filepath, *variables, **kwargs):
         self.filepath = filepath
         self.variables = variables
         self.timevar = kwargs.get('timevar', 'time')
 
+        self.ds = None # loaded by get_dataset
+        self.yearindex = None # {year: index along timevar}
+        self.region_indices = None # if not None, only provide these regions
+
         version, units = netcdfs.readmeta(filepath, variables[0])
 
-        regionvar = kwargs.get('regionvar', 'hierid')
-        self.regions = netcdfs.readncdf_single(filepath, regionvar, allow_missing=True) # Is None if organized by SHAPENUM
+        self.regionvar = kwargs.get('regionvar', 'hierid')
+        self.regions = netcdfs.readncdf_single(filepath, self.regionvar, allow_missing=True) # Is None if organized by SHAPENUM
         super(YearlyWeatherReader, self).__init__(version, units, 'year')
 
     def get_times(self):
@@ -34,19 +43,48 @@ class YearlyWeatherReader(WeatherReader):
     def get_dimension(self):
         return self.variables
 
+    def can_subset_regions(self):
+        return True
+
+    def subset_regions(self, indices):
+        if not hasattr(self, 'all_regions'):
+            self.all_regions = self.regions
+        self.region_indices = np.asarray(indices, dtype=int)
+        if self.all_regions is not None:
+            self.regions = self.all_regions[self.region_indices]
+        self.ds = None # reload with the new regions
+
+    def get_dataset(self):
+        """Return the full dataset, loading it and indexing its years on first use."""
+        if self.ds is None:
+            ds = netcdfs.load_netcdf(self.filepath, variables=list(self.variables) + [self.regionvar, self.timevar])
+            try:
+                years = ds[self.timevar].dt.year.values
+            except (AttributeError, TypeError):
+                years = ds[self.timevar].values # already years
+            self.yearindex = {int(year): ii for ii, year in enumerate(years)}
+            if self.region_indices is not None:
+                regiondims = [dim for dim in ds[self.variables[0]].dims if dim != self.timevar]
+                ds = ds.isel({regiondims[0]: self.region_indices})
+            self.ds = ds
+
+        return self.ds
+
     def read_iterator(self):
-        ds = netcdfs.load_netcdf(self.filepath)
-        years = self.get_times()
-
-        for ii in range(len(years)):
-            yeards = ds[{self.timevar: ii}]
-            if self.timevar != 'time':
-                yeards = yeards.rename({self.timevar: 'time'})
-                if self.timevar == 'year':
-                    yeards['time'] = pd.to_datetime(["%d-01-01" % yeards['time']])
-                    for variable in self.variables:
-                        yeards[variable] = yeards[variable].expand_dims('time', 0)
-            yield yeards
+        ds = self.get_dataset()
+        for ii in range(len(ds[self.timevar])):
+            yield self.prepare_year(ds, ii)
+
+    def prepare_year(self, ds, ii):
+        """Return the dataset for the `ii`-th time step."""
+        yeards = ds[{self.timevar: ii}]
+        if self.timevar != 'time':
+            yeards = yeards.rename({self.timevar: 'time'})
+            if self.timevar == 'year':
+                yeards['time'] = pd.to_datetime(["%d-01-01" % yeards['time']])
+                for variable in self.variables:
+                    yeards[variable] = yeards[variable].expand_dims('time', 0)
+        return yeards
 
     def read_iterator_to(self, maxyear):
         for ds in self.read_iterator():
@@ -55,9 +93,10 @@ class YearlyWeatherReader(WeatherReader):
             yield ds
 
     def read_year(self, year):
-        for ds in self.read_iterator():
-            if ds['time.year'][0] == year: # always a single value anyway
-                return ds
+        ds = self.get_dataset()
+        if int(year) not in self.yearindex:
+            return None
+        return self.prepare_year(ds, self.yearindex[int(year)])
 
     def __str__(self):
         return "%s: %s" % (self.filepath, ','.join(self.variables))
@@ -91,7 +130,7 @@ class YearlyDayLikeWeatherReader(YearlySplitWeatherReader):
         return self.prepare_ds(self.file_for_year(year), year)
 
     def prepare_ds(self, filename, year):
-        ds = netcdfs.load_netcdf(filename)
+        ds = netcdfs.load_netcdf(filename, variables=list(self.variable) + [self.regionvar], regions=self.get_region_selection())
         ds = ds.rename({self.regionvar: 'region'})
         ds['time'] = np.array([year])
         ds.set_coords(['time'])
@@ -99,21 +138,33 @@ class YearlyDayLikeWeatherReader(YearlySplitWeatherReader):
         return ds
 
 class RandomYearlyAccess(object):
+    """Provides the data for any year of a reader, keeping the most recent year.
+
+    Covariators request the same year for every region in turn, so
+    the last year read, and each of its variables as an array across
+    regions, are saved for reuse.
+    """
     def __init__(self, yearlyreader):
         self.yearlyreader = yearlyreader
 
-        self.current_iterator = None
+        self.current_year = None
+        self.current_ds = None
+        self.current_values = {} # {variable: array over regions}
 
     def get_year(self, year):
-        if self.current_iterator is None or year < self.current_year:
-            self.current_iterator = self.yearlyreader.read_iterator()
-            self.current_year = None
-            self.current_ds = None
-
-        while self.current_year is None or year > self.current_year:
-            ds = next(self.current_iterator) # If run off the end, allow exception
-            self.current_year = ds['time.year'][0]
+        if year != self.current_year:
+            ds = self.yearlyreader.read_year(year)
+            if ds is None:
+                raise ValueError("Year %s not available from %s" % (str(year), str(self.yearlyreader)))
+            self.current_year = year
             self.current_ds = ds
+            self.current_values = {}
 
-        assert year == self.current_year
         return self.current_ds
+
+    def get_values(self, year, variable):
+        """Return the values of `variable` in `year`, as an array across regions."""
+        ds = self.get_year(year)
+        if variable not in self.current_values:
+            self.current_values[variable] = np.asarray(ds[variable].values).reshape(-1)
+        return self.current_values[variable]
@@ -16,9 +16,88 @@ the regions/hierarchy.csv file in the shared directory.
 """
 
 import csv
+from collections import OrderedDict
+import numpy as np
+import scipy.sparse
 from impactlab_tools.utils import files
 import helpers.header as headre
 
+class RegionIndex(list):
+    """An immutable, ordered list of regions with constant-time lookups.
+
+    Behaves as the list of region ids it is constructed from, but
+    `index` uses a precomputed {region: position} mapping rather than
+    a linear scan, which matters with ~24k impact regions. Instances
+    cannot be modified after construction, so they may be shared
+    between bundles, covariators, weights, and writers.
+
+    Parameters
+    ----------
+    regions : Iterable of str
+        The region ids, in order.
+    """
+    def __init__(self, regions):
+        super(RegionIndex, self).__init__(regions)
+        self.positions = {}
+        for ii, region in enumerate(self):
+            if region not in self.positions: # list.index returns the first
+                self.positions[region] = ii
+
+    def index(self, region, *args):
+        """Return the position of `region`, raising ValueError if missing."""
+        if args:
+            return super(RegionIndex, self).index(region, *args)
+        try:
+            return self.positions[region]
+        except KeyError:
+            raise ValueError("%s is not in the region index" % str(region))
+
+    def indices(self, regions):
+        """Return an integer array of the positions of each of `regions`."""
+        return np.array([self.index(region) for region in regions], dtype=int)
+
+    def get_indices_dict(self, regions=None):
+        """Return {region: position} for `regions` (or all regions)."""
+        if regions is None:
+            return dict(self.positions)
+        return {region: self.index(region) for region in regions}
+
+    def __contains__(self, region):
+        return region in self.positions
+
+    def __reduce__(self):
+        return (RegionIndex, (list(self),))
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("RegionIndex objects cannot be modified.")
+
+    append = extend = insert = remove = pop = clear = sort = reverse = _immutable
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _immutable
+
+    @staticmethod
+    def of(regions):
+        """Return `regions` as a RegionIndex, reusing a shared instance where possible.
+
+        Instances are cached by region ordering, so each hierarchy and
+        ordering is only indexed once per process. Only the
+        `region_index_cache_size` most recently used orderings are kept.
+        """
+        if isinstance(regions, RegionIndex):
+            return regions
+        key = tuple(regions)
+        if key in region_index_cache:
+            region_index_cache.move_to_end(key)
+            return region_index_cache[key]
+
+        region_index = RegionIndex(key)
+        region_index_cache[key] = region_index
+        while len(region_index_cache) > region_index_cache_size:
+            region_index_cache.popitem(last=False)
+        return region_index
+
+region_index_cache = OrderedDict() # {tuple of regions: RegionIndex}, least recently used first
+region_index_cache_size = 16
+
 
 def contains_region(parents, candidate, hierid_df):
     """True if parents region is or contains candidate region
@@ -65,7 +144,50 @@ def load_regions(hierarchy, dependencies):
     for ii in range(len(mapping)):
         regions.append(mapping[ii + 1])
 
-    return regions
+    return RegionIndex.of(regions)
+
+def country_matrix(regions, weights=None):
+    """Sparse (countries x regions) matrix of weights for country averages.
+
+    Each region is assigned to the country given by the first three
+    characters of its id. Multiplying the matrix by a (regions x N)
+    array gives the (countries x N) weighted averages.
+
+    Parameters
+    ----------
+    regions : sequence of str
+    weights : sequence of float, optional
+        Weight of each region (e.g., its population); equal by
+        default. Countries whose weights sum to 0 are averaged equally.
+
+    Returns
+    -------
+    countries : ndarray of str
+        The countries, sorted.
+    matrix : scipy.sparse.csr_matrix
+    """
+    countries, rows = np.unique([region[:3] for region in regions], return_inverse=True)
+    weights = np.ones(len(regions)) if weights is None else np.asarray(weights, dtype=float)
+
+    totals = np.bincount(rows, weights, minlength=len(countries))
+    weights = np.where(totals[rows] == 0, 1., weights)
+    totals = np.bincount(rows, weights, minlength=len(countries))
+
+    matrix = scipy.sparse.csr_matrix((weights / totals[rows], (rows, np.arange(len(regions)))),
+                                     shape=(len(countries), len(regions)))
+    return countries, matrix
+
+def get_country_matrix(source, regions, get_weights=None):
+    """Return `country_matrix` for `regions`, cached by the name of the weights' `source`.
+
+    `get_weights(regions)` is only called if the matrix is not cached.
+    """
+    key = (source, tuple(regions))
+    if key not in country_matrix_cache:
+        country_matrix_cache[key] = country_matrix(regions, None if get_weights is None else get_weights(regions))
+    return country_matrix_cache[key]
+
+country_matrix_cache = {} # {(source, tuple of regions): (countries, matrix)}
 
 def load_region_attr(filepath, indexcol, valcol, dependencies):
     """Load a column of attributes from an attribute file."""
@@ -78,4 +200,3 @@ def load_region_attr(filepath, indexcol, valcol, dependencies):
             mapping[row[header.index(indexcol)]] = float(row[header.index(valcol)])
 
     return mapping
-
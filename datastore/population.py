@@ -2,7 +2,7 @@ import csv, os
 import numpy as np
 from impactlab_tools.utils import files
 from helpers import header
-from . import spacetime
+from . import spacetime, irregions
 
 use_merged = True
 population_baseline_cache = {} # dict of (year0, year1) => baselinedata
@@ -77,6 +77,7 @@ def population_baseline_data(year0, year1, dependencies):
     return baselinedata
 
 def extend_population_future(baselinedata, year0, year1, regions, model, scenario, dependencies):
+    region_index = irregions.RegionIndex.of(regions)
     popout = np.ones((year1 - year0 + 1, len(regions))) * np.nan
 
     # Fill in the values
@@ -93,7 +94,7 @@ def extend_population_future(baselinedata, year0, year1, regions, model, scenari
     for region, year, value in each_future_population(model, scenario, dependencies):
         if year < year0 or year > year1:
             continue
-        ii = regions.index(region)
+        ii = region_index.index(region)
         popout[year - year0, ii] = value
 
     # Interpolate values by holding constant
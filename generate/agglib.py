@@ -1,5 +1,6 @@
 import csv, os
 import numpy as np
+import scipy.sparse
 from netCDF4 import Dataset
 from . import nc4writer
 from helpers import header
@@ -245,6 +246,73 @@ def get_aggregated_regions(regions):
 
     return originals, prefixes, dependencies
 
+def get_aggregation_matrix(regions, originals, prefixes):
+    """Sparse (aggregated regions x regions) matrix of region membership.
+
+    Entry (ii, jj) is 1 if `regions[jj]` is within the aggregated
+    region `prefixes[ii]`, and 0 otherwise.
+
+    Parameters
+    ----------
+    regions : sequence of str
+        List of IR keys, as passed to `get_aggregated_regions`.
+    originals, prefixes
+        As returned by `get_aggregated_regions`.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+    """
+    region_index = irregions.RegionIndex.of(regions)
+    rows = []
+    cols = []
+    for ii, prefix in enumerate(prefixes):
+        if prefix == '':
+            # Special handling of '', the global region
+            withinii = np.arange(len(regions))
+        else:
+            withinii = region_index.indices(originals[prefix])
+        rows.append(np.full(len(withinii), ii))
+        cols.append(withinii)
+
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    return scipy.sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(prefixes), len(regions)))
+
+def deltamethod_variance(bcde, vcv, out=None, maxbytes=2**27):
+    """Compute the quadratic form b' V b for every year and region.
+
+    Parameters
+    ----------
+    bcde : ndarray
+        Coefficient vectors, as a (coefficient x year x region) array.
+    vcv : ndarray
+        The (coefficient x coefficient) variance-covariance matrix.
+    out : ndarray, optional
+        (year x region) array to fill in; allocated if not given.
+    maxbytes : int, optional
+        Approximate limit on the temporary memory used; years are
+        processed in chunks to stay under it.
+
+    Returns
+    -------
+    ndarray
+        The (year x region) variances. Region-years with any NaN
+        coefficient are NaN.
+    """
+    numcoeffs, numyears, numregions = bcde.shape
+    if out is None:
+        out = np.full((numyears, numregions), np.nan)
+
+    chunkyears = max(1, int(maxbytes // (8 * numcoeffs * max(1, numregions))))
+    for start in range(0, numyears, chunkyears):
+        chunk = bcde[:, start:start + chunkyears, :].reshape(numcoeffs, -1)
+        # sum_ij V_ij b_i b_j, as sum_i b_i (V b)_i
+        variance = np.einsum('ij,ij->j', chunk, np.dot(vcv, chunk))
+        out[start:start + chunkyears, :] = variance.reshape(-1, numregions)
+
+    return out
+
 def combine_results(targetdir, basename, sub_basenames, get_stweights, description, suffix=''):
     writer = nc4writer.create(targetdir, basename + suffix)
 
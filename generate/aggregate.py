@@ -21,10 +21,10 @@ Helper functions are organized in agglib.py, which are also used by
 climateagg.py.
 """
 
-import os, traceback, warnings
+import os, time, traceback, warnings, multiprocessing
 import numpy as np
 from netCDF4 import Dataset
-from . import nc4writer, agglib, checks
+from . import nc4writer, agglib, checks, weightcache
 from datastore import weights
 from impactlab_tools.utils import paralog, files
 import subprocess 
@@ -121,8 +121,55 @@ def main(config, config_name, statman=None):
                 halfweight_aggregate = None
                 halfweight_aggregate_denom = None
 
+    # Configure the weight cache, describing the weights so they can be saved
+    cached_weights.limit_mb = config.get('weight-cache-mb', None)
+    cached_weights.cachedir = config.get('weight-cache-dir', None)
+    for option, halfweight in [('weighting', halfweight_levels), ('levels-weighting', halfweight_levels),
+                               ('aggregate-weighting', halfweight_aggregate), ('aggregate-weighting-numerator', halfweight_aggregate),
+                               ('aggregate-weighting-denominator', halfweight_aggregate_denom)]:
+        if option in config and halfweight is not None and halfweight != weights.HALFWEIGHT_SUMTO1:
+            cached_weights.describe(halfweight, config[option])
+
     ### Generate aggregate and levels files
 
+    context = dict(config=config, statman=statman, regioncount=regioncount, costs_config=costs_config, costs_suffix=costs_suffix,
+                   halfweight_levels=halfweight_levels, halfweight_aggregate=halfweight_aggregate,
+                   halfweight_aggregate_denom=halfweight_aggregate_denom)
+
+    time0 = time.perf_counter()
+    workers = config.get('workers', 1)
+    if workers > 1 and not isinstance(debug_aggregate, str):
+        # Load the weights once, to be shared by the forked workers
+        targets = list(itertargets(config))
+        preload_weights(targets, context)
+
+        global worker_context
+        worker_context = context
+        numfiles = 0
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            for targetfiles, stats in pool.imap_unordered(aggregate_worker, targets):
+                numfiles += targetfiles
+                cached_weights.add_stats(stats)
+        worker_context = None
+    else:
+        numfiles = 0
+        for target in itertargets(config):
+            numfiles += aggregate_targetdir(target, context)
+
+    elapsed = time.perf_counter() - time0
+    print("Aggregated %d files in %.1f s (%.2f files/s)." % (numfiles, elapsed, numfiles / elapsed if elapsed > 0 else 0))
+    cached_weights.report()
+
+def itertargets(config):
+    """Yield the target directories to aggregate, after filtering.
+
+    Yields
+    ------
+    tuple of str
+        The batch, climate scenario, climate model, economic scenario,
+        economic model, target directory, and the directory to write
+        results into.
+    """
     # Find all target directories
     outputdir = config['outputdir']
     for batch, clim_scenario, clim_model, econ_scenario, econ_model, targetdir in agglib.iterresults(outputdir, agglib.make_batchfilter(config), targetdirfilter):
@@ -135,160 +182,272 @@ def main(config, config_name, statman=None):
         # Check if we should process this targetdir
         if not agglib.config_targetdirfilter(clim_scenario, clim_model, econ_scenario, econ_model, targetdir, config):
             continue
+
+        yield batch, clim_scenario, clim_model, econ_scenario, econ_model, targetdir, writetargetdir
+
+def aggregate_targetdir(target, context):
+    """Generate the levels, aggregated, and costs files for a single target directory.
+
+    Parameters
+    ----------
+    target : tuple of str
+        A target directory, as yielded by `itertargets`.
+    context : dict
+        The configuration, status manager, and weighting schemes, as
+        set up by `main`.
+
+    Returns
+    -------
+    int
+        The number of result files for which outputs were produced.
+    """
+    batch, clim_scenario, clim_model, econ_scenario, econ_model, targetdir, writetargetdir = target
+    config = context['config']
+    statman = context['statman']
+    regioncount = context['regioncount']
+    costs_config = context['costs_config']
+    costs_suffix = context['costs_suffix']
+    halfweight_levels = context['halfweight_levels']
+    halfweight_aggregate = context['halfweight_aggregate']
+    halfweight_aggregate_denom = context['halfweight_aggregate_denom']
+    outputdir = config['outputdir']
+
+    print(targetdir)
+    print(econ_model, econ_scenario)
+
+    # Try to claim the directory
+    if not isinstance(debug_aggregate, str) and not statman.claim(writetargetdir) and 'targetdir' not in config:
+        return 0
+
+    # Flag to be set true if could not do a complete aggregation
+    incomplete = False
+    if isinstance(debug_aggregate, str):
+        incomplete = True
+
+    numfiles = 0
+
+    for filename in agglib.listtargetdir(targetdir=targetdir, only=['.nc4'], exclude=[suffix, costs_suffix, levels_suffix], lowprio=['combined']):
         
-        print(targetdir)
-        print(econ_model, econ_scenario)
+        if 'basename' in config:
+            if config['basename'] not in filename[:-4]:
+                continue
+
+        if 'only-farmers' in config:
+            adaptsuffix = agglib.get_farmer_suffix(filename)
+            if adaptsuffix not in config['only-farmers']:
+                continue
+            
+        # This looks like a valid file to consider!
+        print(filename)
 
-        # Try to claim the directory
-        if not isinstance(debug_aggregate, str) and not statman.claim(writetargetdir) and 'targetdir' not in config:
+        # Check if this file is complete
+        variable = config.get('check-variable', 'rebased')
+        if not checks.check_result_100years(os.path.join(targetdir, filename), variable=variable, regioncount=regioncount):
+            print("Incomplete.")
+            incomplete = True
             continue
 
-        # Flag to be set true if could not do a complete aggregation
-        incomplete = False
-        if isinstance(debug_aggregate, str):
+        # Construct the weight arguments, inferring an age cohort if it's used
+        weight_args_levels, weight_args_aggregate, weight_args_aggregate_denom = get_weight_args(config, filename, econ_model, econ_scenario)
+        produced = False # set if any outputs are produced for this file
+
+        # Catch any kind of failure
+        try:
+            # Generate levels (e.g., total deaths)
+            levels_outfilename = None
+            if halfweight_levels:
+                outfilename = fullfile(filename, levels_suffix, config)
+                if not missing_only or not os.path.exists(os.path.join(targetdir, outfilename)) or not checks.check_result_100years(os.path.join(targetdir, outfilename), variable=variable, regioncount=regioncount):
+                    levels_outfilename = outfilename
+
+            # Aggregate impacts
+            aggregated_outfilename = None
+            if halfweight_aggregate:
+                outfilename = fullfile(filename, suffix, config)
+                if isinstance(debug_aggregate, str) or not missing_only or not os.path.exists(os.path.join(targetdir, outfilename)) or not checks.check_result_100years(os.path.join(targetdir, outfilename), variable=variable, regioncount=5665):
+                    aggregated_outfilename = outfilename
+
+            # Produce both from a single pass over the file
+            if levels_outfilename or aggregated_outfilename:
+                make_levels_and_aggregates(targetdir, filename, levels_outfilename, aggregated_outfilename, halfweight_levels, weight_args_levels, halfweight_aggregate, weight_args_aggregate,
+                                           halfweight_denom=halfweight_aggregate_denom, weight_args_denom=weight_args_aggregate_denom, config=config, writetargetdir=writetargetdir)
+                produced = True
+
+            if costs_config is not None:
+                if '-noadapt' not in filename and '-incadapt' not in filename and 'histclim' not in filename and 'indiamerge' not in filename:
+                    # Tries to generate costs every time it finds a 'fulladapt' file. 
+                    outfilename = fullfile(filename, costs_suffix, config)
+                    if not missing_only or not os.path.exists(os.path.join(targetdir, outfilename)) or not checks.check_result_100years(os.path.join(targetdir, outfilename), variable=costs_config.get('check-variable-costs', None)):
+                        if '-combined' in filename:
+                            # Trying to obtain a combined cost file from age files. 
+                            # Look for age-specific costs
+                            agegroups = ['young', 'older', 'oldest']
+                            basenames = [filename[:-4].replace('-combined', '-' + agegroup + '-costs') for agegroup in agegroups]
+                            hasall = True
+                            for basename in basenames:
+                                if not os.path.exists(os.path.join(targetdir, basename + '.nc4')):
+                                    print("Missing " + os.path.join(targetdir, basename + '.nc4'))
+                                    hasall = False
+                                    break
+
+                            if hasall:
+                                # Combine costs across age-groups
+                                print("Has all component costs")
+                                get_stweights = [lambda year0, year1: halfweight_levels.load(year0, year1, econ_model, econ_scenario, 'age0-4', shareonly=True), lambda year0, year1: halfweight_levels.load(year0, year1, econ_model, econ_scenario, 'age5-64', shareonly=True), lambda year0, year1: halfweight_levels.load(year0, year1, econ_model, econ_scenario, 'age65+', shareonly=True)]
+                                agglib.combine_results(targetdir, filename[:-4] + costs_suffix, basenames, get_stweights, "Combined costs across age-groups for " + filename.replace('-combined.nc4', ''))
+                        else:
+                            costs_suffix = '-' + str(costs_config['infix']) + costs_suffix if 'infix' in costs_config else costs_suffix 
+                            args = agglib.interpret_costs_args(costs_config=costs_config,
+                                                              outputdir=outputdir,
+                                                              targetdir=targetdir,
+                                                              filename=filename,
+                                                              batch=batch,
+                                                              clim_scenario=clim_scenario,
+                                                              clim_model=clim_model,
+                                                              econ_model=econ_model,
+                                                              econ_scenario=econ_scenario,
+                                                              costs_suffix=costs_suffix)
+
+                            # Call the adaptation costs system
+                            command = costs_config.get('command-prefix').split() + args
+                            print(' '.join(command))
+                            subprocess.run(command)
+
+
+                    # Levels of costs
+                    levels_outfilename = None
+                    if halfweight_levels:
+                        outfilename = fullfile(filename, costs_suffix + levels_suffix, config)
+                        if not missing_only or not os.path.exists(os.path.join(targetdir, outfilename)):
+                            levels_outfilename = outfilename
+
+                    # Aggregate costs
+                    aggregated_outfilename = None
+                    outfilename = fullfile(filename, costs_suffix + suffix, config)
+                    if not missing_only or not os.path.exists(os.path.join(targetdir, outfilename)) or not checks.check_result_100years(os.path.join(targetdir, outfilename), variable=costs_config.get('check-variable-costs', None), regioncount=5665):
+                        aggregated_outfilename = outfilename
+
+                    if levels_outfilename or aggregated_outfilename:
+                        make_costs_levels_and_aggregates(targetdir, fullfile(filename, costs_suffix, config), levels_outfilename, aggregated_outfilename, halfweight_levels, weight_args_levels, halfweight_aggregate, weight_args_aggregate,
+                                                         halfweight_denom=halfweight_aggregate_denom, weight_args_denom=weight_args_aggregate_denom, config=config, writetargetdir=writetargetdir)
+                        produced = True
+                elif 'indiamerge' in filename:
+                    # Just aggregate the costs for indiamerge file
+                    costsfilename = filename[:-4].replace('combined', 'combined-costs')
+
+                    # Levels of costs
+                    levels_outfilename = costsfilename + levels_suffix + '.nc4'
+                    if missing_only and os.path.exists(os.path.join(targetdir, levels_outfilename)):
+                        levels_outfilename = None
+
+                    # Aggregate costs
+                    aggregated_outfilename = costsfilename + suffix + '.nc4'
+                    if missing_only and os.path.exists(os.path.join(targetdir, aggregated_outfilename)):
+                        aggregated_outfilename = None
+
+                    if levels_outfilename or aggregated_outfilename:
+                        make_costs_levels_and_aggregates(targetdir, costsfilename + '.nc4', levels_outfilename, aggregated_outfilename, halfweight_levels, weight_args_levels, halfweight_aggregate, weight_args_aggregate,
+                                                         halfweight_denom=halfweight_aggregate_denom, weight_args_denom=weight_args_aggregate_denom, config=config, writetargetdir=writetargetdir)
+                        produced = True
+
+        # On exception, report it and continue
+        except Exception as ex:
+            print("Failed.")
+            traceback.print_exc()
             incomplete = True
+        else:
+            if produced:
+                numfiles += 1
+
+    # Release the claim on this directory
+    statman.release(writetargetdir, "Incomplete" if incomplete else "Complete")
+    # Make sure all produced files are read-writable by the group
+    os.system("chmod g+rw --quiet " + os.path.join(targetdir, "*"))
+
+    return numfiles
+
+## Shared state for aggregation workers, inherited when they are forked
+worker_context = None
+
+def aggregate_worker(target):
+    """Aggregate `target` in a worker process, returning the number of files and the weight cache statistics."""
+    cached_weights.reset_stats()
+    numfiles = aggregate_targetdir(target, worker_context)
+    return numfiles, cached_weights.stats
+
+def get_weight_args(config, filename, econ_model, econ_scenario):
+    """Return the weight arguments for the levels, aggregate, and aggregate denominator weights of `filename`.
 
-        # Try to process every NetCDF file to aggregate in targetdir
-        for filename in agglib.listtargetdir(targetdir=targetdir, only=['.nc4'], exclude=[suffix, costs_suffix, levels_suffix], lowprio=['combined']):
+    Age cohort weights use the age group inferred from the filename.
+    """
+    if 'weighting' in config and config['weighting'] == 'agecohorts':
+        weight_args_levels = (econ_model, econ_scenario, agecohorts.age_from_filename(filename) if 'IND_' not in filename else 'total')
+        weight_args_aggregate = weight_args_levels
+        weight_args_aggregate_denom = None
+    else:
+        if 'levels-weighting' in config and config['levels-weighting'] == 'agecohorts':
+            weight_args_levels = (econ_model, econ_scenario, agecohorts.age_from_filename(filename) if 'IND_' not in filename else 'total')
+        else:
+            weight_args_levels = (econ_model, econ_scenario)
             
-            if 'basename' in config:
-                if config['basename'] not in filename[:-4]:
-                    continue
-
-            if 'only-farmers' in config:
-                adaptsuffix = agglib.get_farmer_suffix(filename)
-                if adaptsuffix not in config['only-farmers']:
-                    continue
+        if 'aggregate-weighting' in config and config['aggregate-weighting'] == 'agecohorts':
+            weight_args_aggregate = (econ_model, econ_scenario, agecohorts.age_from_filename(filename) if 'IND_' not in filename else 'total')
+            weight_args_aggregate_denom = None
+        else:
+            if 'aggregate-weighting-numerator' in config and config['aggregate-weighting-numerator'] == 'agecohorts':
+                weight_args_aggregate = (econ_model, econ_scenario, agecohorts.age_from_filename(filename) if 'IND_' not in filename else 'total')
+            else:
+                weight_args_aggregate = (econ_model, econ_scenario)
                 
-            # This looks like a valid file to consider!
-            print(filename)
-
-            # Check if this file is complete
-            variable = config.get('check-variable', 'rebased')
-            if not checks.check_result_100years(os.path.join(targetdir, filename), variable=variable, regioncount=regioncount):
-                print("Incomplete.")
-                incomplete = True
-                continue
-
-            # Construct the weight arguments, inferring an age cohort if it's used
-            if 'weighting' in config and config['weighting'] == 'agecohorts':
-                weight_args_levels = (econ_model, econ_scenario, agecohorts.age_from_filename(filename) if 'IND_' not in filename else 'total')
-                weight_args_aggregate = weight_args_levels
-                weight_args_aggregate_denom = None
+            if 'aggregate-weighting-denominator' in config and config['aggregate-weighting-denominator'] == 'agecohorts':
+                weight_args_aggregate_denom = (econ_model, econ_scenario, agecohorts.age_from_filename(filename) if 'IND_' not in filename else 'total')
             else:
-                if 'levels-weighting' in config and config['levels-weighting'] == 'agecohorts':
-                    weight_args_levels = (econ_model, econ_scenario, agecohorts.age_from_filename(filename) if 'IND_' not in filename else 'total')
-                else:
-                    weight_args_levels = (econ_model, econ_scenario)
-                    
-                if 'aggregate-weighting' in config and config['aggregate-weighting'] == 'agecohorts':
-                    weight_args_aggregate = (econ_model, econ_scenario, agecohorts.age_from_filename(filename) if 'IND_' not in filename else 'total')
-                    weight_args_aggregate_denom = None
-                else:
-                    if 'aggregate-weighting-numerator' in config and config['aggregate-weighting-numerator'] == 'agecohorts':
-                        weight_args_aggregate = (econ_model, econ_scenario, agecohorts.age_from_filename(filename) if 'IND_' not in filename else 'total')
-                    else:
-                        weight_args_aggregate = (econ_model, econ_scenario)
-                        
-                    if 'aggregate-weighting-denominator' in config and config['aggregate-weighting-denominator'] == 'agecohorts':
-                        weight_args_aggregate_denom = (econ_model, econ_scenario, agecohorts.age_from_filename(filename) if 'IND_' not in filename else 'total')
-                    else:
-                        weight_args_aggregate_denom = (econ_model, econ_scenario)
+                weight_args_aggregate_denom = (econ_model, econ_scenario)
 
-            # Catch any kind of failure
-            try:
-                # Generate levels (e.g., total deaths)
-                if halfweight_levels:
-                    outfilename = fullfile(filename, levels_suffix, config)
-                    if not missing_only or not checks.check_result_100years(os.path.join(targetdir, outfilename), variable=variable, regioncount=regioncount) or not os.path.exists(os.path.join(targetdir, outfilename)):
-                        make_levels(targetdir, filename, outfilename, halfweight_levels, weight_args_levels, config=config, writetargetdir=writetargetdir)
-
-                # Aggregate impacts
-                if halfweight_aggregate:
-                    outfilename = fullfile(filename, suffix, config)
-                    if isinstance(debug_aggregate, str) or not missing_only or not checks.check_result_100years(os.path.join(targetdir, outfilename), variable=variable, regioncount=5665) or not os.path.exists(os.path.join(targetdir, outfilename)):
-                        make_aggregates(targetdir, filename, outfilename, halfweight_aggregate, weight_args_aggregate, halfweight_denom=halfweight_aggregate_denom, weight_args_denom=weight_args_aggregate_denom, config=config, writetargetdir=writetargetdir)
-
-                if costs_config is not None:
-                    if '-noadapt' not in filename and '-incadapt' not in filename and 'histclim' not in filename and 'indiamerge' not in filename:
-                        # Tries to generate costs every time it finds a 'fulladapt' file. 
-                        outfilename = fullfile(filename, costs_suffix, config)
-                        if not missing_only or not os.path.exists(os.path.join(targetdir, outfilename)) or not checks.check_result_100years(os.path.join(targetdir, outfilename), variable=costs_config.get('check-variable-costs', None)):
-                            if '-combined' in filename:
-                                # Trying to obtain a combined cost file from age files. 
-                                # Look for age-specific costs
-                                agegroups = ['young', 'older', 'oldest']
-                                basenames = [filename[:-4].replace('-combined', '-' + agegroup + '-costs') for agegroup in agegroups]
-                                hasall = True
-                                for basename in basenames:
-                                    if not os.path.exists(os.path.join(targetdir, basename + '.nc4')):
-                                        print("Missing " + os.path.join(targetdir, basename + '.nc4'))
-                                        hasall = False
-                                        break
-
-                                if hasall:
-                                    # Combine costs across age-groups
-                                    print("Has all component costs")
-                                    get_stweights = [lambda year0, year1: halfweight_levels.load(year0, year1, econ_model, econ_scenario, 'age0-4', shareonly=True), lambda year0, year1: halfweight_levels.load(year0, year1, econ_model, econ_scenario, 'age5-64', shareonly=True), lambda year0, year1: halfweight_levels.load(year0, year1, econ_model, econ_scenario, 'age65+', shareonly=True)]
-                                    agglib.combine_results(targetdir, filename[:-4] + costs_suffix, basenames, get_stweights, "Combined costs across age-groups for " + filename.replace('-combined.nc4', ''))
-                            else:
-                                costs_suffix = '-' + str(costs_config['infix']) + costs_suffix if 'infix' in costs_config else costs_suffix 
-                                args = agglib.interpret_costs_args(costs_config=costs_config,
-                                                                  outputdir=outputdir,
-                                                                  targetdir=targetdir,
-                                                                  filename=filename,
-                                                                  batch=batch,
-                                                                  clim_scenario=clim_scenario,
-                                                                  clim_model=clim_model,
-                                                                  econ_model=econ_model,
-                                                                  econ_scenario=econ_scenario,
-                                                                  costs_suffix=costs_suffix)
-
-                                # Call the adaptation costs system
-                                command = costs_config.get('command-prefix').split() + args
-                                print(' '.join(command))
-                                subprocess.run(command)
-
-
-                        # Levels of costs
-                        if halfweight_levels:
-                            outfilename = fullfile(filename, costs_suffix + levels_suffix, config)
-                            if not missing_only or not os.path.exists(os.path.join(targetdir, outfilename)):
-                                make_costs_levels(targetdir, fullfile(filename, costs_suffix, config), outfilename, halfweight_levels, weight_args_levels, config=config, writetargetdir=writetargetdir)
-
-                        # Aggregate costs
-                        outfilename = fullfile(filename, costs_suffix + suffix, config)
-                        if not missing_only or not os.path.exists(os.path.join(targetdir, outfilename)) or not checks.check_result_100years(os.path.join(targetdir, outfilename), variable=costs_config.get('check-variable-costs', None), regioncount=5665):
-                            make_costs_aggregate(targetdir, fullfile(filename, costs_suffix, config), outfilename, halfweight_aggregate, weight_args_aggregate, halfweight_denom=halfweight_aggregate_denom, weight_args_denom=weight_args_aggregate_denom, config=config, writetargetdir=writetargetdir)
-                    elif 'indiamerge' in filename:
-                        # Just aggregate the costs for indiamerge file
-
-                        # Levels of costs
-                        outfilename = filename[:-4].replace('combined', 'combined-costs') + levels_suffix + '.nc4'
-                        if not missing_only or not os.path.exists(os.path.join(targetdir, outfilename)):
-                            make_costs_levels(targetdir, filename[:-4].replace('combined', 'combined-costs') + '.nc4', outfilename, halfweight_levels, weight_args_levels, config=config, writetargetdir=writetargetdir)
+    return weight_args_levels, weight_args_aggregate, weight_args_aggregate_denom
 
-                        # Aggregate costs
-                        outfilename = filename[:-4].replace('combined', 'combined-costs') + suffix + '.nc4'
-                        if not missing_only or not os.path.exists(os.path.join(targetdir, outfilename)):
-                            make_costs_aggregate(targetdir, filename[:-4].replace('combined', 'combined-costs') + '.nc4', outfilename, halfweight_aggregate, weight_args_aggregate, halfweight_denom=halfweight_aggregate_denom, weight_args_denom=weight_args_aggregate_denom, config=config, writetargetdir=writetargetdir)
+def preload_weights(targets, context):
+    """Load the weights needed for `targets` into the caches.
+
+    For each economic scenario and model, the weights are loaded
+    according to the result files of the first target directory, along
+    with the aggregation matrices for their regions. Forked workers
+    then share these caches, rather than each loading the same weights.
+    """
+    config = context['config']
+    loaded = set()
+    for batch, clim_scenario, clim_model, econ_scenario, econ_model, targetdir, writetargetdir in targets:
+        if (econ_model, econ_scenario) in loaded:
+            continue
+        loaded.add((econ_model, econ_scenario))
 
-            # On exception, report it and continue
+        for filename in agglib.listtargetdir(targetdir=targetdir, only=['.nc4'], exclude=[suffix, context['costs_suffix'], levels_suffix]):
+            try:
+                with Dataset(os.path.join(targetdir, filename), 'r', format='NETCDF4') as reader:
+                    years = nc4writer.get_years(reader)
+                    regions = reader.variables['regions'][:].tolist()
             except Exception as ex:
-                print("Failed.")
-                traceback.print_exc()
-                incomplete = True
+                print("WARNING: Could not read years and regions from %s." % filename)
+                print(ex)
+                continue
 
-        # Release the claim on this directory
-        statman.release(writetargetdir, "Incomplete" if incomplete else "Complete")
-        # Make sure all produced files are read-writable by the group
-        os.system("chmod g+rw --quiet " + os.path.join(targetdir, "*"))
+            weight_args_levels, weight_args_aggregate, weight_args_aggregate_denom = get_weight_args(config, filename, econ_model, econ_scenario)
+            if context['halfweight_aggregate']:
+                get_cached_aggregation(regions)
+                get_cached_weight(context['halfweight_aggregate'], weight_args_aggregate, years, regions)
+                halfweight_denom = context['halfweight_aggregate_denom']
+                if halfweight_denom and halfweight_denom != weights.HALFWEIGHT_SUMTO1:
+                    get_cached_weight(halfweight_denom, weight_args_aggregate_denom, years, regions)
+            if context['halfweight_levels']:
+                get_cached_weight(context['halfweight_levels'], weight_args_levels, years, regions)
 
-## Cache of loaded weighting data
-# Dictionary of (halfweight, weight_args, minyear, maxyear) => weights
-cached_weights = {}
 
-def get_cached_weight(halfweight, weight_args, years):
+## Cache of loaded weighting data, limited by the `weight-cache-mb` option
+# Keys are (halfweight, weight_args, minyear, maxyear[, tuple of regions]) => weights,
+#   and (stweight, tuple of regions) => (years x regions) array
+cached_weights = weightcache.WeightCache()
+
+def get_cached_weight(halfweight, weight_args, years, regions=None):
     """Return a `SpaceTimeData` object of weights with `get_time`, using
     cached values as possible.
 
@@ -300,6 +459,9 @@ def get_cached_weight(halfweight, weight_args, years):
         Additional arguments to the `halfweight.load(y0, y1, ...)` function.
     years : sequence of int
         Years needed to be loaded.
+    regions : sequence of str, optional
+        Regions needed. If given, the weights are materialized for
+        these regions, and may be read from the `weight-cache-dir`.
 
     Returns
     -------
@@ -307,32 +469,120 @@ def get_cached_weight(halfweight, weight_args, years):
         A loaded object, either from the cache or from calling the
         `load` function on `halfweight`
     """
-    global cached_weights
-
     # Get the full set of arguments
     minyear = int(min(years))
     maxyear = int(max(years))
 
-    key = (halfweight, weight_args, minyear, maxyear)
-    # Return the cached object, if available
-    if key in cached_weights:
-        return cached_weights[key]
+    if regions is not None:
+        return cached_weights.get_materialized(halfweight, weight_args, minyear, maxyear, regions)
 
-    # Load weights; this may take a minute
-    print("Loading weights...")
-    stweight = halfweight.load(minyear, maxyear, *weight_args)
-    print("Loaded.")
+    def load():
+        # Load weights; this may take a minute
+        print("Loading weights...")
+        stweight = halfweight.load(minyear, maxyear, *weight_args)
+        print("Loaded.")
+        return stweight
 
-    # Save result to the cache
-    cached_weights[key] = stweight
-    return stweight
+    return cached_weights.get((halfweight, weight_args, minyear, maxyear), load)
 
-def make_aggregates(targetdir, filename, outfilename, halfweight, weight_args, dimensions_template=None, metainfo=None, limityears=None, halfweight_denom=None, weight_args_denom=None, config=None, writetargetdir=None):
-    """Generate aggregate output files.
+## Cache of aggregated regions, for each list of regions
+# Dictionary of tuple of regions => (originals, prefixes, dependencies, matrix)
+cached_aggregations = {}
 
-    Creates a copy of the `targetdir/filename` NetCDF file as
-    `targetdir/outfilename`, with higher-level regions aggregated
-    according to the weights provided by `halfweight`.
+def get_cached_aggregation(regions):
+    """Return the aggregated regions containing `regions`, and their membership matrix.
+
+    Returns
+    -------
+    tuple
+        The `originals`, `prefixes`, and `dependencies` from
+        `agglib.get_aggregated_regions`, and the sparse (prefixes x
+        regions) matrix from `agglib.get_aggregation_matrix`.
+    """
+    key = tuple(regions)
+    if key not in cached_aggregations:
+        originals, prefixes, dependencies = agglib.get_aggregated_regions(regions)
+        matrix = agglib.get_aggregation_matrix(regions, originals, prefixes)
+        cached_aggregations[key] = (originals, prefixes, dependencies, matrix)
+    return cached_aggregations[key]
+
+def get_cached_weight_array(stweight, regions):
+    """Return the weights of `stweight` for all `regions`, as a (years x regions) array.
+
+    Regions with weights for fewer years limit the years of all
+    regions. If every region has a constant weight, the array has a
+    single row.
+    """
+    if isinstance(stweight, weightcache.MaterializedWeights) and stweight.regions == list(regions):
+        return stweight.array
+
+    return cached_weights.get((stweight, tuple(regions)), lambda: weightcache.materialize(stweight, regions))
+
+def aggregate_coefficients(srcvalues, aggmatrix, wws, wws_denom=None, sumto1=False, maxbytes=2**27):
+    """Aggregate the coefficient vectors of a deltamethod file.
+
+    Region-years with any non-finite coefficient are left out of both
+    the numerator and the denominator. Years are processed in chunks,
+    to limit the temporary memory used.
+
+    Parameters
+    ----------
+    srcvalues : ndarray
+        (coefficient x year x region) coefficient vectors.
+    aggmatrix : scipy.sparse matrix
+        (aggregated regions x regions) membership matrix, from
+        `agglib.get_aggregation_matrix`.
+    wws : ndarray
+        (year x region) weights, as from `get_cached_weight_array`.
+    wws_denom : ndarray, optional
+        (year x region) denominator weights; `wws` by default.
+    sumto1 : bool, optional
+        If True, the weighted sums are not divided by a denominator.
+    maxbytes : int, optional
+        Approximate limit on the temporary memory used.
+
+    Returns
+    -------
+    ndarray
+        (coefficient x year x aggregated region) coefficient vectors.
+    """
+    numcoeffs, numyears, numregions = srcvalues.shape
+    if wws_denom is None:
+        wws_denom = wws
+
+    # Clean up bad values
+    rowreal = np.all(np.isfinite(srcvalues), axis=0) # year x region
+    srcvalues = np.nan_to_num(srcvalues, posinf=0, neginf=0)
+
+    coeffvalues = np.zeros((numcoeffs, numyears, aggmatrix.shape[0]))
+    chunkyears = max(1, int(maxbytes // (8 * numcoeffs * max(1, numregions + aggmatrix.shape[0]))))
+    for start in range(0, numyears, chunkyears):
+        end = min(start + chunkyears, numyears)
+        # Weights by year and region, including only complete coefficient vectors
+        chunkwws = wws[start:end] if wws.shape[0] > 1 else wws
+        chunkreal = rowreal[start:end]
+        weighted = (chunkwws * chunkreal)[np.newaxis, :, :] * srcvalues[:, start:end, :]
+
+        # Sum within each aggregated region, for all coefficients and years at once
+        numers = (aggmatrix @ weighted.reshape(-1, numregions).T).T.reshape(numcoeffs, end - start, -1)
+        if sumto1:
+            coeffvalues[:, start:end, :] = numers
+        else:
+            chunkdenom = wws_denom[start:end] if wws_denom.shape[0] > 1 else wws_denom
+            denoms = (aggmatrix @ (chunkdenom * chunkreal).T).T
+            coeffvalues[:, start:end, :] = numers / denoms[np.newaxis, :, :]
+
+    return coeffvalues
+
+def make_levels_and_aggregates(targetdir, filename, levels_outfilename, aggregated_outfilename, halfweight_levels, weight_args_levels, halfweight_aggregate, weight_args_aggregate,
+                               dimensions_template=None, metainfo=None, limityears=None, halfweight_denom=None, weight_args_denom=None, config=None, writetargetdir=None):
+    """Generate levels and aggregate output files in a single pass.
+
+    Reads each variable of the `targetdir/filename` NetCDF file once,
+    and writes both its levels, as `levels_outfilename`, and its
+    aggregated values, as `aggregated_outfilename`. Either output may
+    be skipped by giving None for its filename. See `make_levels` and
+    `make_aggregates` for the calculations.
 
     Handles regular and deltamethod files.
 
@@ -340,16 +590,20 @@ def make_aggregates(targetdir, filename, outfilename, halfweight, weight_args, d
     ----------
     targetdir : str
         path to the target directory
-    writetargetdir: str, optional
-        path to the target directory in which to save aggregated files. If None, targetdir is used. 
     filename : str
         NetCDF filename within the target directory
-    outfilename : str
-        Filename for the resulting output
-    halfweight : `SpaceTimeData`
-        A source for the weights, if the cache misses.
-    weight_args : tuple
-        Additional arguments to the `halfweight.load(y0, y1, ...)` function.
+    levels_outfilename : str or None
+        Filename for the levels output
+    aggregated_outfilename : str or None
+        Filename for the aggregated output
+    halfweight_levels : `SpaceTimeData`
+        A source for the levels weights, if the cache misses.
+    weight_args_levels : tuple
+        Additional arguments to the `halfweight_levels.load(y0, y1, ...)` function.
+    halfweight_aggregate : `SpaceTimeData`
+        A source for the aggregation weights, if the cache misses.
+    weight_args_aggregate : tuple
+        Additional arguments to the `halfweight_aggregate.load(y0, y1, ...)` function.
     dimensions_template : str, optional
         Full path to a NetCDF file from which we want to take the dimensions information
     metainfo : dict, optional
@@ -357,11 +611,13 @@ def make_aggregates(targetdir, filename, outfilename, halfweight, weight_args, d
     limityears : function(sequence of int), optional
         Filters the years extracted before returning.
     halfweight_denom : `SpaceTimeData`, optional
-        An optional different source for denominator weights.
+        An optional different source for aggregation denominator weights.
     weight_args_denom : tuple
         Additional arguments to the `halfweight_denom.load(y0, y1, ...)` function.
     config : dict, optional
         The aggregation configuration dictionary
+    writetargetdir: str, optional
+        path to the target directory in which to save the outputs. If None, targetdir is used.
     """
     # Read the source files
     reader = Dataset(os.path.join(targetdir, filename), 'r', format='NETCDF4')
@@ -370,180 +626,216 @@ def make_aggregates(targetdir, filename, outfilename, halfweight, weight_args, d
     else:
         dimreader = Dataset(dimensions_template, 'r', format='NETCDF4')
 
-    # Set up the writer object
-    outdir = writetargetdir if writetargetdir is not None else targetdir
-    writer = nc4writer.create(outdir, outfilename)
-
     # Extract the years and regions
     readeryears = nc4writer.get_years(dimreader, limityears)
-
     regions = dimreader.variables['regions'][:].tolist()
-    originals, prefixes, dependencies = agglib.get_aggregated_regions(regions)
 
-    # Infer or collect metadata and copy it over
-    if metainfo is None:
-        writer.description = reader.description + " (aggregated)"
-        writer.version = reader.version
-        writer.dependencies = ', '.join(dependencies) + ', ' + reader.version
-        writer.author = reader.author
-    else:
-        writer.description = metainfo['description']
-        writer.version = metainfo['version']
-        writer.dependencies = ', '.join(dependencies) + ', ' + metainfo['version']
-        writer.author = metainfo['author']
-
-    # Set up year and regions variables in result
-    years = nc4writer.make_years_variable(writer)
-    years[:] = readeryears
-
-    nc4writer.make_regions_variable(writer, prefixes, 'aggregated')
-
-    # Collect the weighting objects
-    stweight = get_cached_weight(halfweight, weight_args, years)
-    if halfweight_denom:
-        if halfweight_denom == weights.HALFWEIGHT_SUMTO1: # singleton to force summing to 1
-            stweight_denom = weights.HALFWEIGHT_SUMTO1
-        else:
-            stweight_denom = get_cached_weight(halfweight_denom, weight_args_denom, years)
-    else:
-        stweight_denom = None # Just use the same weight
-
-    # If this is a deltamethod file, collect the VCV and setup in the output
+    # If this is a deltamethod file, collect the VCV
     if 'vcv' in reader.variables:
         vcv = reader.variables['vcv'][:, :]
-        writer.createDimension('coefficient', vcv.shape[0])
-        vcvvar = writer.createVariable('vcv','f4',('coefficient', 'coefficient'))
-        vcvvar[:, :] = vcv
     else:
         vcv = None
 
-    # Convenience mapping from region key to index
-    original_indices = {regions[ii]: ii for ii in range(len(regions))}
+    # Set up the writer objects
+    outdir = writetargetdir if writetargetdir is not None else targetdir
+    levels_writer = None
+    if levels_outfilename is not None:
+        levels_writer = create_writer(outdir, levels_outfilename, reader, metainfo, "(levels)", readeryears, regions, 'regions', vcv)
+        stweight_levels = get_cached_weight(halfweight_levels, weight_args_levels, readeryears, regions)
+
+    aggregated_writer = None
+    if aggregated_outfilename is not None:
+        originals, prefixes, dependencies, aggmatrix = get_cached_aggregation(regions)
+        aggregated_writer = create_writer(outdir, aggregated_outfilename, reader, metainfo, "(aggregated)", readeryears, prefixes, 'aggregated', vcv, dependencies)
+
+        # Collect the weighting objects
+        stweight = get_cached_weight(halfweight_aggregate, weight_args_aggregate, readeryears, regions)
+        if halfweight_denom:
+            if halfweight_denom == weights.HALFWEIGHT_SUMTO1: # singleton to force summing to 1
+                stweight_denom = weights.HALFWEIGHT_SUMTO1
+            else:
+                stweight_denom = get_cached_weight(halfweight_denom, weight_args_denom, readeryears, regions)
+        else:
+            stweight_denom = None # Just use the same weight
 
-    # Iterate through all aggregatable variables
+    # Iterate through all regional variables, reading each once
     for key, variable in agglib.iter_timereg_variables(reader, config=config):
-        dstvalues = np.zeros((len(years), len(prefixes))) # output matrix
-        dstvalues[:] = np.nan
         if vcv is None:
-            srcvalues = variable[:, :]
+            srcvalues = np.ma.filled(variable[:, :], np.nan)
+        else:
+            srcvalues = np.ma.filled(reader.variables[key + '_bcde'][:, :, :], np.nan)
+
+        if levels_writer is not None:
+            dstvalues = np.zeros((len(readeryears), len(regions))) # output matrix
+            dstvalues[:] = np.nan
+            wws = get_cached_weight_array(stweight_levels, regions)
+            if vcv is None:
+                # Multiply each entry by the appropriate weight, limited to the years of both
+                numyears = srcvalues.shape[0] if wws.shape[0] == 1 else min(wws.shape[0], srcvalues.shape[0])
+                dstvalues[:numyears, :] = wws[:numyears] * srcvalues[:numyears]
+            else:
+                # Perform multiplication on BCDE vectors
+                coeffvalues = srcvalues * (wws[:len(readeryears)] if wws.shape[0] > 1 else wws)[np.newaxis, :, :]
 
-            # Clean up bad values
-            realvalues = np.isfinite(srcvalues)
-            srcvalues = np.nan_to_num(srcvalues, copy=False, posinf=0, neginf=0)
-            
-            # Iterates over aggregated regions
-            for ii in range(len(prefixes)):
-                # Setup numerator and demoninator vector across time
-                numers = np.zeros(srcvalues.shape[0])
-                denoms = np.zeros(srcvalues.shape[0])
-
-                # Get the list of regions we want to include in this aggregated region
-                if prefixes[ii] == '':
-                    # Special handling of '', the global region
-                    withinregions = regions
-                else:
-                    withinregions = originals[prefixes[ii]]
+                # Generate the variances for all years and regions
+                agglib.deltamethod_variance(coeffvalues, vcv, out=dstvalues)
 
-                # Add each sub-region to the numerator and denominator
-                for original in withinregions:
-                    wws = np.array(stweight.get_time(original)) # Get vector of weights vs. time
+                # We have to specifically create this, since the key was just the variance version
+                coeffcolumn = levels_writer.createVariable(key + '_bcde', 'f4', ('coefficient', 'year', 'region'))
+                coeffcolumn[:, :, :] = coeffvalues
 
-                    if len(wws.shape) == 1 and wws.shape[0] != srcvalues.shape[0]:
-                        # Shorten to the minimum of the two years
-                        wws = wws[:min(wws.shape[0], srcvalues.shape[0])]
-                        srcvalues = srcvalues[:min(wws.shape[0], srcvalues.shape[0]), :]
-                        numers = numers[:srcvalues.shape[0]]
-                        denoms = denoms[:srcvalues.shape[0]]
+            # Copy the result into the output file
+            agglib.copy_timereg_variable(levels_writer, variable, key, dstvalues, "(levels)", unitchange = lambda unit: config.get('levels-unit'))
 
-                    numers += wws * srcvalues[:, original_indices[original]]
+        if aggregated_writer is not None:
+            dstvalues = np.zeros((len(readeryears), len(prefixes))) # output matrix
+            dstvalues[:] = np.nan
+            if vcv is None:
+                # Clean up bad values; the levels are already computed
+                realvalues = np.isfinite(srcvalues)
+                srcvalues = np.nan_to_num(srcvalues, copy=False, posinf=0, neginf=0)
 
-                    if stweight_denom != weights.HALFWEIGHT_SUMTO1: # wait for sum-to-1
-                        if stweight_denom:
-                            weights_denom = stweight_denom.get_time(original)
-                            denoms += weights_denom * realvalues[:, original_indices[original]]
-                        else:
-                            denoms += wws * realvalues[:, original_indices[original]]
+                # Weights by year and region, limited to the years of both
+                wws = get_cached_weight_array(stweight, regions)
+                numyears = srcvalues.shape[0] if wws.shape[0] == 1 else min(wws.shape[0], srcvalues.shape[0])
+                wws = wws[:numyears]
 
-                # Fill in result
-                if stweight_denom == weights.HALFWEIGHT_SUMTO1: # wait for sum-to-1
-                    dstvalues[:len(numers), ii] = numers
-                else:
-                    dstvalues[:len(numers), ii] = numers / denoms
-        else:
-            # Handle deltamethod files
-            coeffvalues = np.zeros((vcv.shape[0], len(years), len(prefixes)))
-            # Perform aggregation on BCDE vectors
-            srcvalues = reader.variables[key + '_bcde'][:, :, :]
-
-            # Clean up bad values
-            realvalues = np.isfinite(srcvalues)
-            srcvalues = np.nan_to_num(srcvalues, copy=False, posinf=0, neginf=0)
-
-            # Iterates over aggregated regions
-            for ii in range(len(prefixes)):
-                # Setup numerator and demoninator vector across time
-                numers = np.zeros(srcvalues.shape[:2]) # coeff, time
-                denoms = np.zeros(srcvalues.shape[1]) # time
-
-                # Get the list of regions we want to include in this aggregated region
-                if prefixes[ii] == '':
-                    # Special handling of '', the global region
-                    withinregions = regions
-                else:
-                    withinregions = originals[prefixes[ii]]
-
-                # Add each sub-region to the numerator and denominator
-                for original in withinregions:
-                    # Get vector of weights vs. time
-                    wws = stweight.get_time(original)
-                    if stweight_denom != weights.HALFWEIGHT_SUMTO1:
-                        if stweight_denom:
-                            weights_denom = stweight_denom.get_time(original)
-                        else:
-                            weights_denom = wws
-                            
-                    # Handle each year separately
-                    for tt in range(len(years)):
-                        if prefixes[ii] == debug_aggregate and tt == len(years) - 1:
-                            print(original, wws[tt])
-                            print(srcvalues[:, tt, original_indices[original]] * np.all(realvalues[:, tt, original_indices[original]]))
-                        numers[:, tt] += wws[tt] * srcvalues[:, tt, original_indices[original]] * np.all(realvalues[:, tt, original_indices[original]])
-                        if stweight_denom != weights.HALFWEIGHT_SUMTO1: # wait for sum-to-1
-                            if prefixes[ii] == debug_aggregate and tt == len(years) - 1:
-                                print(weights_denom[tt] * np.all(realvalues[:, tt, original_indices[original]]))
-                            denoms[tt] += weights_denom[tt] * np.all(realvalues[:, tt, original_indices[original]])
+                # Sum across all regions within each aggregated region, for all years at once
+                numers = (aggmatrix @ (wws * srcvalues[:numyears]).T).T
 
                 # Fill in result
                 if stweight_denom == weights.HALFWEIGHT_SUMTO1: # wait for sum-to-1
-                    coeffvalues[:, :, ii] = numers
-                    if prefixes[ii] == debug_aggregate:
-                        print("Numerators")
-                        print(numers[:, len(years) - 1])
+                    dstvalues[:numyears, :] = numers
                 else:
-                    for tt in range(len(years)):
-                        coeffvalues[:, tt, ii] = numers[:, tt] / denoms[tt]
-                        if prefixes[ii] == debug_aggregate and tt == len(years) - 1:
-                            print("Numerators / Denominators")
-                            print(numers[:, tt])
-                            print(numers[:, tt] / denoms[tt])
+                    if stweight_denom:
+                        weights_denom = get_cached_weight_array(stweight_denom, regions)[:numyears]
+                    else:
+                        weights_denom = wws
+                    denoms = (aggmatrix @ (weights_denom * realvalues[:numyears]).T).T
+                    dstvalues[:numyears, :] = numers / denoms
+            else:
+                # Perform aggregation on BCDE vectors
+                coeffvalues = aggregate_coefficients(srcvalues, aggmatrix, get_cached_weight_array(stweight, regions),
+                                                     None if stweight_denom is None or stweight_denom == weights.HALFWEIGHT_SUMTO1 else get_cached_weight_array(stweight_denom, regions),
+                                                     sumto1=stweight_denom == weights.HALFWEIGHT_SUMTO1)
+
                 # Now that we have the BCDE vectors, generate the new variance results
-                for tt in range(len(years)):
-                    dstvalues[tt, ii] = vcv.dot(coeffvalues[:, tt, ii]).dot(coeffvalues[:, tt, ii])
-                    if prefixes[ii] == debug_aggregate and tt == len(years) - 1:
-                        print(dstvalues[tt, ii])
+                agglib.deltamethod_variance(coeffvalues, vcv, out=dstvalues)
+
+                if isinstance(debug_aggregate, str) and debug_aggregate in prefixes:
+                    ii = prefixes.index(debug_aggregate)
+                    print("Coefficients")
+                    print(coeffvalues[:, len(readeryears) - 1, ii])
+                    print(dstvalues[len(readeryears) - 1, ii])
 
-            # We have to specifically create this, since the key was just the variance version
-            coeffcolumn = writer.createVariable(key + '_bcde', 'f4', ('coefficient', 'year', 'region'))
-            coeffcolumn[:, :, :] = coeffvalues
+                # We have to specifically create this, since the key was just the variance version
+                coeffcolumn = aggregated_writer.createVariable(key + '_bcde', 'f4', ('coefficient', 'year', 'region'))
+                coeffcolumn[:, :, :] = coeffvalues
 
-        # Copy the result into the output file
-        agglib.copy_timereg_variable(writer, variable, key, dstvalues, "(aggregated)", unitchange = lambda unit: config.get('aggregated-unit'))
+            # Copy the result into the output file
+            agglib.copy_timereg_variable(aggregated_writer, variable, key, dstvalues, "(aggregated)", unitchange = lambda unit: config.get('aggregated-unit'))
 
     # Close all files
     reader.close()
     if dimensions_template is not None:
         dimreader.close()
-    writer.close()
+    if levels_writer is not None:
+        levels_writer.close()
+    if aggregated_writer is not None:
+        aggregated_writer.close()
+
+def create_writer(outdir, outfilename, reader, metainfo, label, readeryears, regions, regionkind, vcv, dependencies=None):
+    """Create an output file, with its metadata, years, regions, and VCV.
+
+    Parameters
+    ----------
+    outdir : str
+    outfilename : str
+    reader : netCDF4.Dataset
+        The source file, from which metadata is copied.
+    metainfo : dict or None
+        Overriding information for attributes; keys `description`, `version`, and `author` used.
+    label : str
+        Added to the description of the source file, like "(levels)".
+    readeryears : sequence of int
+    regions : sequence of str
+    regionkind : str
+        Passed to `nc4writer.make_regions_variable`.
+    vcv : array_like or None
+        The VCV of a deltamethod file.
+    dependencies : sequence of str, optional
+        Dependencies listed before the version of the source, for aggregated files.
+
+    Returns
+    -------
+    netCDF4.Dataset
+    """
+    writer = nc4writer.create(outdir, outfilename)
+
+    # Infer or collect metadata and copy it over
+    prefix = '' if dependencies is None else ', '.join(dependencies) + ', '
+    if metainfo is None:
+        writer.description = reader.description + " " + label
+        writer.version = reader.version
+        writer.dependencies = prefix + reader.version
+        writer.author = reader.author
+    else:
+        writer.description = metainfo['description']
+        writer.version = metainfo['version']
+        writer.dependencies = prefix + metainfo['version']
+        writer.author = metainfo['author']
+
+    # Set up year and regions variables in result
+    years = nc4writer.make_years_variable(writer)
+    years[:] = readeryears
+    nc4writer.make_regions_variable(writer, regions, regionkind)
+
+    # Copy the VCV of deltamethod files
+    if vcv is not None:
+        writer.createDimension('coefficient', vcv.shape[0])
+        vcvvar = writer.createVariable('vcv','f4',('coefficient', 'coefficient'))
+        vcvvar[:, :] = vcv
+
+    return writer
+
+def make_aggregates(targetdir, filename, outfilename, halfweight, weight_args, dimensions_template=None, metainfo=None, limityears=None, halfweight_denom=None, weight_args_denom=None, config=None, writetargetdir=None):
+    """Generate aggregate output files.
+
+    Creates a copy of the `targetdir/filename` NetCDF file as
+    `targetdir/outfilename`, with higher-level regions aggregated
+    according to the weights provided by `halfweight`.
+
+    Handles regular and deltamethod files.
+
+    Parameters
+    ----------
+    targetdir : str
+        path to the target directory
+    writetargetdir: str, optional
+        path to the target directory in which to save aggregated files. If None, targetdir is used. 
+    filename : str
+        NetCDF filename within the target directory
+    outfilename : str
+        Filename for the resulting output
+    halfweight : `SpaceTimeData`
+        A source for the weights, if the cache misses.
+    weight_args : tuple
+        Additional arguments to the `halfweight.load(y0, y1, ...)` function.
+    dimensions_template : str, optional
+        Full path to a NetCDF file from which we want to take the dimensions information
+    metainfo : dict, optional
+        Overriding information for attributes; keys `description`, `version`, and `author` used.
+    limityears : function(sequence of int), optional
+        Filters the years extracted before returning.
+    halfweight_denom : `SpaceTimeData`, optional
+        An optional different source for denominator weights.
+    weight_args_denom : tuple
+        Additional arguments to the `halfweight_denom.load(y0, y1, ...)` function.
+    config : dict, optional
+        The aggregation configuration dictionary
+    """
+    make_levels_and_aggregates(targetdir, filename, None, outfilename, None, None, halfweight, weight_args, dimensions_template=dimensions_template, metainfo=metainfo,
+                               limityears=limityears, halfweight_denom=halfweight_denom, weight_args_denom=weight_args_denom, config=config, writetargetdir=writetargetdir)
 
 def make_costs_aggregate(targetdir, filename, outfilename, halfweight, weight_args, halfweight_denom=None, weight_args_denom=None, config=None, writetargetdir=None):
     """Aggregate adaptation costs (currently only for mortality).
@@ -611,91 +903,8 @@ def make_levels(targetdir, filename, outfilename, halfweight, weight_args, dimen
     config : dict, optional
         The aggregation configuration dictionary
     """
-    # Read the source files
-    reader = Dataset(os.path.join(targetdir, filename), 'r', format='NETCDF4')
-    if dimensions_template is None:
-        dimreader = reader
-    else:
-        dimreader = Dataset(dimensions_template, 'r', format='NETCDF4')
-
-    # Set up the writer object    
-    outdir = writetargetdir if writetargetdir is not None else targetdir
-    writer = nc4writer.create(outdir, outfilename)
-
-    # Extract the years and regions
-    years = nc4writer.make_years_variable(writer)
-    years[:] = nc4writer.get_years(dimreader, limityears)
-
-    regions = dimreader.variables['regions'][:].tolist()
-    nc4writer.make_regions_variable(writer, regions, 'regions')
-
-    # Infer or collect metadata and copy it over
-    if metainfo is None:
-        writer.description = reader.description + " (levels)"
-        writer.version = reader.version
-        writer.dependencies = reader.version
-        writer.author = reader.author
-    else:
-        writer.description = metainfo['description']
-        writer.version = metainfo['version']
-        writer.dependencies = metainfo['version']
-        writer.author = metainfo['author']
-
-    # Construct the weighting object
-    stweight = get_cached_weight(halfweight, weight_args, years)
-
-    # If this is a deltamethod file, collect the VCV and setup in the output
-    if 'vcv' in reader.variables:
-        vcv = reader.variables['vcv'][:, :]
-        writer.createDimension('coefficient', vcv.shape[0])
-        vcvvar = writer.createVariable('vcv','f4',('coefficient', 'coefficient'))
-        vcvvar[:, :] = vcv
-    else:
-        vcv = None
-        
-    # Iterate through all regional variables
-    for key, variable in agglib.iter_timereg_variables(reader, config=config):
-        dstvalues = np.zeros((len(years), len(regions))) # output matrix
-        dstvalues[:] = np.nan
-        if vcv is None:
-            # Multiply each entry by appropriate weight   
-            srcvalues = np.array(variable[:, :])
-                
-            for ii in range(len(regions)):
-                wws = np.array(stweight.get_time(regions[ii]))
-
-                if len(wws.shape) == 1 and wws.shape[0] != dstvalues.shape[0]:
-                    # Shorten to the minimum of the two years
-                    wws = wws[:min(wws.shape[0], srcvalues.shape[0])]
-                    srcvalues = srcvalues[:min(wws.shape[0], srcvalues.shape[0]), :]
-                    dstvalues[:len(wws), ii] = wws * srcvalues[:, ii]
-                else:
-                    dstvalues[:, ii] = wws * srcvalues[:, ii]
-        else:
-            # Handle deltamethod files
-            coeffvalues = np.zeros((vcv.shape[0], len(years), len(regions)))
-            # Perform multiplication on BCDE vectors
-            srcvalues = reader.variables[key + '_bcde'][:, :, :]
-            # Iterates over regions
-            for ii in range(len(regions)):
-                wws = stweight.get_time(regions[ii])
-                for tt in range(len(years)):
-                    # Generate both the BCDE values and the variances
-                    coeffvalues[:, tt, ii] = srcvalues[:, tt, ii] * wws[tt]
-                    dstvalues[tt, ii] = vcv.dot(coeffvalues[:, tt, ii]).dot(coeffvalues[:, tt, ii])
-
-            # We have to specifically create this, since the key was just the variance version
-            coeffcolumn = writer.createVariable(key + '_bcde', 'f4', ('coefficient', 'year', 'region'))
-            coeffcolumn[:, :, :] = coeffvalues
-
-        # Copy the result into the output file
-        agglib.copy_timereg_variable(writer, variable, key, dstvalues, "(levels)", unitchange = lambda unit: config.get('levels-unit'))
-
-    # Close all files
-    reader.close()
-    if dimensions_template is not None:
-        dimreader.close()
-    writer.close()
+    make_levels_and_aggregates(targetdir, filename, outfilename, None, halfweight, weight_args, None, None, dimensions_template=dimensions_template, metainfo=metainfo,
+                               limityears=limityears, config=config, writetargetdir=writetargetdir)
 
 def make_costs_levels(targetdir, filename, outfilename, halfweight, weight_args, config=None, writetargetdir=None):
     """Make adaptation cost levels (currently only for mortality).
@@ -727,6 +936,22 @@ def make_costs_levels(targetdir, filename, outfilename, halfweight, weight_args,
     # Perform the levels calculations
     make_levels(targetdir, filename, outfilename, halfweight, weight_args, dimensions_template=dimensions_template, metainfo=metainfo, config=config, writetargetdir=writetargetdir)
 
+def make_costs_levels_and_aggregates(targetdir, filename, levels_outfilename, aggregated_outfilename, halfweight_levels, weight_args_levels, halfweight_aggregate, weight_args_aggregate,
+                                     halfweight_denom=None, weight_args_denom=None, config=None, writetargetdir=None):
+    """Make adaptation cost levels and aggregates in a single pass (currently only for mortality).
+
+    This sets up metadata appropriate to the mortality costs, and then
+    calls `make_levels_and_aggregates` for processing. Either output
+    may be skipped by giving None for its filename.
+    """
+    # Setup the metadata
+    dimensions_template = files.sharedpath("outputs/temps/rcp45/CCSM4/climtas.nc4")
+    metainfo = config['costs-config'].get('meta-info', None)
+
+    # Perform the levels and aggregation calculations
+    make_levels_and_aggregates(targetdir, filename, levels_outfilename, aggregated_outfilename, halfweight_levels, weight_args_levels, halfweight_aggregate, weight_args_aggregate,
+                               dimensions_template=dimensions_template, metainfo=metainfo, halfweight_denom=halfweight_denom, weight_args_denom=weight_args_denom, config=config, writetargetdir=writetargetdir)
+
 def fullfile(filename, suffix, config):
     """
     Convenience function to expand a file name with `suffix` and `infix` from `config` if it exists. 
@@ -0,0 +1,176 @@
+"""On-disk cache of baseline climate covariates.
+
+Every covariator that averages a weather variable over the baseline
+period (e.g., `climtas`) reads each baseline year of weather and
+averages it over the year. The result depends only on the weather
+inputs, so identical baselines are recomputed for every target
+directory and Monte Carlo batch.
+
+`BaselineCache` stores the last `numyears` annual means before the
+end of the baseline, as a (years x regions) array, in a binary file
+under the directory given by the `baseline-cache` configuration
+option. Each entry is keyed by the GCM, scenario, variable, weather
+readers and transformer (which describe how the variable is derived),
+regions, and baseline window, and records the modification times of
+the weather files it was computed from; if any of these files change,
+the entry is recomputed.
+
+Only weather bundles that can list their input files
+(`DailyWeatherBundle.get_baseline_sources`) are cached.
+"""
+
+import os, json, hashlib
+import numpy as np
+
+class BaselineCache(object):
+    """Baseline (years x regions) arrays, stored as `.npz` files in `cachedir`."""
+    def __init__(self, cachedir):
+        self.cachedir = cachedir
+
+    def get_path(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cachedir, 'baseline-' + digest + '.npz')
+
+    def load(self, key, inputs, regions):
+        """Return the cached (dsvar, values), or None if missing or out of date.
+
+        Parameters
+        ----------
+        key : str
+            Description of the baseline, from `get_key`.
+        inputs : dict of str -> float
+            Modification time of each input file.
+        regions : sequence of str
+            The regions expected, in column order.
+        """
+        path = self.get_path(key)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with np.load(path) as data:
+                meta = json.loads(str(data['meta']))
+                if meta['key'] != key or meta['inputs'] != inputs:
+                    return None
+                if list(data['regions']) != list(regions):
+                    return None
+                return meta['dsvar'], data['values']
+        except Exception as ex:
+            print("WARNING: Could not read baseline cache %s." % path)
+            print(ex)
+            return None
+
+    def save(self, key, inputs, regions, dsvar, values):
+        """Store the (years x regions) `values` of `dsvar` for `key`."""
+        os.makedirs(self.cachedir, exist_ok=True)
+        path = self.get_path(key)
+        meta = json.dumps(dict(key=key, inputs=inputs, dsvar=dsvar))
+
+        # Write under a temporary name, so concurrent runs never see a partial file
+        tmppath = path[:-4] + '-%d.tmp.npz' % os.getpid()
+        np.savez(tmppath, values=values, regions=np.array(regions, dtype=str), meta=np.array(meta))
+        os.replace(tmppath, path)
+
+def get_cache(config):
+    """Return the BaselineCache for the `baseline-cache` option, or None."""
+    cachedir = config.get('baseline-cache', None)
+    if not cachedir:
+        return None
+    return BaselineCache(cachedir)
+
+def get_key(weatherbundle, description, variables, maxbaseline, numyears):
+    """Describe a baseline as a string, for use as a cache key."""
+    regionhash = hashlib.sha1('\n'.join(map(str, weatherbundle.regions)).encode('utf-8')).hexdigest()
+    return json.dumps(dict(model=weatherbundle.model, scenario=weatherbundle.scenario, variables=list(variables), regions=regionhash,
+                           sources=description, transformer=describe_transformer(weatherbundle.transformer),
+                           maxbaseline=int(maxbaseline), numyears=int(numyears)), sort_keys=True)
+
+def get_input_mtimes(files):
+    return {path: os.path.getmtime(path) for path in files}
+
+def describe_transformer(transformer):
+    """Describe the configuration of `transformer`, which must not depend on how far it has iterated."""
+    return [transformer.__class__.__name__, sorted(transformer.get_settings().items())]
+
+def describe_reader(reader, years):
+    """Return a description of `reader` and the files it reads for `years`.
+
+    Wrapping readers are described along with the readers they wrap.
+    If `years` is None, all years of the files are included.
+
+    Returns
+    -------
+    description : list
+    files : list of str
+    """
+    description = [reader.__class__.__name__, list(reader.get_dimension())]
+    files = []
+
+    if hasattr(reader, 'template'):
+        description.append(reader.template)
+        for year in (reader.get_years() if years is None else years):
+            path = reader.find_templated(year)
+            if os.path.exists(path):
+                files.append(path)
+    elif hasattr(reader, 'filepath'):
+        description.append(reader.filepath)
+        files.append(reader.filepath)
+
+    # HistoricalCycleReader reads its source years in a different order
+    subyears = None if hasattr(reader, 'futurereader') else years
+    subreaders = [getattr(reader, attr) for attr in ['reader', 'source'] if hasattr(reader, attr)]
+    for subreader in subreaders + list(getattr(reader, 'readers', [])):
+        subdescription, subfiles = describe_reader(subreader, subyears)
+        description.append(subdescription)
+        files.extend(subfiles)
+
+    return description, files
+
+def baseline_matrix(weatherbundle, maxbaseline, variables, numyears, config, quiet=False):
+    """Return the recent baseline annual means of the first of `variables` present.
+
+    Uses the cache configured by `baseline-cache`, if any, and
+    computes the baseline from the weather otherwise.
+
+    Parameters
+    ----------
+    weatherbundle : generate.weather.DailyWeatherBundle
+    maxbaseline : int
+        Year up to which the baseline is calculated.
+    variables : sequence of str
+        Weather variables to look for, in order of preference.
+    numyears : int
+        Number of years to return, counting back from `maxbaseline`.
+    config : dict
+    quiet : bool, optional
+
+    Returns
+    -------
+    dsvar : str
+        The variable found.
+    values : ndarray
+        (years x regions) array, in the order of `weatherbundle.regions`.
+    """
+    cache = get_cache(config)
+    sources = weatherbundle.get_baseline_sources(maxbaseline) if cache is not None else None
+    if sources is not None:
+        description, files = sources
+        key = get_key(weatherbundle, description, variables, maxbaseline, numyears)
+        inputs = get_input_mtimes(files)
+        cached = cache.load(key, inputs, weatherbundle.regions)
+        if cached is not None:
+            if not quiet:
+                print("Loaded baseline %s from %s" % (cached[0], cache.get_path(key)))
+            return cached
+
+    dsvar, values = weatherbundle.baseline_matrix(maxbaseline, variables, quiet=quiet)
+    values = np.ascontiguousarray(values[-numyears:])
+
+    if sources is not None:
+        try:
+            cache.save(key, inputs, weatherbundle.regions, dsvar, values)
+        except Exception as ex:
+            print("WARNING: Could not write baseline cache %s." % cache.get_path(key))
+            print(ex)
+
+    return dsvar, values
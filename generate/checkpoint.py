@@ -0,0 +1,180 @@
+"""Checkpoints of in-progress projections, so interrupted runs can resume.
+
+A checkpoint is taken at the boundary between weather years, and
+records the full state of the calculations: the application objects
+for every region, along with everything they refer to (the curve
+generators, covariators and their running averages, and any partially
+accumulated results), and the results stored so far.
+
+The state is pickled, with two additions to the standard pickler:
+
+ - Functions that cannot be pickled by reference, such as lambdas and
+   closures, are pickled by their code. Checkpoints can therefore only
+   be resumed under the same version of Python and of this code.
+ - Shared data sources (the weather bundle and economic model) are not
+   saved, but are reconnected to those of the resuming run.
+
+If the state cannot be pickled (for example, if a calculation holds an
+open file), checkpointing is disabled for the run, with a warning.
+"""
+
+import os, sys, io, types, marshal, pickle, importlib
+
+class Checkpointer(object):
+    """Saves and loads the checkpoints for a single result file.
+
+    Parameters
+    ----------
+    targetdir : str
+        Directory containing the results.
+    basename : str
+        Basename of the result file; the checkpoint is saved as
+        `<basename>-checkpoint.pkl`.
+    every_years : int
+        Number of years between checkpoints.
+    externals : sequence
+        Shared objects, which are not saved but are replaced by the
+        corresponding objects of the resuming run.
+    fingerprint : object, optional
+        Describes the run (for example, its years and regions); a
+        checkpoint is only resumed if it has the same fingerprint.
+    """
+    def __init__(self, targetdir, basename, every_years, externals, fingerprint=None):
+        self.path = os.path.join(targetdir, basename + '-checkpoint.pkl')
+        self.every_years = every_years
+        self.externals = list(externals)
+        self.fingerprint = fingerprint
+        self.enabled = True
+        self.years_since = 0
+        self.resumed = None # the loaded state, if resuming
+
+        # Set by the consumer of the results, returning their current state
+        self.get_results = lambda: None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        """Load the saved state into `resumed`, as a dictionary, if there is one to resume.
+
+        The state has the keys `year` (the last year included),
+        `calculations`, `applicationses`, and `results`.
+        """
+        self.resumed = None
+        if not self.exists():
+            return None
+
+        try:
+            with open(self.path, 'rb') as fp:
+                state = CheckpointUnpickler(fp, self.externals).load()
+        except Exception as ex:
+            print("WARNING: Could not load checkpoint %s; starting from the beginning." % self.path)
+            print(ex)
+            return None
+
+        if state['fingerprint'] != self.fingerprint:
+            print("WARNING: Checkpoint %s is for a different run; starting from the beginning." % self.path)
+            return None
+
+        print("Resuming from checkpoint after %d." % state['year'])
+        self.resumed = state
+        return state
+
+    def year_complete(self, year, calculations, applicationses):
+        """Called once all weather through `year` has been pushed; saves a checkpoint if one is due."""
+        if not self.enabled:
+            return
+
+        self.years_since += 1
+        if self.years_since < self.every_years:
+            return
+
+        self.save(dict(year=year, calculations=calculations, applicationses=applicationses))
+        self.years_since = 0
+
+    def save(self, state):
+        state['fingerprint'] = self.fingerprint
+        state['results'] = self.get_results()
+
+        try:
+            buffer = io.BytesIO()
+            CheckpointPickler(buffer, self.externals).dump(state)
+        except Exception as ex:
+            print("WARNING: Calculation state cannot be checkpointed; disabling checkpoints.")
+            print(ex)
+            self.enabled = False
+            return
+
+        # Replace the last checkpoint only once the new one is complete
+        with open(self.path + '.tmp', 'wb') as fp:
+            fp.write(buffer.getbuffer())
+        os.replace(self.path + '.tmp', self.path)
+
+    def remove(self):
+        """Delete the checkpoint, once the results are complete."""
+        if self.exists():
+            os.remove(self.path)
+
+class CheckpointPickler(pickle.Pickler):
+    """Pickler which saves `externals` by reference, and functions by code if necessary."""
+    def __init__(self, file, externals):
+        super(CheckpointPickler, self).__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.external_ids = {id(external): ii for ii, external in enumerate(externals)}
+
+    def persistent_id(self, obj):
+        return self.external_ids.get(id(obj))
+
+    def reducer_override(self, obj):
+        if isinstance(obj, types.FunctionType) and not is_importable(obj):
+            closure = obj.__closure__ or ()
+            cellvalues = [cell_value(cell) for cell in closure]
+            return (make_function, (marshal.dumps(obj.__code__), obj.__module__, obj.__name__, len(closure)),
+                    (obj.__defaults__, obj.__kwdefaults__, obj.__qualname__, cellvalues, obj.__dict__), None, None, set_function_state)
+        return NotImplemented
+
+class CheckpointUnpickler(pickle.Unpickler):
+    def __init__(self, file, externals):
+        super(CheckpointUnpickler, self).__init__(file)
+        self.externals = externals
+
+    def persistent_load(self, pid):
+        return self.externals[pid]
+
+class EmptyCell(object):
+    """Placeholder for the value of an unassigned closure cell."""
+    pass
+
+def is_importable(func):
+    """Can `func` be found by its module and qualified name, as pickle does?"""
+    obj = sys.modules.get(func.__module__)
+    for name in func.__qualname__.split('.'):
+        obj = getattr(obj, name, None)
+    return obj is func
+
+def cell_value(cell):
+    try:
+        return cell.cell_contents
+    except ValueError:
+        return EmptyCell
+
+def make_function(code, module, name, numcells):
+    """Create a function from its marshalled code, with empty closure cells."""
+    globs = importlib.import_module(module).__dict__
+    closure = tuple(types.CellType() for ii in range(numcells)) if numcells else None
+    return types.FunctionType(marshal.loads(code), globs, name, None, closure)
+
+def set_function_state(func, state):
+    """Fill in the defaults and closure of a function from `make_function`.
+
+    This is done after the function is created, so closures that
+    refer back to the function itself can be restored.
+    """
+    defaults, kwdefaults, qualname, cellvalues, funcdict = state
+    func.__defaults__ = defaults
+    func.__kwdefaults__ = kwdefaults
+    func.__qualname__ = qualname
+    for cell, value in zip(func.__closure__ or (), cellvalues):
+        if value is not EmptyCell:
+            cell.cell_contents = value
+    func.__dict__.update(funcdict)
+    return func
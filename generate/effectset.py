@@ -1,15 +1,17 @@
-import re, yaml, os, time
+import re, yaml, os, time, hashlib, contextlib
 import numpy as np
 import xarray as xr
 from netCDF4 import Dataset
 import helpers.header as headre
 from openest.generate import retrieve, diagnostic, fast_dataset
 from adaptation import curvegen
+from datastore import irregions
+from climate.netcdfs import netcdf_lock
 from interpret import configs
-from . import server, nc4writer, parallel_weather
+from . import server, nc4writer, parallel_weather, checkpoint, agglib
 
 
-def simultaneous_application(weatherbundle, calculation, regions=None, push_callback=None):
+def simultaneous_application(weatherbundle, calculation, regions=None, push_callback=None, checkpointer=None):
     """Iterate weather, calculations, generating regional results per time step
 
     Parameters
@@ -26,6 +28,8 @@ def simultaneous_application(weatherbundle, calculation, regions=None, push_call
         Used for diagnostic purposes. Must accept three arguments. A year, a
         str region, and whatever is returned from ``calculation.apply()`` when
         passed region.
+    checkpointer : generate.checkpoint.Checkpointer or None, optional
+        Passed to ``multiplexed_application``.
 
     Yields
     -------
@@ -38,49 +42,116 @@ def simultaneous_application(weatherbundle, calculation, regions=None, push_call
         Remaining elements returned from `calculation`, as described above,
         without `result_year`.
     """
+    for calcii, region, year, results in multiplexed_application(weatherbundle, [calculation], regions=regions, push_callbacks=[push_callback], checkpointer=checkpointer):
+        yield (region, year, results)
+
+def multiplexed_application(weatherbundle, calculations, regions=None, push_callbacks=None, checkpointer=None):
+    """Iterate weather once, pushing each year into several calculations
+
+    Equivalent to calling `simultaneous_application` for each
+    calculation, but ``weatherbundle.yearbundles`` is only walked
+    once, so the weather for each year is read a single time and
+    shared by every calculation.
+
+    Parameters
+    ----------
+    weatherbundle : generate.weather.DailyWeatherBundle
+        Its ``regions`` may be parsed and ``yearbundle`` is iterated.
+    calculations : sequence of openest.generate.functions.SpanInstabase
+        Each calculation's ``apply`` method is passed items from
+        ``regions``, and its ``cleanup`` method is called at the end.
+    regions : Iterable of str or None, optional:
+        One or more regions to perform calculations for. If None, uses all
+        regions available in ``weatherbundle.regions``.
+    push_callbacks : sequence of Callable or None, optional
+        One entry per calculation, each as `push_callback` in
+        `simultaneous_application`, or None.
+    checkpointer : generate.checkpoint.Checkpointer or None, optional
+        If given, the calculation state is checkpointed between
+        years. If the checkpointer has resumed a checkpoint, the saved
+        calculations continue after the checkpointed year, and
+        earlier years of weather are skipped.
+
+    Yields
+    -------
+    calcii : int
+        Index of the calculation in `calculations` producing the result.
+    region : str
+    result_year : int
+    result : list
+        As in `simultaneous_application`.
+    """
     if regions is None:
         regions = weatherbundle.regions
+    if push_callbacks is None:
+        push_callbacks = [None] * len(calculations)
+
+    resumeyear = None
+    if checkpointer is not None and checkpointer.resumed is not None:
+        calculations = checkpointer.resumed['calculations']
+        applicationses = checkpointer.resumed['applicationses']
+        resumeyear = checkpointer.resumed['year']
+    else:
+        print("Creating calculations...")
+        applicationses = [] # [{region: application}], one per calculation
+        for calculation in calculations:
+            applications = {}
+            for region in regions:
+                applications[region] = calculation.apply(region)
+            applicationses.append(applications)
 
-    print("Creating calculations...")
-    applications = {}
-    for region in regions:
-        applications[region] = calculation.apply(region)
-
-    region_indices = {region: weatherbundle.regions.index(region) for region in regions}
+    region_indices = irregions.RegionIndex.of(weatherbundle.regions).get_indices_dict(regions)
+    any_callback = any([push_callback is not None for push_callback in push_callbacks])
 
     print("Processing years...")
+    lastyear = None
     for year, ds in weatherbundle.yearbundles():
-        if ds.region.shape[0] < len(applications):
+        if resumeyear is not None and year <= resumeyear:
+            continue # already included in the checkpoint
+        if checkpointer is not None and lastyear is not None:
+            checkpointer.year_complete(lastyear, calculations, applicationses)
+        lastyear = year
+
+        if ds.region.shape[0] < len(applicationses[0]):
             print("WARNING: fewer regions in weather than expected; dropping from end.")
 
         print("Push", year)
         for region, subds in fast_dataset.region_groupby(ds, year, regions, region_indices):
-            for yearresult in applications[region].push(subds):
-                yield (region, yearresult[0], yearresult[1:])
+            for calcii in range(len(calculations)):
+                application = applicationses[calcii][region]
+                for yearresult in application.push(subds):
+                    yield (calcii, region, yearresult[0], yearresult[1:])
 
-            if push_callback is not None:
-                push_callback(region, year, applications[region])
+                if push_callbacks[calcii] is not None:
+                    push_callbacks[calcii](region, year, application)
+
+            if any_callback:
                 diagnostic.finish(region, year, group='input')
-                
-    for region in applications:
-        for yearresult in applications[region].done():
-            yield (region, yearresult[0], yearresult[1:])
 
-    calculation.cleanup()
+    for calcii in range(len(calculations)):
+        for region in applicationses[calcii]:
+            for yearresult in applicationses[calcii][region].done():
+                yield (calcii, region, yearresult[0], yearresult[1:])
+
+    for calculation in calculations:
+        calculation.cleanup()
 
-def generate(targetdir, basename, weatherbundle, calculation, description, calculation_dependencies, config, filter_region=None, push_callback=None, subset=None, diagnosefile=False, deltamethod_vcv=False):
+def generate(targetdir, basename, weatherbundle, calculation, description, calculation_dependencies, config, filter_region=None, push_callback=None, subset=None, diagnosefile=False, deltamethod_vcv=False, economicmodel=None):
     """Compute impact projection and write to a file
 
     See the subprocesses prepare_ncdf_data and write_ncdf for most
-    parameter definitions. The only additional parameter handled by
-    this function is `filter_region`; it also works differently for
-    the 'profile' or 'diagnostic' modes.
+    parameter definitions. The additional parameters handled by this
+    function are `filter_region` and `economicmodel`; it also works
+    differently for the 'profile' or 'diagnostic' modes.
 
     Parameters
     ----------
     filter_region : str or None, optional
         One or more regions to perform calculations for. If None, uses all
         regions available in ``weatherbundle.regions``.
+    economicmodel : adaptation.econmodel.SSPEconomicModel or None, optional
+        The economic model used by the calculation; under
+        `checkpoint-years`, it is reconnected rather than saved.
     """
     if 'mode' in config and config['mode'] == 'profile':
         return small_print(weatherbundle, calculation, regions=10000)
@@ -95,19 +166,62 @@ def generate(targetdir, basename, weatherbundle, calculation, description, calcu
         calculation.enable_deltamethod()
 
     my_regions = configs.get_regions(weatherbundle.regions, filter_region)
-    columndata = prepare_ncdf_data(weatherbundle, calculation, my_regions, push_callback=push_callback, diagnosefile=diagnosefile, deltamethod_vcv=deltamethod_vcv)
+    checkpointer = get_checkpointer(targetdir, basename, weatherbundle, economicmodel, my_regions, config)
+    if checkpointer is not None:
+        checkpointer.load()
+
+    if config.get('stream-output', False):
+        lock = weatherbundle.driver.lock if parallel_weather.is_parallel(weatherbundle) else None
+        resume_state = checkpointer.resumed['results'] if checkpointer is not None and checkpointer.resumed is not None else None
+        writer = StreamingNcdfWriter(targetdir, basename, weatherbundle, calculation, description, calculation_dependencies, my_regions, subset=subset, deltamethod_vcv=deltamethod_vcv, flush_years=config.get('stream-flush-years', 10), lock=lock, resume_state=resume_state)
+        prepare_ncdf_data(weatherbundle, calculation, my_regions, push_callback=push_callback, diagnosefile=diagnosefile, deltamethod_vcv=deltamethod_vcv, writer=writer, checkpointer=checkpointer)
+        writer.close()
+    else:
+        columndata = prepare_ncdf_data(weatherbundle, calculation, my_regions, push_callback=push_callback, diagnosefile=diagnosefile, deltamethod_vcv=deltamethod_vcv, checkpointer=checkpointer)
 
+        if parallel_weather.is_parallel(weatherbundle):
+            weatherbundle.driver.lock.acquire()
+        write_ncdf(targetdir, basename, columndata, weatherbundle, calculation, description, calculation_dependencies, my_regions, subset=subset, deltamethod_vcv=deltamethod_vcv)
+        if parallel_weather.is_parallel(weatherbundle):
+            weatherbundle.driver.lock.release()
+
+    if checkpointer is not None:
+        checkpointer.remove()
+
+def get_checkpointer(targetdir, basename, weatherbundle, economicmodel, my_regions, config, jobs=None):
+    """Return a Checkpointer for the result file `basename`, or None if not checkpointing.
+
+    The checkpoint is only resumed by a run with the same years,
+    regions, and configuration, and, if `jobs` are given (as for
+    `generate_multiplexed`), the same job basenames, in the same
+    order, CSVV fingerprints, and job configurations.
+    """
+    if not config.get('checkpoint-years', 0):
+        return None
     if parallel_weather.is_parallel(weatherbundle):
-        weatherbundle.driver.lock.acquire()
-    write_ncdf(targetdir, basename, columndata, weatherbundle, calculation, description, calculation_dependencies, my_regions, subset=subset, deltamethod_vcv=deltamethod_vcv)
-    if parallel_weather.is_parallel(weatherbundle):
-        weatherbundle.driver.lock.release()
+        print("WARNING: Checkpoints are not supported under parallel processing.")
+        return None
+
+    fingerprint = (basename, list(weatherbundle.get_years()), list(my_regions), config.get('stream-output', False), config_digest(config))
+    if jobs is not None:
+        fingerprint += ([(job['basename'], job.get('fingerprint'), config_digest(job['config']) if job.get('config') is not None else None) for job in jobs],)
+    externals = [weatherbundle] + ([economicmodel] if economicmodel is not None else [])
+    return checkpoint.Checkpointer(targetdir, basename, config['checkpoint-years'], externals, fingerprint=fingerprint)
+
+def config_digest(config):
+    """Return a digest of the run configuration, for checkpoint fingerprints.
 
-def prepare_ncdf_data(weatherbundle, calculation, my_regions, push_callback=None, diagnosefile=False, deltamethod_vcv=False):
+    Uses the representation of the configuration, since iterating over
+    a ConfigDict would mark all of its keys as accessed.
+    """
+    return hashlib.sha1(repr(config).encode('utf-8')).hexdigest()
+
+def prepare_ncdf_data(weatherbundle, calculation, my_regions, push_callback=None, diagnosefile=False, deltamethod_vcv=False, writer=None, checkpointer=None):
     """Compute impact projection
 
     Organizes data returned by `simultaneous_calculation` into a
-    matrix to be written to a NetCDF file.  It may also write a
+    matrix to be written to a NetCDF file, or passes it to `writer`
+    to be written as each year completes.  It may also write a
     diagnostic file, if specified.
 
     Parameters
@@ -126,40 +240,214 @@ def prepare_ncdf_data(weatherbundle, calculation, my_regions, push_callback=None
     deltamethod_vcv : ndarray or bool, optional
         2D variance-covariance float array if the projection is to run with the
         delta method. If ``False``, the delta method is not used.
+    writer : StreamingNcdfWriter or None, optional
+        If given, results are stored in the writer, and None is returned.
+    checkpointer : generate.checkpoint.Checkpointer or None, optional
+        If given, the results so far are included in each checkpoint,
+        and restored if the checkpointer has resumed a checkpoint.
 
     """
     yeardata = weatherbundle.get_years()
-    columndata = [] # [matrix(year x region)]
-    for ii in range(len(calculation.unitses)):
-        columndata.append(np.zeros((len(yeardata), len(my_regions))) * np.nan)
-
-        if deltamethod_vcv is not False:
-            columndata.append(np.zeros((deltamethod_vcv.shape[0], len(yeardata), len(my_regions))) * np.nan)
+    if writer is None:
+        columndata = allocate_ncdf_data(yeardata, calculation, my_regions, deltamethod_vcv=deltamethod_vcv)
+        if checkpointer is not None:
+            checkpointer.get_results = lambda: columndata
+            if checkpointer.resumed is not None:
+                restore_ncdf_data(columndata, checkpointer.resumed['results'])
+    else:
+        columndata = None
+        if checkpointer is not None:
+            checkpointer.get_results = writer.get_state
 
     if diagnosefile:
         diagnostic.begin(diagnosefile, finishset=set(['input', 'output']))
 
-    region_indices = {region: my_regions.index(region) for region in my_regions}
+    region_indices = irregions.RegionIndex.of(my_regions).get_indices_dict()
 
-    for region, year, results in simultaneous_application(weatherbundle, calculation, regions=my_regions, push_callback=push_callback):
-        for col in range(len(results)):
-            if deltamethod_vcv is not False:
-                variance = 0
-                for ii in range(len(results[col])):
-                    for jj in range(len(results[col])):
-                        variance += deltamethod_vcv[ii, jj] * results[col][ii] * results[col][jj]
-                columndata[2 * col][year - yeardata[0], region_indices[region]] = variance
-                columndata[2 * col + 1][:, year - yeardata[0], region_indices[region]] = results[col]
-            else:
-                columndata[col][year - yeardata[0], region_indices[region]] = results[col]
+    for region, year, results in simultaneous_application(weatherbundle, calculation, regions=my_regions, push_callback=push_callback, checkpointer=checkpointer):
+        if writer is None:
+            store_ncdf_result(columndata, year - yeardata[0], region_indices[region], results, deltamethod_vcv=deltamethod_vcv)
+        else:
+            writer.store(year - yeardata[0], region_indices[region], results)
         if diagnosefile:
             diagnostic.finish(region, year, group='output')
 
     if diagnosefile:
         diagnostic.close()
 
+    if writer is None:
+        finish_ncdf_data(columndata, deltamethod_vcv=deltamethod_vcv)
+
+    return columndata
+
+def allocate_ncdf_data(yeardata, calculation, my_regions, deltamethod_vcv=False):
+    """Create the NaN-filled result matrices for a calculation.
+
+    Returns
+    -------
+    list of ndarray
+        One (year x region) matrix per output column, each followed by
+        a (coefficient x year x region) matrix under the delta method.
+    """
+    columndata = [] # [matrix(year x region)]
+    for ii in range(len(calculation.unitses)):
+        columndata.append(np.zeros((len(yeardata), len(my_regions))) * np.nan)
+
+        if deltamethod_vcv is not False:
+            columndata.append(np.zeros((deltamethod_vcv.shape[0], len(yeardata), len(my_regions))) * np.nan)
+
     return columndata
-        
+
+def restore_ncdf_data(columndata, saved):
+    """Copy checkpointed results into `columndata`, which must have the same columns."""
+    assert len(saved) == len(columndata), "Checkpoint has %d result columns, but the calculation has %d." % (len(saved), len(columndata))
+    for column, values in zip(columndata, saved):
+        assert column.shape == values.shape, "Checkpoint results have shape %s, but %s is expected." % (values.shape, column.shape)
+        column[...] = values
+
+def store_ncdf_result(columndata, yearii, regionii, results, deltamethod_vcv=False):
+    """Record the results of one region-year into `columndata`.
+
+    Under the delta method, only the coefficient vectors are recorded;
+    the variances are computed for all region-years by `finish_ncdf_data`.
+    """
+    for col in range(len(results)):
+        if deltamethod_vcv is not False:
+            columndata[2 * col + 1][:, yearii, regionii] = results[col]
+        else:
+            columndata[col][yearii, regionii] = results[col]
+
+def finish_ncdf_data(columndata, deltamethod_vcv=False):
+    """Fill in the delta-method variances, once all results are stored."""
+    if deltamethod_vcv is False:
+        return
+
+    for col in range(len(columndata) // 2):
+        agglib.deltamethod_variance(columndata[2 * col + 1], deltamethod_vcv, out=columndata[2 * col])
+
+def generate_multiplexed(targetdir, jobs, weatherbundle, config, filter_region=None, subset=None, economicmodel=None):
+    """Compute several impact projections from a single pass over the weather
+
+    Each job is written to its own file, exactly as if `generate` had
+    been called for it, but the weather is only read once for all of
+    them.
+
+    Parameters
+    ----------
+    targetdir : str
+        Directory to write files to.
+    jobs : sequence of dict
+        Each dict has the keys `basename`, `calculation`,
+        `description`, `dependencies`, `push_callback`, and
+        `deltamethod_vcv`, as the corresponding arguments to
+        `generate`, and optionally `fingerprint`, identifying the
+        CSVV for checkpoints, and `config`, the configuration of the
+        job's model.
+    weatherbundle : generate.weather.DailyWeatherBundle
+        Populated weather data to compute projection over.
+    config : dict
+        Run configuration, used if the jobs do not give their own.
+        See `get_multiplexed_config`.
+    filter_region : str or None, optional
+        As in `generate`.
+    subset : str or None, optional
+        Passed to ``write_ncdf``.
+    economicmodel : adaptation.econmodel.SSPEconomicModel or None, optional
+        As in `generate`.
+    """
+    if not jobs:
+        return
+
+    config = get_multiplexed_config(jobs, config)
+    if filter_region is None:
+        filter_region = config.get('filter-region', None)
+
+    my_regions = configs.get_regions(weatherbundle.regions, filter_region)
+    region_indices = irregions.RegionIndex.of(my_regions).get_indices_dict()
+    yeardata = weatherbundle.get_years()
+
+    if parallel_weather.is_parallel(weatherbundle):
+        lock = weatherbundle.driver.lock
+    else:
+        lock = None
+
+    # One checkpoint covers all of the jobs
+    checkpointer = get_checkpointer(targetdir, jobs[0]['basename'] + '-multiplex', weatherbundle, economicmodel, my_regions, config, jobs=jobs)
+    if checkpointer is not None:
+        checkpointer.load()
+    resumed_results = checkpointer.resumed['results'] if checkpointer is not None and checkpointer.resumed is not None else None
+    if resumed_results is not None:
+        assert len(resumed_results) == len(jobs), "Checkpoint has results for %d jobs, but there are %d." % (len(resumed_results), len(jobs))
+
+    calculations = []
+    columndatas = []
+    writers = []
+    for jobii, job in enumerate(jobs):
+        if job['deltamethod_vcv'] is not False:
+            job['calculation'].enable_deltamethod()
+        calculations.append(job['calculation'])
+        if config.get('stream-output', False):
+            writers.append(StreamingNcdfWriter(targetdir, job['basename'], weatherbundle, job['calculation'], job['description'], job['dependencies'], my_regions, subset=subset, deltamethod_vcv=job['deltamethod_vcv'], flush_years=config.get('stream-flush-years', 10), lock=lock,
+                                               resume_state=resumed_results[jobii] if resumed_results is not None else None))
+        else:
+            columndatas.append(allocate_ncdf_data(yeardata, job['calculation'], my_regions, deltamethod_vcv=job['deltamethod_vcv']))
+            if resumed_results is not None:
+                restore_ncdf_data(columndatas[-1], resumed_results[jobii])
+
+    if checkpointer is not None:
+        if writers:
+            checkpointer.get_results = lambda: [writer.get_state() for writer in writers]
+        else:
+            checkpointer.get_results = lambda: columndatas
+
+    print("Multiplexing %d calculations over one weather pass." % len(jobs))
+    push_callbacks = [job['push_callback'] for job in jobs]
+    for calcii, region, year, results in multiplexed_application(weatherbundle, calculations, regions=my_regions, push_callbacks=push_callbacks, checkpointer=checkpointer):
+        if writers:
+            writers[calcii].store(year - yeardata[0], region_indices[region], results)
+        else:
+            store_ncdf_result(columndatas[calcii], year - yeardata[0], region_indices[region], results, deltamethod_vcv=jobs[calcii]['deltamethod_vcv'])
+
+    if writers:
+        for writer in writers:
+            writer.close()
+    else:
+        for job, columndata in zip(jobs, columndatas):
+            finish_ncdf_data(columndata, deltamethod_vcv=job['deltamethod_vcv'])
+
+        if parallel_weather.is_parallel(weatherbundle):
+            weatherbundle.driver.lock.acquire()
+        for job, columndata in zip(jobs, columndatas):
+            write_ncdf(targetdir, job['basename'], columndata, weatherbundle, job['calculation'], job['description'], job['dependencies'], my_regions, subset=subset, deltamethod_vcv=job['deltamethod_vcv'])
+        if parallel_weather.is_parallel(weatherbundle):
+            weatherbundle.driver.lock.release()
+
+    if checkpointer is not None:
+        checkpointer.remove()
+
+# Options that apply to a whole multiplexed pass, rather than to each job
+multiplexed_options = ['filter-region', 'stream-output', 'stream-flush-years', 'checkpoint-years']
+
+def get_multiplexed_config(jobs, config):
+    """Return the configuration for a multiplexed pass over `jobs`.
+
+    Jobs queued with the merged configuration of their model carry it
+    as `config`. Since the options in `multiplexed_options` apply to
+    the whole pass, all jobs must agree on them; this raises a
+    ValueError if they do not. The first job's configuration is
+    returned, or `config` if no job has one.
+    """
+    jobconfigs = [job['config'] for job in jobs if job.get('config') is not None]
+    if not jobconfigs:
+        return config
+
+    for option in multiplexed_options:
+        values = [jobconfig.get(option, None) for jobconfig in jobconfigs]
+        if any(value != values[0] for value in values[1:]):
+            raise ValueError("Multiplexed calculations must have the same %s option, but have %s." % (option, ', '.join(map(str, values))))
+
+    return jobconfigs[0]
+
 def write_ncdf(targetdir, basename, columndata, weatherbundle, calculation, description, calculation_dependencies, my_regions, subset=None, deltamethod_vcv=False):
     """Write impact projection to NetCDF file
 
@@ -186,6 +474,31 @@ def write_ncdf(targetdir, basename, columndata, weatherbundle, calculation, desc
         2D variance-covariance float array if the projection is to run with the
         delta method. If ``False``, the delta method is not used.
     """
+    with netcdf_lock:
+        rootgrp, columns = create_ncdf(targetdir, basename, weatherbundle, calculation, description, calculation_dependencies, my_regions, subset=subset, deltamethod_vcv=deltamethod_vcv)
+
+        if deltamethod_vcv is not False:
+            assert len(columndata) % 2 == 0
+            for col in range(len(columndata) // 2):
+                columns[2 * col][:, :] = columndata[2 * col]
+                columns[2 * col + 1][:, :, :] = columndata[2 * col + 1]
+        else:
+            for col in range(len(columndata)):
+                columns[col][:, :] = columndata[col]
+
+        rootgrp.close()
+
+def create_ncdf(targetdir, basename, weatherbundle, calculation, description, calculation_dependencies, my_regions, subset=None, deltamethod_vcv=False):
+    """Create the NetCDF file for a projection, with its dimensions and empty result variables.
+
+    Parameters are as in `write_ncdf`.
+
+    Returns
+    -------
+    tuple of the NetCDF4 writer object (netCDF4.Dataset) and the
+    list of result variables (netCDF4.Variable), in the order of
+    the `columndata` matrices.
+    """
     try:
         rootgrp = Dataset(os.path.join(targetdir, basename + '.nc4'), 'w', format='NETCDF4')
     except Exception as ex:
@@ -236,16 +549,134 @@ def write_ncdf(targetdir, basename, columndata, weatherbundle, calculation, desc
 
     years[:] = yeardata
 
-    if deltamethod_vcv is not False:
-        assert len(columndata) % 2 == 0
-        for col in range(len(columndata) // 2):
-            columns[2 * col][:, :] = columndata[2 * col]
-            columns[2 * col + 1][:, :, :] = columndata[2 * col + 1]
-    else:
-        for col in range(len(columndata)):
-            columns[col][:, :] = columndata[col]
+    return rootgrp, columns
 
-    rootgrp.close()
+class StreamingNcdfWriter(object):
+    """Writes the results of a projection to its NetCDF file as each year completes.
+
+    A year is written once every region has reported its results for
+    that year. Calculations may report years out of order (for
+    example, results relative to a baseline are held until the
+    baseline is known), so only the incomplete years are kept in
+    memory. Any years still incomplete are written, with NaNs for the
+    missing regions, by `close`.
+
+    The file's `years_complete` attribute gives the number of leading
+    years that have been written, and equals the number of years once
+    the file is closed, so a partial file can be detected.
+
+    Parameters
+    ----------
+    targetdir, basename, weatherbundle, calculation, description, calculation_dependencies, my_regions, subset, deltamethod_vcv
+        As in `write_ncdf`.
+    flush_years : int, optional
+        Number of years to write between flushes to disk.
+    lock : Lock or None, optional
+        Held while accessing the file, under parallel processing.
+        `netcdf_lock` is always held as well, since weather may be
+        read on a prefetch thread.
+    resume_state : dict or None, optional
+        A result of `get_state`; if given, the existing file is
+        reopened and writing continues from that state.
+    """
+    def __init__(self, targetdir, basename, weatherbundle, calculation, description, calculation_dependencies, my_regions, subset=None, deltamethod_vcv=False, flush_years=10, lock=None, resume_state=None):
+        self.calculation = calculation
+        self.my_regions = my_regions
+        self.deltamethod_vcv = deltamethod_vcv
+        self.flush_years = flush_years
+        self.lock = lock
+        self.numyears = len(weatherbundle.get_years())
+        self.unflushed = 0
+
+        if resume_state is not None:
+            with self.locked():
+                self.rootgrp = Dataset(os.path.join(targetdir, basename + '.nc4'), 'a', format='NETCDF4')
+                self.columns = [self.rootgrp.variables[name] for name in resume_state['columnnames']]
+            numcolumns = len(calculation.unitses) * (2 if deltamethod_vcv is not False else 1)
+            assert len(self.columns) == numcolumns, "Checkpoint has %d result columns, but the calculation has %d." % (len(self.columns), numcolumns)
+            self.written = resume_state['written'].copy()
+            self.years_complete = resume_state['years_complete']
+            self.pending = resume_state['pending']
+            return
+
+        with self.locked():
+            self.rootgrp, self.columns = create_ncdf(targetdir, basename, weatherbundle, calculation, description, calculation_dependencies, my_regions, subset=subset, deltamethod_vcv=deltamethod_vcv)
+            self.rootgrp.years_complete = 0
+
+        self.written = np.zeros(self.numyears, dtype=bool)
+        self.years_complete = 0
+        self.pending = {} # {yearii: (columndata for one year, regions reported)}
+
+    @contextlib.contextmanager
+    def locked(self):
+        with netcdf_lock, (self.lock if self.lock is not None else contextlib.nullcontext()):
+            yield
+
+    def store(self, yearii, regionii, results):
+        """Record the results of one region-year, writing the year if it is complete."""
+        if self.written[yearii]:
+            # A late result for a year already written: write only this region
+            columndata = allocate_ncdf_data([yearii], self.calculation, self.my_regions, deltamethod_vcv=self.deltamethod_vcv)
+            store_ncdf_result(columndata, 0, regionii, results, deltamethod_vcv=self.deltamethod_vcv)
+            finish_ncdf_data(columndata, deltamethod_vcv=self.deltamethod_vcv)
+            with self.locked():
+                for col in range(len(columndata)):
+                    if columndata[col].ndim == 3:
+                        self.columns[col][:, yearii, regionii] = columndata[col][:, 0, regionii]
+                    else:
+                        self.columns[col][yearii, regionii] = columndata[col][0, regionii]
+            return
+
+        if yearii not in self.pending:
+            self.pending[yearii] = (allocate_ncdf_data([yearii], self.calculation, self.my_regions, deltamethod_vcv=self.deltamethod_vcv),
+                                    np.zeros(len(self.my_regions), dtype=bool))
+        columndata, reported = self.pending[yearii]
+        store_ncdf_result(columndata, 0, regionii, results, deltamethod_vcv=self.deltamethod_vcv)
+        reported[regionii] = True
+        if np.all(reported):
+            self.write_year(yearii)
+
+    def write_year(self, yearii):
+        """Write the results for a year, and update the `years_complete` marker."""
+        if yearii in self.pending:
+            columndata, reported = self.pending.pop(yearii)
+            finish_ncdf_data(columndata, deltamethod_vcv=self.deltamethod_vcv)
+        else:
+            columndata = allocate_ncdf_data([yearii], self.calculation, self.my_regions, deltamethod_vcv=self.deltamethod_vcv)
+
+        self.written[yearii] = True
+        while self.years_complete < self.numyears and self.written[self.years_complete]:
+            self.years_complete += 1
+
+        with self.locked():
+            for col in range(len(columndata)):
+                if columndata[col].ndim == 3:
+                    self.columns[col][:, yearii, :] = columndata[col][:, 0, :]
+                else:
+                    self.columns[col][yearii, :] = columndata[col][0, :]
+            self.rootgrp.years_complete = self.years_complete
+
+            self.unflushed += 1
+            if self.unflushed >= self.flush_years:
+                self.rootgrp.sync()
+                self.unflushed = 0
+
+    def get_state(self):
+        """Flush the file, and return the state needed to resume writing it."""
+        with self.locked():
+            self.rootgrp.sync()
+            self.unflushed = 0
+        return dict(columnnames=[column.name for column in self.columns], written=self.written.copy(),
+                    years_complete=self.years_complete, pending=self.pending)
+
+    def close(self):
+        """Write any incomplete years and close the file."""
+        for yearii in range(self.numyears):
+            if not self.written[yearii]:
+                self.write_year(yearii)
+
+        with self.locked():
+            self.rootgrp.close()
 
 def small_print(weatherbundle, calculation, regions=10):
     """
@@ -0,0 +1,346 @@
+"""Lockstep parallel processing with worker processes, rather than threads.
+
+Under `multithread.FoldedActionsLockstepParallelDriver`, worker threads
+read the driver's attributes directly, but their Python-level
+calculations are serialized by the GIL.
+`FoldedActionsProcessLockstepParallelDriver` runs the same lockstep
+protocol with forked worker processes:
+
+ - Each worker process starts with a copy of the driver, made by `fork`.
+ - At every barrier, the driver sends each worker the shared state
+   (the outputs for the timestep, the action list, and the last
+   instant action result), and each worker sends the driver any
+   changes it made to the attributes workers are allowed to set (such
+   as a requested action).
+ - Numerical arrays in the shared state, including the variables of
+   weather datasets and the columns of `ColumnarCovariateStore`
+   objects, are published in shared memory, so each year's data is
+   written once by the driver and mapped, not copied, by every worker.
+
+Actions are requested and performed as for the threaded driver, so
+subclasses and worker code use the same `request_action`,
+`instant_action`, `end_timestep`, and `end_worker` calls. Published
+values are treated as read-only: an object is only exported again once
+it has dropped out of the shared state.
+"""
+
+import pickle, itertools, traceback
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+from adaptation import columnar
+from . import multithread
+
+NUMERIC_KINDS = 'biufcmM' # dtype kinds that can be placed directly in shared memory
+
+class SharedMemoryPublisher(object):
+    """Driver-side export of values, with their arrays in shared memory.
+
+    Scalars and strings are sent inline, and lists, tuples, and dicts
+    are exported item by item. Every other object is exported once,
+    while it remains part of the published state: numerical arrays,
+    datasets, and covariate stores have their arrays copied into
+    shared memory blocks, and anything else is pickled into a block.
+    """
+    def __init__(self):
+        self.exportids = itertools.count()
+        self.exports = {} # {id(value): (value, descriptor, [SharedMemory])}
+        self.retired = [] # blocks no longer published, which workers may still be attaching
+
+    def publish(self, value):
+        """Return a descriptor for `value`, from which `SharedMemoryReader.read` reconstructs it.
+
+        Exports from earlier calls that are not part of `value` are
+        retired; their blocks are unlinked by `unlink_retired`, once
+        all workers have read this descriptor.
+        """
+        live = {}
+        descriptor = self._export(value, live)
+        for valueid in self.exports:
+            if valueid not in live:
+                self.retired.extend(self.exports[valueid][2])
+        self.exports = live
+        return descriptor
+
+    def unlink_retired(self):
+        for block in self.retired:
+            block.close()
+            block.unlink()
+        self.retired = []
+
+    def close(self):
+        """Unlink all blocks."""
+        for value, descriptor, blocks in self.exports.values():
+            self.retired.extend(blocks)
+        self.exports = {}
+        self.unlink_retired()
+
+    def _export(self, value, live):
+        if value is None or isinstance(value, (bool, int, float, str, np.number)):
+            return ('value', value)
+        if type(value) is dict:
+            return ('dict', {key: self._export(item, live) for key, item in value.items()})
+        if type(value) in (list, tuple):
+            return (type(value).__name__, [self._export(item, live) for item in value])
+
+        valueid = id(value)
+        if valueid not in live:
+            if valueid in self.exports:
+                live[valueid] = self.exports[valueid]
+            else:
+                blocks = []
+                descriptor = ('shared', next(self.exportids), self._export_content(value, blocks))
+                live[valueid] = (value, descriptor, blocks)
+        return live[valueid][1]
+
+    def _export_content(self, value, blocks):
+        if isinstance(value, np.ndarray) and value.dtype.kind in NUMERIC_KINDS:
+            return self._export_array(value, blocks)
+        if isinstance(value, columnar.ColumnarCovariateStore):
+            columns = {covar: self._export_column(value.columns[covar], blocks) for covar in value.columns}
+            return ('covariates', self._export_pickle(list(value.regions), blocks), columns, self._export_array(value.years, blocks))
+        if hasattr(value, 'variables') and hasattr(value, 'coords') and hasattr(value, 'attrs'):
+            # xarray Dataset or FastDataset; FastDataset keeps the coordinates it was constructed with
+            coords = getattr(value, 'original_coords', None)
+            if coords is None:
+                coords = {name: value.coords[name] for name in value.coords}
+            variables = {}
+            for name in value.variables:
+                if name in value.coords:
+                    continue
+                variable = value.variables[name]
+                values = variable._values if hasattr(variable, '_values') else variable.values
+                variables[name] = (tuple(variable.dims), self._export_column(np.asarray(values), blocks))
+            return ('dataset', type(value), variables, self._export_pickle((coords, dict(value.attrs)), blocks))
+        return self._export_pickle(value, blocks)
+
+    def _export_column(self, array, blocks):
+        if array.dtype.kind in NUMERIC_KINDS:
+            return self._export_array(array, blocks)
+        return self._export_pickle(array, blocks)
+
+    def _export_array(self, array, blocks):
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        return ('array', block.name, array.shape, array.dtype.str)
+
+    def _export_pickle(self, value, blocks):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        block = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+        block.buf[:len(data)] = data
+        blocks.append(block)
+        return ('pickle', block.name, len(data))
+
+class SharedMemoryReader(object):
+    """Worker-side reconstruction of values exported by a `SharedMemoryPublisher`.
+
+    Arrays are views onto the shared memory blocks. Each export is
+    attached once, and its blocks are closed once it is no longer
+    published and none of its arrays are still in use.
+    """
+    def __init__(self):
+        self.attached = {} # {exportid: (value, [SharedMemory])}
+        self.closing = [] # blocks no longer published, but possibly still in use
+
+    def read(self, descriptor):
+        live = {}
+        value = self._import(descriptor, live)
+        for exportid in self.attached:
+            if exportid not in live:
+                self.closing.extend(self.attached[exportid][1])
+        self.attached = live
+        self.release()
+        return value
+
+    def release(self):
+        """Close blocks that are no longer published, if their arrays have been dropped."""
+        inuse = []
+        for block in self.closing:
+            try:
+                block.close()
+            except BufferError:
+                inuse.append(block)
+        self.closing = inuse
+
+    def _import(self, descriptor, live):
+        kind = descriptor[0]
+        if kind == 'value':
+            return descriptor[1]
+        if kind == 'dict':
+            return {key: self._import(item, live) for key, item in descriptor[1].items()}
+        if kind == 'list':
+            return [self._import(item, live) for item in descriptor[1]]
+        if kind == 'tuple':
+            return tuple(self._import(item, live) for item in descriptor[1])
+
+        assert kind == 'shared', "Unknown shared value descriptor."
+        exportid = descriptor[1]
+        if exportid not in live:
+            if exportid in self.attached:
+                live[exportid] = self.attached[exportid]
+            else:
+                blocks = []
+                live[exportid] = (self._import_content(descriptor[2], blocks), blocks)
+        return live[exportid][0]
+
+    def _import_content(self, content, blocks):
+        kind = content[0]
+        if kind == 'array':
+            name, shape, dtype = content[1:]
+            block = shared_memory.SharedMemory(name=name)
+            blocks.append(block)
+            return np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        if kind == 'pickle':
+            name, size = content[1:]
+            block = shared_memory.SharedMemory(name=name)
+            value = pickle.loads(bytes(block.buf[:size]))
+            block.close()
+            return value
+        if kind == 'covariates':
+            regions, columns, years = content[1:]
+            store = columnar.ColumnarCovariateStore(self._import_content(regions, blocks))
+            store.columns = {covar: self._import_content(columns[covar], blocks) for covar in columns}
+            store.years = self._import_content(years, blocks)
+            return store
+        if kind == 'dataset':
+            cls, variables, extras = content[1:]
+            coords, attrs = self._import_content(extras, blocks)
+            data_vars = {name: (dims, self._import_content(values, blocks)) for name, (dims, values) in variables.items()}
+            return cls(data_vars, coords=coords, attrs=attrs)
+        raise ValueError("Unknown shared content: " + kind)
+
+class FoldedActionsProcessLockstepParallelDriver(multithread.FoldedActionsLockstepParallelDriver):
+    """FoldedActionsLockstepParallelDriver with worker processes in place of threads.
+
+    Workers are forked when `loop` is called, so they begin with a copy
+    of the driver as it is then. After that, the only driver state
+    they see is that named in `driver_attributes`, along with
+    `outputs` and `instant_result`, which is sent to them at every
+    barrier. Workers may only change the attributes named in
+    `worker_attributes` (under `lock`, as for the threaded driver);
+    the changes are merged by the driver at every barrier.
+
+    Instant actions named in `replicated_actions` are also performed
+    by each worker on its own copy of the driver, after the driver has
+    performed them, for actions that change driver state which workers
+    read directly.
+
+    Requires the `fork` start method (Linux or macOS).
+    """
+    driver_attributes = ('action_list', 'ending_action', 'ending_clock', 'clock')
+    worker_attributes = ('new_action', 'is_new_action_instant', 'complete', 'worker_exception', 'workers_failed')
+    replicated_actions = ()
+
+    def __init__(self, nthreads, verbosity=multithread.DEFAULT_VERBOSITY):
+        super(FoldedActionsProcessLockstepParallelDriver, self).__init__(nthreads, verbosity=verbosity)
+        self.context = multiprocessing.get_context('fork')
+        self.barrier = self.context.Barrier(nthreads + 1)
+        self.lock = self.context.Lock()
+        self.to_workers = [self.context.Queue() for proc in range(nthreads)]
+        self.from_workers = [self.context.Queue() for proc in range(nthreads)]
+        self.processes = []
+        self.publisher = SharedMemoryPublisher()
+
+        # Set only within worker processes
+        self.worker_proc = None
+        self.reader = None
+        self.received = None # worker attributes as last received from the driver
+
+    def loop(self, start, *args, **kwargs):
+        # Start the resource tracker before forking, so all processes share it
+        resource_tracker.ensure_running()
+        try:
+            super(FoldedActionsProcessLockstepParallelDriver, self).loop(start, *args, **kwargs)
+        except Exception:
+            self.barrier.abort()
+            raise
+        finally:
+            for process in self.processes:
+                process.join()
+            self.processes = []
+            self.publisher.close()
+
+    def _start_worker(self, proc, start, args, kwargs):
+        process = self.context.Process(target=self._worker_main, args=(proc, start, args, kwargs))
+        process.start()
+        self.processes.append(process)
+
+    def _worker_main(self, proc, start, args, kwargs):
+        self.worker_proc = proc
+        self.reader = SharedMemoryReader()
+        self.received = {name: getattr(self, name) for name in self.worker_attributes}
+        start(proc, self, *args, **kwargs)
+
+    def _barrier_wait(self):
+        if self.worker_proc is None:
+            self._driver_barrier_wait()
+        else:
+            self._worker_barrier_wait()
+
+    def _driver_barrier_wait(self):
+        state = {name: getattr(self, name) for name in self.driver_attributes + self.worker_attributes}
+        state['outputs'] = self.outputs
+        state['instant_result'] = self.instant_result
+        message = pickle.dumps(self.publisher.publish(state), pickle.HIGHEST_PROTOCOL)
+        for queue in self.to_workers:
+            queue.put(message)
+
+        self.barrier.wait() # if broken, retired blocks are unlinked at the end of `loop`
+        self.publisher.unlink_retired()
+        for queue in self.from_workers:
+            self._merge_worker_changes(queue.get())
+
+    def _worker_barrier_wait(self):
+        self.from_workers[self.worker_proc].put(self._get_worker_changes())
+        self.barrier.wait()
+
+        state = self.reader.read(pickle.loads(self.to_workers[self.worker_proc].get()))
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.received = {name: getattr(self, name) for name in self.worker_attributes}
+
+    def _get_worker_changes(self):
+        """Collect the worker attributes changed since the last barrier; counters as differences."""
+        changes = {}
+        for name in self.worker_attributes:
+            value = getattr(self, name)
+            if value is self.received[name]:
+                continue
+            if isinstance(value, int) and not isinstance(value, bool):
+                if value != self.received[name]:
+                    changes[name] = value - self.received[name]
+            else:
+                changes[name] = value
+
+        if changes.get('worker_exception') is not None:
+            ex = changes['worker_exception']
+            print("Worker process %d failed:" % self.worker_proc)
+            traceback.print_exception(type(ex), ex, ex.__traceback__)
+            try:
+                pickle.dumps(ex)
+            except Exception:
+                changes['worker_exception'] = RuntimeError("%s: %s" % (type(ex).__name__, ex))
+        return changes
+
+    def _merge_worker_changes(self, changes):
+        for name, value in changes.items():
+            if name == 'is_new_action_instant':
+                continue
+            if name == 'new_action':
+                if self.new_action:
+                    assert self.new_action == value, "Workers are requesting different driver actions."
+                else:
+                    self.new_action = value
+                    self.is_new_action_instant = changes.get('is_new_action_instant', self.is_new_action_instant)
+            elif isinstance(value, int) and not isinstance(value, bool):
+                setattr(self, name, getattr(self, name) + value)
+            elif not getattr(self, name):
+                setattr(self, name, value)
+
+    def instant_action(self, action, *args, **kwargs):
+        result = super(FoldedActionsProcessLockstepParallelDriver, self).instant_action(action, *args, **kwargs)
+        if action in self.replicated_actions:
+            getattr(self, 'instant_' + action)(*args, **kwargs)
+        return result
@@ -29,8 +29,7 @@ class LockstepParallelDriver(object):
         self.outputs = self._prepare_next()
         # Start all threads
         for proc in range(self.nthreads):
-            thread = threading.Thread(None, start, args=tuple([proc, self] + list(args)), kwargs=kwargs)
-            thread.start()
+            self._start_worker(proc, start, args, kwargs)
             
         # Initiate lockstep process
         while True:
@@ -40,23 +39,30 @@ class LockstepParallelDriver(object):
             
             # Barrier 1 is when everyone is done processing
             try:
-                self.barrier.wait()
+                self._barrier_wait()
                 self._intermission_threadsafe(next_outputs)
                 if self.verbosity > 0:
                     print("----- LOCKSTEP -----")
-                self.barrier.wait()
+                self._barrier_wait()
             except threading.BrokenBarrierError:
                 # This happens if aborted while in prepare_next
                 break
 
         try:
-            self.barrier.wait()
+            self._barrier_wait()
             self.outputs = None # report that there's no more data
-            self.barrier.wait()
+            self._barrier_wait()
         except threading.BrokenBarrierError:
             # This happens if aborted while in prepare_next
             pass
 
+    def _start_worker(self, proc, start, args, kwargs):
+        thread = threading.Thread(None, start, args=tuple([proc, self] + list(args)), kwargs=kwargs)
+        thread.start()
+
+    def _barrier_wait(self):
+        self.barrier.wait()
+
     def _intermission_threadsafe(self, next_outputs):
         # Everyone else immediately waits at barrier 2 for the data to be copied over
         self.outputs = next_outputs
@@ -65,8 +71,8 @@ class LockstepParallelDriver(object):
         raise NotImplementedError
 
     def lockstep_pause(self):
-        self.barrier.wait()
-        self.barrier.wait()
+        self._barrier_wait()
+        self._barrier_wait()
 
 class SharingLockstepParallelDriver(LockstepParallelDriver):
     """Lockstep system that introduces a Driver-level lock.
@@ -104,7 +110,7 @@ class SharingLockstepParallelDriver(LockstepParallelDriver):
                     driver.worker_exception = ex
                 driver.workers_failed += 1
             # Allow driver to check this
-            driver.barrier.wait()
+            driver._barrier_wait()
 
         driver.end_worker()
                 
@@ -0,0 +1,147 @@
+"""Bounded background read-ahead for per-year iterators.
+
+Reading and merging a year of weather can take as long as computing
+its impacts. `PrefetchIterator` moves the reading onto a background
+thread, so that up to `depth` upcoming years are loaded while the
+current year is being processed.
+
+The netCDF4 library (and the HDF5 library under it) is not
+thread-safe, so the background thread may not read a file while
+another thread is reading or writing one. All netCDF access that can
+happen while a prefetch thread is running must hold
+`climate.netcdfs.netcdf_lock`: the background thread holds it while
+each item is read, the climate readers hold it while loading a file,
+and the result writers hold it for their writes. Reading is then
+serialized with other file access, but still overlaps the
+computation of the impacts.
+"""
+
+import threading, queue
+from climate.netcdfs import netcdf_lock
+from . import timing
+
+_DONE = object() # Marks the end of the wrapped iterator
+
+def locked(iterator):
+    """Generator over `iterator`, holding `netcdf_lock` while each item is read."""
+    iterator = iter(iterator)
+    while True:
+        with netcdf_lock:
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+class PrefetchIterator(object):
+    """Iterate over `iterator`, reading up to `depth` items ahead in a thread.
+
+    Exceptions raised by the wrapped iterator (including those not
+    derived from Exception) are re-raised in the consuming thread, at
+    the point where the failing item would have been returned. Each
+    item is read while holding `netcdf_lock`. If the consumer stops
+    early, call `close` (or let the generator using this be closed) to
+    stop the background thread.
+
+    Parameters
+    ----------
+    iterator : Iterable
+        Source of items, typically (year, ds) tuples.
+    depth : int
+        Maximum number of items to read ahead. Must be >= 1.
+    name : str, optional
+        Label used when reporting statistics.
+
+    Attributes
+    ----------
+    count : int
+        Number of items handed to the consumer.
+    stalls : int
+        Number of times the consumer had to wait for an item to be read.
+    stalltime : float
+        Total seconds the consumer spent waiting.
+    """
+    def __init__(self, iterator, depth, name="weather"):
+        assert depth >= 1, "Prefetch depth must be at least 1."
+        self.name = name
+        self.count = 0
+        self.stalls = 0
+        self.stalltime = 0.
+
+        self.queue = queue.Queue(maxsize=depth)
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._produce, args=(locked(iterator),), daemon=True)
+        self.thread.start()
+
+    def _produce(self, iterator):
+        ending = (_DONE, None)
+        try:
+            for item in iterator:
+                if not self._put((item, None)):
+                    return
+        except BaseException as ex:
+            ending = (None, ex)
+        finally:
+            # Always end the queue, so the consumer never waits forever
+            self._put(ending)
+
+    def _put(self, entry):
+        """Place an entry on the queue, giving up if the consumer has stopped."""
+        while not self.stopping.is_set():
+            try:
+                self.queue.put(entry, timeout=.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.queue.empty() and self.thread.is_alive():
+            self.stalls += 1
+            time0 = timing.perf_counter()
+            item, ex = self.queue.get()
+            self.stalltime += timing.perf_counter() - time0
+        else:
+            item, ex = self.queue.get()
+
+        if ex is not None:
+            self.close()
+            raise ex
+        if item is _DONE:
+            self.close()
+            raise StopIteration
+
+        self.count += 1
+        return item
+
+    def close(self):
+        """Stop the background thread and drop any read-ahead items."""
+        self.stopping.set()
+        self.thread.join()
+
+    def report(self):
+        """Print a summary of the stalls on reading."""
+        print("Prefetch %s: %d items, %d stalls waiting on reads (%.2f s)." % (self.name, self.count, self.stalls, self.stalltime))
+
+def prefetched(iterator, depth, name="weather"):
+    """Generator over `iterator`, with `depth` items of read-ahead.
+
+    If `depth` is 0 or None, the items are read in the calling
+    thread, still holding `netcdf_lock`, since another bundle may be
+    prefetching. Otherwise, statistics are printed when the iteration
+    ends.
+    """
+    if not depth:
+        yield from locked(iterator)
+        return
+
+    prefetcher = PrefetchIterator(iterator, depth, name)
+    try:
+        for item in prefetcher:
+            yield item
+    finally:
+        prefetcher.close()
+        prefetcher.report()
@@ -6,8 +6,10 @@ from netCDF4 import Dataset
 from impactlab_tools.utils import files
 from openest.generate import fast_dataset
 import helpers.header as headre
-from climate import netcdfs
+from climate import netcdfs, reader as climatereader
+from . import prefetch, baselinecache
 from datastore import irregions
+from interpret import configs
 
 class WeatherTransformer(object):
     def push(self, year, ds):
@@ -16,6 +18,10 @@ class WeatherTransformer(object):
     def get_years(self, years):
         return years
 
+    def get_settings(self):
+        """Return the configuration of the transformer, as a dict; this excludes its state while iterating."""
+        return {}
+
 def iterate_bundles(*iterators_readers, **config):
     """
     Return bundles for each RCP and model.
@@ -24,6 +30,7 @@ def iterate_bundles(*iterators_readers, **config):
         transformer = RollingYearTransformer(config['rolling-years'])
     else:
         transformer = WeatherTransformer()
+    prefetch_years = config.get('prefetch-years', 0)
 
     print("Loading weather...")
         
@@ -31,7 +38,8 @@ def iterate_bundles(*iterators_readers, **config):
         for scenario, model, pastreader, futurereader in iterators_readers[0]:
             if 'gcm' in config and config['gcm'] != model:
                 continue
-            weatherbundle = PastFutureWeatherBundle([(pastreader, futurereader)], scenario, model, transformer=transformer)
+            weatherbundle = PastFutureWeatherBundle([(pastreader, futurereader)], scenario, model, transformer=transformer, prefetch_years=prefetch_years)
+            subset_filter_region(weatherbundle, config)
             yield scenario, model, weatherbundle
         return
     
@@ -48,9 +56,15 @@ def iterate_bundles(*iterators_readers, **config):
         if len(scenmodels[(scenario, model)]) < len(iterators_readers):
             continue
 
-        weatherbundle = PastFutureWeatherBundle(scenmodels[(scenario, model)], scenario, model, transformer=transformer)
+        weatherbundle = PastFutureWeatherBundle(scenmodels[(scenario, model)], scenario, model, transformer=transformer, prefetch_years=prefetch_years)
+        subset_filter_region(weatherbundle, config)
         yield scenario, model, weatherbundle
 
+def subset_filter_region(weatherbundle, config):
+    """Under `filter-region`, limit the weather read to the regions that will be computed."""
+    if config.get('filter-region') is not None:
+        weatherbundle.subset_regions(configs.get_regions(weatherbundle.regions, config['filter-region']))
+
 def iterate_amorphous_bundles(iterators_reader_dict):
     scenmodels = {} # {(scenario, model): [(pastreader, futurereader), ...]}
     for name in iterators_reader_dict:
@@ -95,7 +109,7 @@ class WeatherBundle(object):
         """Load the rows of hierarchy.csv associated with all known regions."""
         if reader is not None:
             try:
-                self.regions = list(reader.get_regions())
+                self.regions = irregions.RegionIndex.of(reader.get_regions())
                 if not isinstance(self.regions[0], str) and np.issubdtype(self.regions[0], np.integer):
                     self.regions = irregions.load_regions(self.hierarchy, self.dependencies)
             except Exception as ex:
@@ -183,8 +197,54 @@ class DailyWeatherBundle(WeatherBundle):
         for ii in range(len(self.regions)):
             yield self.regions[ii], region_averages[ii]
 
-    def baseline_values(self, maxyear, do_mean=True, quiet=False, only_region=None):
-        """Yield the list of all weather values up to `maxyear` for each region."""
+    def get_readers(self):
+        """Return the list of all weather readers used by this bundle."""
+        return []
+
+    def report_timing(self):
+        """Print the time spent reordering regions and the year cache use of any of the readers."""
+        for reader in self.get_readers():
+            for subreader in climatereader.iterate_wrapped(reader):
+                if isinstance(subreader, (climatereader.RegionReorderWeatherReader, climatereader.HistoricalCycleReader)):
+                    subreader.report()
+
+    def subset_regions(self, regions):
+        """Read weather only for `regions`, a subset of `self.regions`.
+
+        The readers are asked to read only these regions from each
+        file, and `self.regions` is replaced by `regions`. If any
+        reader does not support this, all regions continue to be read.
+
+        Returns
+        -------
+        bool
+            True if the readers were subset.
+        """
+        readers = self.get_readers()
+        if not readers or not all(reader.can_subset_regions() for reader in readers):
+            print("WARNING: Weather readers cannot read a subset of regions; reading all regions.")
+            return False
+
+        indices = irregions.RegionIndex.of(self.regions).indices(regions)
+        for reader in readers:
+            reader.subset_regions(indices)
+        self.regions = irregions.RegionIndex.of(regions)
+        self._saved_baseline_values = None
+        return True
+
+    def get_baseline_sources(self, maxyear):
+        """Describe the weather read for the baseline up to `maxyear`.
+
+        Returns
+        -------
+        tuple of (list, list of str) or None
+            A description of the readers and the files that they read,
+            used by `generate.baselinecache`, or None if unknown.
+        """
+        return None
+
+    def baseline_dataset(self, maxyear, do_mean=True, quiet=False):
+        """Return all weather values up to `maxyear`, concatenated along time."""
 
         if self._caching_baseline_values and self._saved_baseline_values is not None:
             values = self._saved_baseline_values
@@ -211,6 +271,12 @@ class DailyWeatherBundle(WeatherBundle):
         if self._caching_baseline_values and self._saved_baseline_values is None:
             self._saved_baseline_values = values
 
+        return values
+
+    def baseline_values(self, maxyear, do_mean=True, quiet=False, only_region=None):
+        """Yield the list of all weather values up to `maxyear` for each region."""
+        values = self.baseline_dataset(maxyear, do_mean=do_mean, quiet=quiet)
+
         # Yield the entire collection of values for each region
         if only_region is not None:
             yield only_region, values.sel(region=only_region)
@@ -218,10 +284,34 @@ class DailyWeatherBundle(WeatherBundle):
             for ii in range(len(self.regions)):
                 yield self.regions[ii], values.sel(region=self.regions[ii])
 
+    def baseline_matrix(self, maxyear, variables, quiet=False):
+        """Return the annual means up to `maxyear` of the first of `variables` present.
+
+        Returns
+        -------
+        dsvar : str
+            The variable found.
+        values : ndarray
+            (years x regions) array of annual means.
+        """
+        values = self.baseline_dataset(maxyear, quiet=quiet)
+        for dsvar in variables:
+            if dsvar in values._variables:
+                break
+        else:
+            raise ValueError("None of %s in the baseline weather." % ', '.join(variables))
+
+        data = values[dsvar]
+        dims = list(data.dims)
+        return dsvar, np.moveaxis(np.asarray(data.values), [dims.index('time'), dims.index('region')], [0, 1])
+
 class SingleWeatherBundle(ReaderWeatherBundle, DailyWeatherBundle):
     def is_historical(self):
         return False
 
+    def get_readers(self):
+        return [self.reader]
+
     def yearbundles(self, maxyear=np.inf, variable_ofinterest=None):
         for year, ds in self.reader.read_iterator_to(maxyear):
             for year2, ds2 in self.transformer.push(year, ds):
@@ -231,9 +321,10 @@ class SingleWeatherBundle(ReaderWeatherBundle, DailyWeatherBundle):
         return self.transformer.get_years(self.reader.get_years())
 
 class PastFutureWeatherBundle(DailyWeatherBundle):
-    def __init__(self, pastfuturereaders, scenario, model, hierarchy='hierarchy.csv', transformer=WeatherTransformer()):
+    def __init__(self, pastfuturereaders, scenario, model, hierarchy='hierarchy.csv', transformer=WeatherTransformer(), prefetch_years=0):
         super(PastFutureWeatherBundle, self).__init__(scenario, model, hierarchy, transformer)
         self.pastfuturereaders = pastfuturereaders
+        self.prefetch_years = prefetch_years
 
         self.variable2readers = {}
         for pastfuturereader in pastfuturereaders:
@@ -255,15 +346,26 @@ class PastFutureWeatherBundle(DailyWeatherBundle):
         return False
 
     def yearbundles(self, maxyear=np.inf, variable_ofinterest=None):
-        """Yields xarray Datasets for each year up to (but not including) `maxyear`"""
+        """Yields xarray Datasets for each year up to (but not including) `maxyear`
+
+        If `prefetch_years` is set, the weather is read that many
+        years ahead on a background thread.
+        """
+        for year, ds in prefetch.prefetched(self.read_yearbundles(maxyear, variable_ofinterest), self.prefetch_years, name=self.model):
+            for year2, ds2 in self.transformer.push(year, ds):
+                yield year2, ds2
+
+        self.report_timing()
+
+    def read_yearbundles(self, maxyear=np.inf, variable_ofinterest=None):
+        """Yields the untransformed (year, xarray Dataset) for each year up to (but not including) `maxyear`"""
         if len(self.pastfuturereaders) == 1:
             year = None # In case no additional years in pastreader
             for ds in self.pastfuturereaders[0][0].read_iterator_to(min(self.futureyear1, maxyear)):
                 assert ds.region.shape[0] == len(self.regions), "Region length mismatch: %d <> %d" % (ds.region.shape[0], len(self.regions))
                 year = ds['time.year'][0]
                 year = int(year.values) if isinstance(year, xr.DataArray) else int(year)
-                for year2, ds2 in self.transformer.push(year, ds):
-                    yield year2, ds2
+                yield year, ds
 
             if year is None:
                 lastyear = self.futureyear1 - 1
@@ -276,8 +378,7 @@ class PastFutureWeatherBundle(DailyWeatherBundle):
                     if year <= lastyear:
                         continue # allow for overlapping weather
                     assert ds.region.shape[0] == len(self.regions), "Region length mismatch: %d <> %d" % (ds.region.shape[0], len(self.regions))
-                    for year2, ds2 in self.transformer.push(year, ds):
-                        yield year2, ds2
+                    yield year, ds
             return
 
         # Set this here so it's not called in nested for-loops.
@@ -317,8 +418,20 @@ class PastFutureWeatherBundle(DailyWeatherBundle):
                 assert ds.region.shape[0] == len(self.regions)
                 allds = fast_dataset.merge((allds, ds)) #xr.merge((allds, ds))
 
-            for year2, ds2 in self.transformer.push(year, allds):
-                yield year2, ds2
+            yield year, allds
+
+    def get_readers(self):
+        return [reader for pastfuturereader in self.pastfuturereaders for reader in pastfuturereader]
+
+    def get_baseline_sources(self, maxyear):
+        description, files = [], []
+        for pastreader, futurereader in self.pastfuturereaders:
+            for reader in [pastreader, futurereader]:
+                years = [year for year in reader.get_years() if year <= maxyear]
+                readerdescription, readerfiles = baselinecache.describe_reader(reader, years)
+                description.append(readerdescription)
+                files.extend(readerfiles)
+        return description, files
 
     def get_reader_years(self):
         return np.unique(self.pastfuturereaders[0][0].get_years() + self.pastfuturereaders[0][1].get_years())
@@ -361,6 +474,7 @@ class HistoricalWeatherBundle(DailyWeatherBundle):
     def __init__(self, pastreaders, futureyear_end, seed, scenario, model, hierarchy='hierarchy.csv', transformer=WeatherTransformer(), pastyear_end=None):
         super(HistoricalWeatherBundle, self).__init__(scenario, model, hierarchy, transformer)
         self.pastreaders = pastreaders
+        self.yearcache = climatereader.YearCache(model + ' histclim')
 
         onereader = self.pastreaders[0]
         years = onereader.get_years()
@@ -423,28 +537,40 @@ class HistoricalWeatherBundle(DailyWeatherBundle):
                 if year > maxyear:
                     break
 
-                ds = self.pastreaders[0].read_year(pastyear)
+                ds = self.yearcache.get(pastyear, lambda: self.pastreaders[0].read_year(pastyear))
                 ds = self.update_year(ds, pastyear, year)
                 
                 for year2, ds2 in self.transformer.push(year, ds):
                     yield year2, ds2
                 year += 1
+
+            self.report_timing()
             return
             
         for pastyear in self.pastyears:
             if year > maxyear:
                 break
-            allds = xr.Dataset({'region': self.regions})
-            for pastreader in self.pastreaders:
-                ds = pastreader.read_year(pastyear)
-                allds = fast_dataset.merge((allds, ds)) #xr.merge((allds, ds))
-
+            allds = self.yearcache.get(pastyear, lambda: self.read_pastyear(pastyear))
             allds = self.update_year(allds, pastyear, year)
                 
             for year2, ds2 in self.transformer.push(year, allds):
                 yield year2, ds2
             year += 1
 
+        self.report_timing()
+
+    def read_pastyear(self, pastyear):
+        """Merge the weather of all readers for `pastyear`."""
+        allds = xr.Dataset({'region': self.regions})
+        for pastreader in self.pastreaders:
+            ds = pastreader.read_year(pastyear)
+            allds = fast_dataset.merge((allds, ds)) #xr.merge((allds, ds))
+        return allds
+
+    def report_timing(self):
+        super(HistoricalWeatherBundle, self).report_timing()
+        self.yearcache.report()
+
     def update_year(self, ds, pastyear, futureyear):
         """Corrects resampled weather Dataset 'time' coordinate to a new range
 
@@ -463,13 +589,25 @@ class HistoricalWeatherBundle(DailyWeatherBundle):
         if isinstance(ds['time'][0], np.datetime64):
             ds['time']._values = np.array([str(futureyear) + str(date)[4:] for date in ds['time']._values])
         elif ds['time'][0] < 10000:
-            ds['time']._values += futureyear - pastyear # YYYY
+            ds['time']._values = ds['time']._values + (futureyear - pastyear) # YYYY
         elif ds['time'][0] < 1000000:
-            ds['time']._values += (futureyear - pastyear) * 100 # YYYYMM
+            ds['time']._values = ds['time']._values + (futureyear - pastyear) * 100 # YYYYMM
         else:
-            ds['time']._values += (futureyear - pastyear) * 1000 # YYYYDDD
+            ds['time']._values = ds['time']._values + (futureyear - pastyear) * 1000 # YYYYDDD
         return ds
             
+    def get_readers(self):
+        return list(self.pastreaders)
+
+    def get_baseline_sources(self, maxyear):
+        pastyears = [int(pastyear) for pastyear in self.pastyears[:max(0, int(maxyear - self.pastyear_start + 1))]]
+        description, files = [pastyears], []
+        for pastreader in self.pastreaders:
+            readerdescription, readerfiles = baselinecache.describe_reader(pastreader, sorted(set(pastyears)))
+            description.append(readerdescription)
+            files.extend(readerfiles)
+        return description, files
+
     def get_years(self):
         """Get list of years represented in this bundle"""
         return self.transformer.get_years(list(range(int(self.pastyear_start), int(self.futureyear_end) + 1)))
@@ -513,6 +651,17 @@ class AmorphousWeatherBundle(WeatherBundle):
 class RollingYearTransformer(WeatherTransformer):
     """WeatherTransformer giving years and weather for a number of past years
 
+    Rather than concatenating the past years anew each year, each
+    year's weather is copied once into a buffer with room for twice
+    `rolling_years` years, and each rolling window is a view onto
+    consecutive years of the buffer. When the buffer is full, the
+    latest years are copied to the start of a new buffer, so windows
+    that have already been yielded are never overwritten.
+
+    Years are located in the buffer by their cumulative time offsets,
+    so they may differ in length (such as 365- and 366-day years). A
+    new buffer is also started if a year is longer than the space left.
+
     Parameters
     ----------
     rolling_years : int, optional
@@ -525,9 +674,22 @@ class RollingYearTransformer(WeatherTransformer):
         self.pastdses = []
         self.last_year = None
 
+        self.layout = None # description of the variables in the buffer
+        self.buffer = None # {name: (dims, array)}, including 'time'
+        self.starts = [0] # time offset of each year in the buffer, and of the end of the last
+        self.buffered = 0 # number of consecutive years in the buffer
+
+    @property
+    def position(self):
+        """The number of years in the buffer."""
+        return len(self.starts) - 1
+
     def get_years(self, years):
         """Get rolling years from 'years' sequence"""
         return years[:-self.rolling_years + 1]
+
+    def get_settings(self):
+        return dict(rolling_years=self.rolling_years)
         
     def push(self, year, ds):
         """Yield transformed year(s) and Dataset(s) for year and Dataset
@@ -548,6 +710,7 @@ class RollingYearTransformer(WeatherTransformer):
         """
         if self.last_year is not None and year != self.last_year + 1:
             self.pastdses = []
+            self.buffered = 0
         self.last_year = year
         
         if len(self.pastdses) < self.rolling_years:
@@ -555,7 +718,117 @@ class RollingYearTransformer(WeatherTransformer):
         else:
             self.pastdses = self.pastdses[1:] + [ds]
 
+        coords = self.buffer_year(ds)
+
         if len(self.pastdses) == self.rolling_years:
-            ds = fast_dataset.concat(self.pastdses, dim='time')
+            if self.buffered >= self.rolling_years:
+                ds = self.get_window(ds, coords)
+            else:
+                ds = fast_dataset.concat(self.pastdses, dim='time')
             yield year - self.rolling_years + 1, ds
 
+    def buffer_year(self, ds):
+        """Copy the weather in `ds` into the buffer, if it can be stored there.
+
+        Returns
+        -------
+        dict
+            The coordinates of `ds`.
+        """
+        coords = getattr(ds, 'original_coords', None)
+        if coords is None:
+            coords = {name: ds.coords[name] for name in ds.coords}
+
+        variables = get_time_variables(ds, coords)
+        if variables is None:
+            self.layout = None
+            self.buffered = 0
+            return coords
+
+        timelen = len(variables['time'][1])
+        # The length of the time dimension may differ between years
+        layout = tuple((name, dims, values.shape[:dims.index('time')] + values.shape[dims.index('time') + 1:], values.dtype.str)
+                       for name, (dims, values) in sorted(variables.items()))
+        if layout != self.layout:
+            self.layout = layout
+            self.buffer = None
+            self.buffered = 0
+
+        capacity = 2 * self.rolling_years
+        if self.buffer is None or self.position == capacity or self.starts[-1] + timelen > self.buffer['time'][1].shape[0]:
+            # Start a new buffer, since earlier windows may still be in use
+            keep = min(self.buffered, self.rolling_years - 1)
+            keepstarts = self.starts[self.position - keep:] if keep > 0 else [0]
+            yearlens = np.diff(keepstarts).tolist() + [timelen]
+            newbuffer = {}
+            for name, (dims, values) in variables.items():
+                axis = dims.index('time')
+                shape = list(values.shape)
+                shape[axis] = capacity * max(yearlens)
+                newbuffer[name] = (dims, np.empty(shape, dtype=values.dtype))
+                if keep > 0:
+                    olddims, oldvalues = self.buffer[name]
+                    newbuffer[name][1][time_slice(axis, 0, keepstarts[-1] - keepstarts[0])] = oldvalues[time_slice(axis, keepstarts[0], keepstarts[-1])]
+            self.buffer = newbuffer
+            self.starts = [start - keepstarts[0] for start in keepstarts]
+
+        for name, (dims, values) in variables.items():
+            axis = dims.index('time')
+            self.buffer[name][1][time_slice(axis, self.starts[-1], self.starts[-1] + timelen)] = values
+        self.starts.append(self.starts[-1] + timelen)
+        self.buffered += 1
+
+        return coords
+
+    def get_window(self, ds, coords):
+        """Construct a dataset of views onto the last `rolling_years` years of the buffer."""
+        start = self.starts[self.position - self.rolling_years]
+        end = self.starts[self.position]
+
+        data_vars = {}
+        windowcoords = dict(coords)
+        for name, (dims, values) in self.buffer.items():
+            view = values[time_slice(dims.index('time'), start, end)]
+            if name == 'time':
+                windowcoords['time'] = view
+            else:
+                data_vars[name] = (dims, view)
+
+        return type(ds)(data_vars, coords=windowcoords, attrs=dict(self.pastdses[0].attrs))
+
+def get_time_variables(ds, coords):
+    """Return {name: (dims, values)} for the time coordinate and variables of `ds`.
+
+    Returns None if any variable or coordinate other than time lacks
+    or shares the time dimension, since these cannot be buffered.
+    """
+    if 'time' not in coords:
+        return None
+
+    timevar = ds['time']
+    variables = {'time': (('time',), np.asarray(timevar._values if hasattr(timevar, '_values') else timevar.values))}
+    if variables['time'][1].ndim != 1:
+        return None
+
+    for name in coords:
+        if name != 'time' and 'time' in getattr(coords[name], 'dims', ()):
+            return None
+
+    for name in ds.variables:
+        if name in coords:
+            continue
+        variable = ds.variables[name]
+        dims = tuple(variable.dims)
+        if 'time' not in dims:
+            return None
+        values = np.asarray(variable._values if hasattr(variable, '_values') else variable.values)
+        if values.shape[dims.index('time')] != len(variables['time'][1]):
+            return None
+        variables[name] = (dims, values)
+
+    return variables
+
+def time_slice(axis, start, end):
+    """Index selecting [start, end) along `axis`."""
+    return (slice(None),) * axis + (slice(start, end),)
+
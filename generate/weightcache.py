@@ -0,0 +1,194 @@
+"""Bounded cache of aggregation weights, with an optional on-disk form.
+
+The aggregator loads weights (population, income, area, age cohorts,
+and their products) for every combination of economic model,
+scenario, age group, and range of years that it encounters, and keeps
+them for reuse. `WeightCache` keeps the most recently used weights, up
+to the size limit given by the `weight-cache-mb` option, and counts
+hits, misses, and evictions.
+
+Weights requested for a known list of regions are materialized as a
+(years x regions) array (`MaterializedWeights`), which is both
+compact and exactly sized. If the `weight-cache-dir` option is given,
+these arrays are also saved as `.npz` files, so that later processes
+can load them directly, rather than re-reading and re-interpreting the
+weighting files. Entries are keyed by the configured weighting
+description, so the directory should be cleared if the underlying
+weighting data changes.
+"""
+
+import os, json, hashlib
+from collections import OrderedDict
+import numpy as np
+from datastore import spacetime
+
+class MaterializedWeights(spacetime.SpaceTimeLoadedData):
+    """Weights for a fixed list of regions, as a (years x regions) array.
+
+    If the weights are constant over time, `array` has a single row
+    and `get_time` returns a scalar, like the weights it replaces.
+    """
+    def __init__(self, year0, year1, regions, array):
+        super(MaterializedWeights, self).__init__(year0, year1, regions, array)
+
+    def get_time(self, region):
+        ii = self.indices.get(region, None)
+        if ii is None:
+            return None
+        if self.array.shape[0] == 1:
+            return self.array[0, ii]
+        return self.array[:, ii]
+
+def materialize(stweight, regions):
+    """Return the weights of `stweight` for all `regions`, as a (years x regions) array.
+
+    Regions with weights for fewer years limit the years of all
+    regions. If every region has a constant weight, the array has a
+    single row. Raises a ValueError if any region has no weights.
+    """
+    series = [stweight.get_time(region) for region in regions]
+    missing = [region for region, wws in zip(regions, series) if wws is None]
+    if missing:
+        raise ValueError("No weights for %d regions, including %s." % (len(missing), ', '.join(missing[:5])))
+
+    series = [np.array(wws, dtype=float) for wws in series]
+    lengths = [len(wws) for wws in series if len(wws.shape) == 1]
+    array = np.zeros((min(lengths) if lengths else 1, len(regions)))
+    for ii, wws in enumerate(series):
+        array[:, ii] = wws[:array.shape[0]] if len(wws.shape) == 1 else wws
+    return array
+
+def weight_nbytes(stweight):
+    """Estimate the memory held by a weighting object, in bytes.
+
+    Arrays and region mappings are counted, along with the components
+    of product weights; data loaded lazily by other objects is not.
+    """
+    if isinstance(stweight, np.ndarray):
+        return stweight.nbytes
+    nbytes = 0
+    if isinstance(getattr(stweight, 'array', None), np.ndarray):
+        nbytes += stweight.array.nbytes
+    for attr in ['mapping', 'indices']:
+        if isinstance(getattr(stweight, attr, None), dict):
+            nbytes += 100 * len(getattr(stweight, attr))
+    for attr in ['spdata1', 'spdata2']:
+        if hasattr(stweight, attr):
+            nbytes += weight_nbytes(getattr(stweight, attr))
+    return nbytes
+
+class WeightCache(object):
+    """Least-recently-used cache of loaded weights.
+
+    Parameters
+    ----------
+    limit_mb : float, optional
+        Size limit, in MB. If None (the default), nothing is evicted.
+    cachedir : str, optional
+        Directory in which to save materialized weights.
+    """
+    def __init__(self, limit_mb=None, cachedir=None):
+        self.limit_mb = limit_mb
+        self.cachedir = cachedir
+        self.descriptions = {} # {halfweight: configured description}
+        self.clear()
+
+    def clear(self):
+        self.entries = OrderedDict() # {key: (value, nbytes)}
+        self.nbytes = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = dict(hits=0, misses=0, evictions=0, diskhits=0)
+
+    def add_stats(self, stats):
+        """Include the counts from another cache, such as one in a worker process."""
+        for name in stats:
+            self.stats[name] += stats[name]
+
+    def describe(self, halfweight, description):
+        """Record the configured description of `halfweight`, allowing its weights to be saved."""
+        self.descriptions[halfweight] = description
+
+    def get(self, key, load):
+        """Return the value for `key`, calling `load()` to produce it if it is not cached."""
+        if key in self.entries:
+            self.stats['hits'] += 1
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+        self.stats['misses'] += 1
+        value = load()
+        self.add(key, value)
+        return value
+
+    def add(self, key, value):
+        nbytes = weight_nbytes(value)
+        limit = None if self.limit_mb is None else self.limit_mb * 1e6
+        if limit is not None and nbytes > limit:
+            return
+
+        self.entries[key] = (value, nbytes)
+        self.nbytes += nbytes
+        while limit is not None and self.nbytes > limit:
+            oldkey, (oldvalue, oldbytes) = self.entries.popitem(last=False)
+            self.nbytes -= oldbytes
+            self.stats['evictions'] += 1
+
+    def get_materialized(self, halfweight, weight_args, year0, year1, regions):
+        """Return `MaterializedWeights` of `halfweight` for `regions`.
+
+        Loads the weights from `cachedir`, if they have been saved
+        there, and otherwise from `halfweight`, saving them for later.
+        """
+        key = (halfweight, weight_args, year0, year1, tuple(regions))
+        return self.get(key, lambda: self.load_materialized(halfweight, weight_args, year0, year1, regions))
+
+    def load_materialized(self, halfweight, weight_args, year0, year1, regions):
+        path = self.get_path(halfweight, weight_args, year0, year1, regions)
+        if path is not None and os.path.exists(path):
+            try:
+                with np.load(path) as data:
+                    if list(data['regions']) == list(regions):
+                        self.stats['diskhits'] += 1
+                        return MaterializedWeights(year0, year1, list(regions), data['values'])
+            except Exception as ex:
+                print("WARNING: Could not read weight cache %s." % path)
+                print(ex)
+
+        # Load weights; this may take a minute
+        print("Loading weights...")
+        stweight = halfweight.load(year0, year1, *weight_args)
+        weights = MaterializedWeights(year0, year1, list(regions), materialize(stweight, regions))
+        print("Loaded.")
+
+        if path is not None:
+            try:
+                self.save(path, weights)
+            except Exception as ex:
+                print("WARNING: Could not write weight cache %s." % path)
+                print(ex)
+
+        return weights
+
+    def get_path(self, halfweight, weight_args, year0, year1, regions):
+        """Return the path for saving these weights, or None if they cannot be saved."""
+        if not self.cachedir or halfweight not in self.descriptions:
+            return None
+        regionhash = hashlib.sha1('\n'.join(map(str, regions)).encode('utf-8')).hexdigest()
+        key = json.dumps([self.descriptions[halfweight], list(map(str, weight_args)), int(year0), int(year1), regionhash])
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cachedir, 'weights-' + digest + '.npz')
+
+    def save(self, path, weights):
+        os.makedirs(self.cachedir, exist_ok=True)
+        # Write under a temporary name, so concurrent runs never see a partial file
+        tmppath = path[:-4] + '-%d.tmp.npz' % os.getpid()
+        np.savez(tmppath, values=weights.array, regions=np.array(weights.regions, dtype=str))
+        os.replace(tmppath, path)
+
+    def report(self):
+        """Print the cache statistics."""
+        if self.stats['hits'] + self.stats['misses'] > 0:
+            print("Weight cache: %d hits, %d misses (%d read from disk), %d evictions (%.1f MB held)." % (
+                self.stats['hits'], self.stats['misses'], self.stats['diskhits'], self.stats['evictions'], self.nbytes / 1e6))
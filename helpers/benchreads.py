@@ -0,0 +1,41 @@
+"""Compare reading whole yearly weather files with reading only the needed variables.
+
+Usage:
+```
+python -m helpers.benchreads TEMPLATE YEAR1 REGIONVAR VARIABLE [VARIABLE ...]
+```
+
+where TEMPLATE is a yearly file template (e.g., `.../tas_day_%d.nc`,
+possibly with `%v` for versions), as used by `DailyWeatherReader`.
+For each of up to 5 years, reports the bytes loaded into memory and
+the time taken, loading every variable in the file and loading only
+the given variables.
+"""
+
+import sys, time
+from climate import netcdfs
+from climate.reader import YearlySplitWeatherReader
+
+def time_load(filename, variables=None):
+    start = time.perf_counter()
+    ds = netcdfs.load_netcdf(filename, variables=variables)
+    elapsed = time.perf_counter() - start
+    return ds.nbytes, elapsed
+
+if __name__ == '__main__':
+    template, year1, regionvar = sys.argv[1], int(sys.argv[2]), sys.argv[3]
+    variables = sys.argv[4:] + [regionvar]
+
+    totals = {'all': [0, 0.], 'subset': [0, 0.]}
+    numyears = 0
+    for year in range(year1, year1 + 5):
+        filename = YearlySplitWeatherReader.find_templated_given(template, year)
+        for label, subset in [('all', None), ('subset', variables)]:
+            nbytes, elapsed = time_load(filename, subset)
+            totals[label][0] += nbytes
+            totals[label][1] += elapsed
+            print("%d %-6s: %8.1f MB in %.3f s" % (year, label, nbytes / 1e6, elapsed))
+        numyears += 1
+
+    for label in ['all', 'subset']:
+        print("Per year (%s): %.1f MB in %.3f s" % (label, totals[label][0] / 1e6 / numyears, totals[label][1] / numyears))
@@ -0,0 +1,29 @@
+"""Compare finding every region's position with `list.index` and with `RegionIndex`.
+
+Usage:
+```
+python -m helpers.benchregions [COUNT]
+```
+
+where COUNT is the number of synthetic regions (default: 24378, the
+number of impact regions). Reports the time taken to find the
+position of every region with each approach.
+"""
+
+import sys, time
+from datastore.irregions import RegionIndex
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 24378
+    regions = ["R%05d.%d" % (ii // 10, ii % 10) for ii in range(count)]
+
+    time0 = time.perf_counter()
+    indices = {region: regions.index(region) for region in regions}
+    print("list.index:   %.3f s" % (time.perf_counter() - time0))
+
+    time0 = time.perf_counter()
+    region_index = RegionIndex.of(regions)
+    indices2 = region_index.get_indices_dict(regions)
+    print("RegionIndex:  %.3f s (including construction)" % (time.perf_counter() - time0))
+
+    assert indices == indices2
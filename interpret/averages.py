@@ -7,13 +7,25 @@ the "Covariate Averging" section in docs/generate.md for more details.
 """
 
 from impactcommon.math import averages
+from adaptation import columnar
 
 lookup = {'mean': averages.MeanAverager,
           'median': averages.MedianAverager,
           'bucket': averages.BucketAverager,
           'bartlett': averages.BartlettAverager}
 
+columnar_lookup = {'mean': columnar.ColumnarMeanAverager,
+                   'median': columnar.ColumnarMedianAverager,
+                   'bucket': columnar.ColumnarBucketAverager,
+                   'bartlett': columnar.ColumnarBartlettAverager}
+
 def interpret(config, default, values):
     avgcls = config.get('class', default['class'])
     assert avgcls in lookup
     return lookup[avgcls](values, config.get('length', default['length']))
+
+def interpret_columnar(config, default, valueses):
+    """As `interpret`, but returns a ColumnarAverager for a sequence of per-region values."""
+    avgcls = config.get('class', default['class'])
+    assert avgcls in columnar_lookup
+    return columnar_lookup[avgcls](valueses, config.get('length', default['length']))
@@ -3,6 +3,7 @@ from pathlib import Path
 from impactlab_tools.utils import paralog
 from impactlab_tools.utils.files import get_file_config
 from collections.abc import MutableMapping, MutableSequence
+from datastore import irregions
 
 global_statman = None
 
@@ -205,6 +206,7 @@ def get_regions(allregions, filter_region):
                 if filter_region(allregions[ii]):
                     my_regions.append(allregions[ii])
         assert my_regions != [], "No regions remain after filter."
+        my_regions = irregions.RegionIndex.of(my_regions)
 
     return my_regions
 
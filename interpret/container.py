@@ -4,6 +4,7 @@ import os, glob, copy, warnings
 from impactlab_tools.utils import files
 from generate import weather, server, effectset, caller, checks, pvalses
 from adaptation import csvvfile
+from climate import reader
 from climate.discover import discover_variable, discover_derived_variable, standard_variable
 from interpret import configs
 
@@ -14,6 +15,9 @@ def get_bundle_iterator(config):
     if 'timerate' not in config:
         print("Warning: 'timerate' not found in the configuration; assuming daily.")
     timerate = config.get('timerate', 'day')
+    if config.get('weather-manifest'):
+        reader.listings.use_manifest(config['weather-manifest'])
+    reader.YearCache.default_limit_mb = config.get('histclim-cache-mb', 0)
     discoverers = []
     for variable in config['climate']:
         discoverers.append(standard_variable(variable, timerate, **config))
@@ -74,12 +78,21 @@ def produce(targetdir, weatherbundle, economicmodel, pvals, config, push_callbac
     if push_callback is None:
         push_callback = lambda reg, yr, app, predget, mod: None
 
+    # Under `multiplex`, collect every calculation and run them in one pass
+    if config.get('multiplex', False) and not profile and not diagnosefile:
+        jobs = []
+    else:
+        jobs = None
+
     for model, csvvpath, module, specconf in get_modules_csvv(config):
         basename = os.path.basename(csvvpath)[:-5]
-        produce_csvv(basename, csvvpath, module, specconf, targetdir, weatherbundle, economicmodel, pvals, configs.merge(config, model), push_callback, suffix, profile, diagnosefile)
+        produce_csvv(basename, csvvpath, module, specconf, targetdir, weatherbundle, economicmodel, pvals, configs.merge(config, model), push_callback, suffix, profile, diagnosefile, jobs=jobs)
         if profile:
             return
 
+    if jobs:
+        effectset.generate_multiplexed(targetdir, jobs, weatherbundle, config, economicmodel=economicmodel)
+
 def csvv_organization(specconf):
     """Interpret the `csvv-organization` option in the configuration to split a CSVV up into pieces."""
     if specconf.get('csvv-organization', 'normal') == 'three-ages':
@@ -90,8 +103,22 @@ def csvv_organization(specconf):
         return ["lowrisk", "highrisk"]
     else:
         return None
-        
-def produce_csvv(basename, csvv, module, specconf, targetdir, weatherbundle, economicmodel, pvals, config, push_callback, suffix, profile, diagnosefile):
+
+def generate_or_queue(jobs, targetdir, basename, weatherbundle, calculation, description, dependencies, config, push_callback, diagnosefile=False, deltamethod_vcv=False, economicmodel=None, fingerprint=None):
+    """Run `effectset.generate` now, or add the calculation to `jobs` if multiplexing.
+
+    `fingerprint` identifies the CSVV of a queued calculation, so that a
+    checkpoint of the multiplexed run is only resumed with the same
+    coefficients. Queued calculations keep `config`, the merged
+    configuration of their model, for `effectset.generate_multiplexed`.
+    """
+    if jobs is None:
+        effectset.generate(targetdir, basename, weatherbundle, calculation, description, dependencies, config, push_callback=push_callback, diagnosefile=diagnosefile, deltamethod_vcv=deltamethod_vcv, economicmodel=economicmodel)
+    else:
+        jobs.append(dict(basename=basename, calculation=calculation, description=description, dependencies=dependencies,
+                         push_callback=push_callback, deltamethod_vcv=deltamethod_vcv, fingerprint=fingerprint, config=config))
+
+def produce_csvv(basename, csvv, module, specconf, targetdir, weatherbundle, economicmodel, pvals, config, push_callback, suffix, profile, diagnosefile, jobs=None):
     csvv_parts = csvv_organization(specconf)
     if csvv_parts is not None:
         specconf_part = copy.copy(specconf)
@@ -103,9 +130,11 @@ def produce_csvv(basename, csvv, module, specconf, targetdir, weatherbundle, eco
             produce_csvv(basename + '-' + csvv_parts[partii],
                          csvvfile.subset(csvv, slice(int(partii * n_csvv / n_parts), int((partii + 1) * n_csvv / n_parts))),
                          module, specconf_part, targetdir, weatherbundle, economicmodel, pvals, config, push_callback, suffix,
-                         profile, diagnosefile)
+                         profile, diagnosefile, jobs=jobs)
         return
 
+    fingerprint = csvvfile.fingerprint(csvv) if jobs is not None else None
+
     deltamethod_vcv = False
     if config.get('deltamethod', False):
         if isinstance(csvv, str):
@@ -117,7 +146,7 @@ def produce_csvv(basename, csvv, module, specconf, targetdir, weatherbundle, eco
         print("Full Adaptation")
         calculation, dependencies, baseline_get_predictors = caller.call_prepare_interp(csvv, module, weatherbundle, economicmodel, pvals[basename], specconf=specconf, config=config, standard=False)
 
-        effectset.generate(targetdir, basename + suffix, weatherbundle, calculation, specconf['description'] + ", with interpolation and adaptation through interpolation.", dependencies + weatherbundle.dependencies + economicmodel.dependencies, config, push_callback=lambda reg, yr, app: push_callback(reg, yr, app, baseline_get_predictors, basename), diagnosefile=diagnosefile.replace('.csv', '-' + basename + '.csv') if diagnosefile else False, deltamethod_vcv=deltamethod_vcv)
+        generate_or_queue(jobs, targetdir, basename + suffix, weatherbundle, calculation, specconf['description'] + ", with interpolation and adaptation through interpolation.", dependencies + weatherbundle.dependencies + economicmodel.dependencies, config, push_callback=make_push_callback(push_callback, baseline_get_predictors, basename), diagnosefile=diagnosefile.replace('.csv', '-' + basename + '.csv') if diagnosefile else False, deltamethod_vcv=deltamethod_vcv, economicmodel=economicmodel, fingerprint=fingerprint)
 
         # Make sure to save any random decisions to the pvals file
         if not isinstance(pvals, pvalses.PlaceholderPvals):
@@ -133,9 +162,17 @@ def produce_csvv(basename, csvv, module, specconf, targetdir, weatherbundle, eco
         if check_doit(targetdir, basename + "-noadapt", suffix, config):
             print("No adaptation")
             calculation, dependencies, baseline_get_predictors = caller.call_prepare_interp(csvv, module, weatherbundle, economicmodel, pvals[basename], specconf=specconf, farmer='noadapt', config=config, standard=False)
-            effectset.generate(targetdir, basename + "-noadapt" + suffix, weatherbundle, calculation, specconf['description'] + ", with no adaptation.", dependencies + weatherbundle.dependencies + economicmodel.dependencies, config, push_callback=lambda reg, yr, app: push_callback(reg, yr, app, baseline_get_predictors, basename), deltamethod_vcv=deltamethod_vcv)
+            generate_or_queue(jobs, targetdir, basename + "-noadapt" + suffix, weatherbundle, calculation, specconf['description'] + ", with no adaptation.", dependencies + weatherbundle.dependencies + economicmodel.dependencies, config, push_callback=make_push_callback(push_callback, baseline_get_predictors, basename), deltamethod_vcv=deltamethod_vcv, economicmodel=economicmodel, fingerprint=fingerprint)
 
         if check_doit(targetdir, basename + "-incadapt", suffix, config):
             print("Income-only adaptation")
             calculation, dependencies, baseline_get_predictors = caller.call_prepare_interp(csvv, module, weatherbundle, economicmodel, pvals[basename], specconf=specconf, farmer='incadapt', config=config, standard=False)
-            effectset.generate(targetdir, basename + "-incadapt" + suffix, weatherbundle, calculation, specconf['description'] + ", with interpolation and only environmental adaptation.", dependencies + weatherbundle.dependencies + economicmodel.dependencies, config, push_callback=lambda reg, yr, app: push_callback(reg, yr, app, baseline_get_predictors, basename), deltamethod_vcv=deltamethod_vcv)
+            generate_or_queue(jobs, targetdir, basename + "-incadapt" + suffix, weatherbundle, calculation, specconf['description'] + ", with interpolation and only environmental adaptation.", dependencies + weatherbundle.dependencies + economicmodel.dependencies, config, push_callback=make_push_callback(push_callback, baseline_get_predictors, basename), deltamethod_vcv=deltamethod_vcv, economicmodel=economicmodel, fingerprint=fingerprint)
+
+def make_push_callback(push_callback, baseline_get_predictors, basename):
+    """Bind the calculation-specific arguments of `push_callback`.
+
+    Needed when calculations are queued, since a lambda in a loop would
+    otherwise see only the last calculation's values.
+    """
+    return lambda reg, yr, app: push_callback(reg, yr, app, baseline_get_predictors, basename)
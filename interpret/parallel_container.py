@@ -17,13 +17,18 @@ This allows all processing logic in effectset to be performed at the
 worker level. That is, the code below this point is unchanged and run
 by workers, and the code does not need special conditions for parallel
 processing.
+
+With `parallel-backend: process`, the workers are forked processes,
+and the shared data is published to them in shared memory (see
+generate/multiprocess.py).
 """
 
 import os, threading
 from openest.generate import fast_dataset
 from . import container, configs, specification
-from generate import parallel_weather, pvalses, multithread, weather
-from adaptation import parallel_econmodel, curvegen
+from generate import parallel_weather, pvalses, multithread, multiprocess, weather
+from adaptation import parallel_econmodel, parallel_covariates, curvegen, columnar
+from datastore import irregions
 from impactlab_tools.utils import paralog
 
 preload = container.preload
@@ -49,7 +54,7 @@ class WeatherCovariatorLockstepParallelDriver(multithread.FoldedActionsLockstepP
             self.regions = weatherbundle.regions
         else:
             self.regions = regions
-        self.region_indices = {region: weatherbundle.regions.index(region) for region in self.regions}
+        self.region_indices = irregions.RegionIndex.of(weatherbundle.regions).get_indices_dict(self.regions)
         
         # Active iteration objects
         self.weatheriter = None
@@ -106,6 +111,40 @@ class WeatherCovariatorLockstepParallelDriver(multithread.FoldedActionsLockstepP
 
         return dict(covars_update_year=outputs['year'], curr_covars=curr_covars, curr_years=curr_years)
 
+class WeatherCovariatorProcessLockstepParallelDriver(WeatherCovariatorLockstepParallelDriver, multiprocess.FoldedActionsProcessLockstepParallelDriver):
+    """The driver controller, for worker processes rather than threads.
+
+    Weather and covariates are published to the workers in shared
+    memory. Covariators remain in the driver process: workers receive
+    a SharedCovariatorSource in their place, which is resolved back to
+    the driver's covariator when they request covariate updates.
+    """
+    worker_attributes = multiprocess.FoldedActionsProcessLockstepParallelDriver.worker_attributes + ('any_worker_working',)
+    replicated_actions = ('make_historical',) # workers read the weatherbundle directly
+
+    def __init__(self, *args, **kwargs):
+        super(WeatherCovariatorProcessLockstepParallelDriver, self).__init__(*args, **kwargs)
+        self.shared_covariators = {}
+
+    def instant_create_covariator(self, specconf):
+        covariator = super(WeatherCovariatorProcessLockstepParallelDriver, self).instant_create_covariator(specconf)
+        key = len(self.shared_covariators)
+        self.shared_covariators[key] = covariator
+        return parallel_covariates.SharedCovariatorSource(key, covariator, self.regions)
+
+    def setup_covariate_update(self, covariator, farmer):
+        super(WeatherCovariatorProcessLockstepParallelDriver, self).setup_covariate_update(self.shared_covariators[covariator.key], farmer)
+
+    def covariate_update(self, outputs, covariator, farmer):
+        """Update covariates, publishing them as one shared array per covariate."""
+        outputs = super(WeatherCovariatorProcessLockstepParallelDriver, self).covariate_update(outputs, self.shared_covariators[covariator.key], farmer)
+        # A new store each timestep, since workers may still be reading the last one
+        curr_store = columnar.ColumnarCovariateStore(self.regions)
+        for region in outputs['curr_covars']:
+            curr_store.set(region, outputs['curr_covars'][region], outputs['curr_years'][region])
+
+        return dict(covars_update_year=outputs['covars_update_year'], curr_store=curr_store)
+
 def produce(targetdir, weatherbundle, economicmodel, pvals, config, push_callback=None, suffix='', profile=False, diagnosefile=False):
     """Split the processing to the workers."""
     assert config['threads'] > 1, "More than one thread needed."
@@ -122,7 +161,10 @@ def produce(targetdir, weatherbundle, economicmodel, pvals, config, push_callbac
     
     print("Setting up parallel processing...")
     my_regions = configs.get_regions(weatherbundle.regions, config.get('filter-region', None))
-    driver = WeatherCovariatorLockstepParallelDriver(weatherbundle, economicmodel, config, config['threads'] - 1, seed, my_regions)
+    if config.get('parallel-backend', 'thread') == 'process':
+        driver = WeatherCovariatorProcessLockstepParallelDriver(weatherbundle, economicmodel, config, config['threads'] - 1, seed, my_regions)
+    else:
+        driver = WeatherCovariatorLockstepParallelDriver(weatherbundle, economicmodel, config, config['threads'] - 1, seed, my_regions)
     driver.loop(worker_produce, targetdir, config, pvals)
 
 def worker_produce(proc, driver, driverdir, config, placeholder_pvals):
@@ -1,7 +1,11 @@
 import pytest
 from generate import agglib
 from generate import aggregate
+from generate import nc4writer, weightcache
+from datastore import spacetime
+from netCDF4 import Dataset
 import copy 
+import numpy as np
 
 def test_interpret_costs_known_args():
 
@@ -167,3 +171,70 @@ def test_listtargetdir():
 	files = agglib.listtargetdir(targetdir, only=None, exclude=None) # just list all
 	nochange = agglib.listtargetdir(targetdir, only=None, exclude=None, lowprio=['.notthere'])
 	assert files==nochange
+
+def test_get_aggregation_matrix():
+
+	'''
+	testing the membership matrix from agglib.get_aggregation_matrix(), and aggregating with it
+	'''
+	regions = ['AAA.1.1', 'AAA.1.2', 'AAA.2.1', 'BBB']
+	originals = {'AAA': ['AAA.1.1', 'AAA.1.2', 'AAA.2.1'], 'AAA.1': ['AAA.1.1', 'AAA.1.2'], 'AAA.2': ['AAA.2.1'], 'BBB': ['BBB']}
+	prefixes = [''] + list(originals.keys())
+
+	matrix = agglib.get_aggregation_matrix(regions, originals, prefixes)
+	np.testing.assert_equal(matrix.toarray(), [[1, 1, 1, 1], [1, 1, 1, 0], [1, 1, 0, 0], [0, 0, 1, 0], [0, 0, 0, 1]])
+
+	# (years x regions) values, weighted and summed for all years at once
+	values = np.array([[1., 2., 3., 4.], [5., 6., 7., 8.]])
+	wws = np.array([[1., 1., 2., 1.], [0., 1., 1., 1.]])
+	np.testing.assert_allclose((matrix @ (wws * values).T).T, [[13., 9., 3., 6., 4.], [21., 13., 6., 7., 8.]])
+
+def test_aggregate_coefficients():
+
+	'''
+	testing aggregate.aggregate_coefficients() against aggregating each region-year, with and without chunking
+	'''
+	matrix = agglib.get_aggregation_matrix(['A.1', 'A.2', 'B'], {'A': ['A.1', 'A.2'], 'B': ['B']}, ['', 'A', 'B'])
+	srcvalues = np.random.normal(size=(3, 4, 3))
+	srcvalues[1, 2, 0] = np.nan # left out of that year
+	wws = np.random.uniform(size=(4, 3))
+
+	expected = np.zeros((3, 4, 3))
+	for tt in range(4):
+		for ii, within in enumerate([[0, 1, 2], [0, 1], [2]]):
+			within = [rr for rr in within if np.all(np.isfinite(srcvalues[:, tt, rr]))]
+			expected[:, tt, ii] = np.sum(srcvalues[:, tt, within] * wws[tt, within], axis=1) / np.sum(wws[tt, within])
+
+	np.testing.assert_allclose(aggregate.aggregate_coefficients(srcvalues, matrix, wws), expected)
+	np.testing.assert_allclose(aggregate.aggregate_coefficients(srcvalues, matrix, wws, maxbytes=1), expected)
+
+def test_make_levels_and_aggregates(tmpdir, monkeypatch):
+
+	'''
+	testing that aggregate.make_levels_and_aggregates() writes both outputs from one pass
+	'''
+	monkeypatch.setattr(aggregate, 'cached_weights', weightcache.WeightCache())
+	monkeypatch.setattr(aggregate, 'cached_aggregations', {})
+	monkeypatch.setattr(agglib, 'get_aggregated_regions', lambda regions: ({'A': ['A.1', 'A.2'], 'B': ['B']}, ['', 'A', 'B'], []))
+
+	writer = nc4writer.create(str(tmpdir), 'impacts')
+	writer.description, writer.version, writer.author = 'Impacts', 'v1', 'Tester'
+	nc4writer.make_years_variable(writer)[:] = [2000, 2001]
+	nc4writer.make_regions_variable(writer, ['A.1', 'A.2', 'B'], None)
+	writer.createVariable('rebased', 'f4', ('year', 'region'))[:, :] = [[1., 2., 3.], [4., 5., 6.]]
+	writer.close()
+
+	halfweight = spacetime.SpaceTimeSpatialOnlyData({'A.1': 1., 'A.2': 3., 'B': 2.})
+	aggregate.make_levels_and_aggregates(str(tmpdir), 'impacts.nc4', 'impacts-levels.nc4', 'impacts-aggregated.nc4', halfweight, ('high', 'SSP3'), halfweight, ('high', 'SSP3'), config={})
+
+	with Dataset(str(tmpdir.join('impacts-levels.nc4'))) as reader:
+		assert reader.description == 'Impacts (levels)'
+		np.testing.assert_allclose(reader.variables['rebased'][:, :], [[1., 6., 6.], [4., 15., 12.]])
+	with Dataset(str(tmpdir.join('impacts-aggregated.nc4'))) as reader:
+		assert reader.description == 'Impacts (aggregated)'
+		np.testing.assert_allclose(reader.variables['rebased'][:, :], [[13. / 6, 7. / 4, 3.], [31. / 6, 19. / 4, 6.]])
+
+	# Either output can be skipped
+	aggregate.make_levels_and_aggregates(str(tmpdir), 'impacts.nc4', None, 'impacts-aggregated2.nc4', None, None, halfweight, ('high', 'SSP3'), config={})
+	assert not tmpdir.join('impacts-levels2.nc4').exists()
+	assert tmpdir.join('impacts-aggregated2.nc4').exists()
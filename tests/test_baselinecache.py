@@ -0,0 +1,68 @@
+import os
+import numpy as np
+from generate import baselinecache
+
+class StubTransformer(object):
+    def get_settings(self):
+        return {}
+
+class StubReader(object):
+    """Yearly-split reader with one (empty) file per year."""
+    def __init__(self, template):
+        self.template = template
+
+    def get_dimension(self):
+        return ['tas']
+
+    def get_years(self):
+        return [2000, 2001, 2002]
+
+    def find_templated(self, year):
+        return self.template % year
+
+class StubWeatherBundle(object):
+    model = 'CCSM4'
+    scenario = 'rcp85'
+    regions = ['A', 'B']
+    transformer = StubTransformer()
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.computed = 0
+
+    def get_baseline_sources(self, maxyear):
+        return baselinecache.describe_reader(self.reader, [year for year in self.reader.get_years() if year <= maxyear])
+
+    def baseline_matrix(self, maxyear, variables, quiet=False):
+        self.computed += 1
+        return variables[-1], np.array([[1., 2.], [3., 4.], [5., 6.]])
+
+def test_baseline_cache(tmpdir):
+    template = str(tmpdir.join('tas_%d.nc4'))
+    for year in [2000, 2001, 2002]:
+        open(template % year, 'w').close()
+
+    bundle = StubWeatherBundle(StubReader(template))
+    config = {'baseline-cache': str(tmpdir.join('cache'))}
+
+    dsvar, values = baselinecache.baseline_matrix(bundle, 2001, ['dailytas', 'tas'], 2, config)
+    assert dsvar == 'tas'
+    np.testing.assert_equal(values, [[3., 4.], [5., 6.]])
+
+    # Second call is read from the cache
+    dsvar, values = baselinecache.baseline_matrix(bundle, 2001, ['dailytas', 'tas'], 2, config)
+    assert bundle.computed == 1
+    np.testing.assert_equal(values, [[3., 4.], [5., 6.]])
+
+    # A different window is a different entry
+    baselinecache.baseline_matrix(bundle, 2001, ['dailytas', 'tas'], 3, config)
+    assert bundle.computed == 2
+
+    # Changing a baseline file invalidates the entry
+    os.utime(template % 2001, (0, 0))
+    baselinecache.baseline_matrix(bundle, 2001, ['dailytas', 'tas'], 2, config)
+    assert bundle.computed == 3
+
+    # Without the option, nothing is cached
+    baselinecache.baseline_matrix(bundle, 2001, ['dailytas', 'tas'], 2, {})
+    assert bundle.computed == 4
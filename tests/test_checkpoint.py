@@ -0,0 +1,65 @@
+import os
+import numpy as np
+from generate import checkpoint
+
+class Shared(object):
+    """Stands in for a weather bundle, which should not be saved."""
+    def __init__(self, name):
+        self.name = name
+
+def make_counter(start):
+    total = [start]
+    def counter(step):
+        total[0] += step
+        return total[0]
+    return counter
+
+def make_recursive():
+    def factorial(n):
+        return 1 if n <= 1 else n * factorial(n - 1)
+    return factorial
+
+def test_roundtrip(tmpdir):
+    shared = Shared('original')
+    checkpointer = checkpoint.Checkpointer(str(tmpdir), 'test', 2, [shared], fingerprint=('test', [2000, 2001]))
+    checkpointer.get_results = lambda: np.arange(3.)
+
+    counter = make_counter(10)
+    counter(5)
+    state = {'counter': counter, 'scale': lambda x: 2 * x, 'factorial': make_recursive(), 'shared': shared}
+
+    checkpointer.year_complete(2000, state, [])
+    assert not checkpointer.exists()
+    checkpointer.year_complete(2001, state, [])
+    assert checkpointer.exists()
+
+    # Resume in a new run, with its own shared object
+    newshared = Shared('resumed')
+    resumer = checkpoint.Checkpointer(str(tmpdir), 'test', 2, [newshared], fingerprint=('test', [2000, 2001]))
+    resumed = resumer.load()
+    assert resumed['year'] == 2001
+    np.testing.assert_equal(resumed['results'], np.arange(3.))
+
+    calculations = resumed['calculations']
+    assert calculations['counter'](1) == 16
+    assert calculations['scale'](4) == 8
+    assert calculations['factorial'](5) == 120
+    assert calculations['shared'] is newshared
+
+    resumer.remove()
+    assert not resumer.exists()
+
+def test_fingerprint(tmpdir):
+    checkpointer = checkpoint.Checkpointer(str(tmpdir), 'test', 1, [], fingerprint=['A', 'B'])
+    checkpointer.year_complete(2000, [], [])
+
+    other = checkpoint.Checkpointer(str(tmpdir), 'test', 1, [], fingerprint=['A'])
+    assert other.load() is None
+    assert other.resumed is None
+
+def test_unpicklable(tmpdir):
+    checkpointer = checkpoint.Checkpointer(str(tmpdir), 'test', 1, [])
+    with open(os.path.join(str(tmpdir), 'open.txt'), 'w') as fp:
+        checkpointer.year_complete(2000, [fp], [])
+    assert not checkpointer.enabled
+    assert not checkpointer.exists()
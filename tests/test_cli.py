@@ -28,6 +28,15 @@ def ggmain_stub(mocker):
     )
 
 
+@pytest.fixture
+def gamain_stub(mocker):
+    """Mocks/stubs of gamain, prints input for debugging
+    """
+    mocker.patch.object(
+        cli.core, "gamain", new=lambda *a: click.echo(a),
+    )
+
+
 @pytest.mark.parametrize("subcmd", [None, "generate", "diagnostic", "aggregate"])
 def test_imperics_helpflags(subcmd):
     """Ensure all commands print error if given --help flag
@@ -84,3 +93,14 @@ def test_diagnostic_basic(tmpconf_path, ggmain_stub):
 
     result = runner.invoke(cli.impactcalculations_cli, ["diagnostic", tmpconf_path])
     assert result.output == expected
+
+
+def test_aggregate_workers(tmpconf_path, gamain_stub):
+    """Check aggregate CLI subcommand with config path and --workers
+    """
+    runner = CliRunner()
+    expected = "({'k1': 'v1', 'workers': 4}, 'conf_file')\n"
+    result = runner.invoke(
+        cli.impactcalculations_cli, ["aggregate", tmpconf_path, "--workers", "4"]
+    )
+    assert result.output == expected
@@ -19,6 +19,21 @@ def test_load_netcdf(tmpdir):
     assert ds == orig_ds
 
 
+def test_load_netcdf_variables(tmpdir):
+    """Test that load_netcdf only loads the requested variables."""
+    testdata_path = tmpdir.join("test.nc")
+    orig_ds = xr.Dataset(
+        {"tas": (["time"], np.array([11., 12., 13.])),
+         "pr": (["time"], np.array([1., 2., 3.]))},
+        coords={"time": np.array([1, 2, 3])},
+    )
+    orig_ds.to_netcdf(testdata_path)
+
+    ds = load_netcdf(testdata_path, variables=['tas'])
+    assert list(ds.data_vars) == ['tas']
+    xr.testing.assert_identical(ds, orig_ds[['tas']])
+
+
 @pytest.mark.imperics_shareddir
 def test_standard_variable_identifies():
 
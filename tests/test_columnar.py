@@ -0,0 +1,106 @@
+import pytest
+import numpy as np
+import numpy.testing as npt
+from adaptation import columnar
+
+
+@pytest.fixture
+def histories():
+    rng = np.random.default_rng(4)
+    return [rng.normal(15, 5, nn) for nn in [30, 5, 1, 12]]
+
+
+@pytest.fixture
+def updates():
+    return np.random.default_rng(5).normal(16, 5, (40, 4))
+
+
+def bartlett(values, length):
+    """Triangular kernel, with the newest value weighted `length`"""
+    weights = length - np.arange(len(values))
+    return np.sum(weights * np.array(values[::-1])) / np.sum(weights)
+
+
+@pytest.mark.parametrize("avgcls,reference", [
+    (columnar.ColumnarMeanAverager, lambda values: np.mean(values)),
+    (columnar.ColumnarMedianAverager, lambda values: np.median(values)),
+    (columnar.ColumnarBartlettAverager, lambda values: bartlett(values, 10)),
+])
+def test_windowed_averagers(avgcls, reference, histories, updates):
+    """Each region's average matches the kernel over its own recent values"""
+    length = 10
+    averager = avgcls(histories, length)
+    windows = [list(history[-length:]) for history in histories]
+    for year in range(len(updates)):
+        averager.update_all(updates[year])
+        for rr in range(len(histories)):
+            windows[rr] = (windows[rr] + [updates[year, rr]])[-length:]
+        expected = [reference(window) for window in windows]
+        npt.assert_allclose(averager.get_all(), expected, rtol=1e-12)
+        npt.assert_allclose([averager.get(rr) for rr in range(len(histories))], expected, rtol=1e-12)
+
+
+def test_bucket_averager(histories, updates):
+    averager = columnar.ColumnarBucketAverager(histories, 8)
+    means = [np.mean(history) for history in histories]
+    for year in range(len(updates)):
+        averager.update_all(updates[year])
+        means = [(means[rr] * 7 + updates[year, rr]) / 8 for rr in range(len(histories))]
+    npt.assert_allclose(averager.get_all(), means)
+
+
+def test_views_and_masks(histories):
+    """Per-region views and masked updates touch only their regions"""
+    one = columnar.ColumnarBartlettAverager(histories, 10)
+    two = columnar.ColumnarBartlettAverager(histories, 10)
+    one.view(1).update(20.)
+    one.view(3).update(30.)
+    two.update_all([20., 30.], mask=np.array([False, True, False, True]))
+    npt.assert_allclose(one.get_all(), two.get_all())
+    assert one.view(0).get() == two.get(0)
+
+
+def test_store():
+    store = columnar.ColumnarCovariateStore(['A', 'B', 'C'])
+    store.set('B', {'climtas': 20., 'loggdppc': 9.}, 2020)
+    store.set('A', {'climtas': 10., 'loggdppc': 8.}, 2020)
+    assert store.get_current('B') == {'climtas': 20., 'loggdppc': 9.}
+    assert store['A']['loggdppc'] == 8.
+    assert store.get_yearcovar('A') == 2020
+    npt.assert_allclose(store.get_matrix(['loggdppc', 'climtas'])[:2], [[8., 10.], [9., 20.]])
+    assert np.isnan(store.get_current('C')['climtas'])
+
+
+def test_store_current():
+    """get_current returns the same dictionary until the region's covariates change"""
+    store = columnar.ColumnarCovariateStore(['A', 'B'])
+    store.set('A', {'climtas': 10.}, 2020)
+    store.set('B', {'climtas': 20.}, 2020)
+    current = store.get_current('A')
+    assert store.get_current('A') is current
+    store.set('B', {'climtas': 21.})
+    assert store.get_current('A') is current
+    store.set('B', {'loggdppc': 9.})
+    assert store.get_current('A') is not current and np.isnan(store.get_current('A')['loggdppc'])
+    store.set_column('climtas', [11., 21.])
+    assert store.get_current('A')['climtas'] == 11.
+    assert 'A' in store and 'C' not in store
+    with pytest.raises(KeyError):
+        store.get_current('C')
+
+
+def test_matches_impactcommon(histories, updates):
+    """Columnar averagers reproduce the per-region averagers"""
+    averages = pytest.importorskip("impactcommon.math.averages")
+    pairs = [(averages.MeanAverager, columnar.ColumnarMeanAverager),
+             (averages.MedianAverager, columnar.ColumnarMedianAverager),
+             (averages.BartlettAverager, columnar.ColumnarBartlettAverager),
+             (averages.BucketAverager, columnar.ColumnarBucketAverager)]
+    for avgcls, colcls in pairs:
+        singles = [avgcls(history, 10) for history in histories]
+        averager = colcls(histories, 10)
+        for year in range(len(updates)):
+            averager.update_all(updates[year])
+            for rr in range(len(histories)):
+                singles[rr].update(updates[year, rr])
+            npt.assert_allclose(averager.get_all(), [single.get() for single in singles], rtol=1e-10)
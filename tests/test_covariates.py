@@ -82,6 +82,71 @@ def test_scale_covariate_change():
         np.testing.assert_approx_equal(fast_change, 0)
 
 
+class DummyEconomicModel(object):
+    """Economic model with geometric growth, differing by region, and no population for 'C'"""
+    filter_region = None
+
+    def __init__(self):
+        self.growth = {'A': 0.01, 'B': 0.03, 'C': -0.01}
+
+    def baseline_prepared(self, maxbaseline, numeconyears, func, country_level_gdppc=False, filtered=True):
+        return {region: {'loggdppc': func([8 + self.growth[region] * (year - maxbaseline) for year in range(maxbaseline - 20, maxbaseline + 1)]),
+                         'popop': func([100.] * 21)} for region in self.growth}
+
+    def get_loggdppc_year(self, region, year):
+        return 8 + self.growth[region] * (year - 2015)
+
+    def get_popop_year(self, region, year):
+        return None if region == 'C' else 100. + year - 2015
+
+
+def test_columnar_economic_covariator():
+    """Columnar income covariates, updated for all regions at once, match the per-region averagers"""
+    config = {'class': 'bartlett', 'length': 13}
+    single = covariates.EconomicCovariator(DummyEconomicModel(), 2015, config=config)
+    columnar = covariates.EconomicCovariator(DummyEconomicModel(), 2015, config=dict(config, **{'columnar-covariates': True}))
+    for year in range(2010, 2030):
+        for region in ['B', 'A', 'C']:
+            expected = single.offer_update(region, year, None)
+            result = columnar.offer_update(region, year, None)
+            assert set(result) == set(expected)
+            for covar in expected:
+                np.testing.assert_allclose(result[covar], expected[covar], rtol=1e-12)
+
+
+class DummyDriver(object):
+    """Lockstep driver that returns the given covariate update outputs."""
+    regions = ['A', 'B']
+
+    def __init__(self, outputs):
+        self.outputs = outputs
+
+    def request_action(self, local, action, *args):
+        assert action == 'covariate_update'
+        return self.outputs
+
+
+@pytest.mark.parametrize("backend", ['thread', 'process'])
+def test_worker_parallel_covariator(backend):
+    """Workers read per-region dicts from the threaded driver, and a columnar store from the process driver"""
+    from adaptation import parallel_covariates, columnar
+    source = covariates.EconomicCovariator(DummyEconomicModel(), 2015)
+    updated = {'A': {'loggdppc': 9.}, 'B': {'loggdppc': 10.}}
+    if backend == 'thread':
+        outputs = dict(covars_update_year=2020, curr_covars=updated, curr_years={'A': 2020, 'B': 2020})
+    else:
+        store = columnar.ColumnarCovariateStore(DummyDriver.regions)
+        for region in updated:
+            store.set(region, updated[region], 2020)
+        outputs = dict(covars_update_year=2020, curr_store=store)
+
+    worker = parallel_covariates.WorkerParallelCovariator(DummyDriver(outputs), source, None, 'full')
+    assert worker.get_current('A') == source.get_current('A')
+    assert worker.offer_update('B', 2020, None) == {'loggdppc': 10.}
+    assert worker.get_current('A') == {'loggdppc': 9.}
+    assert worker.get_yearcovar('A') == 2020
+
+
 class TestCovariates(unittest.TestCase):
     def test_spline_covariator(self):
         """Test the SplineCovariator class with two dummy spline terms."""
@@ -1,4 +1,4 @@
-from adaptation.csvvfile import collapse_bang
+from adaptation.csvvfile import collapse_bang, fingerprint, subset
 
 import numpy as np
 import numpy.testing as npt
@@ -17,3 +17,15 @@ def test_collapse_bang():
         rtol=1e-15,
     )
     assert d["gammavcv"] is None
+
+
+def test_fingerprint(tmpdir):
+    """Test that adaptation.csvvfile.fingerprint distinguishes coefficients"""
+    d = {"prednames": ["tas", "tas2"], "covarnames": ["1", "1"], "gamma": np.array([0.5, -0.2]), "gammavcv": None}
+    assert fingerprint(d) == fingerprint(dict(d))
+    assert fingerprint(d) != fingerprint(dict(d, gamma=np.array([0.5, -0.3])))
+    assert fingerprint(subset(d, [0])) != fingerprint(subset(d, [1]))
+
+    path = tmpdir.join("test.csvv")
+    path.write("gamma\n0.5,-0.2\n")
+    assert fingerprint(str(path)) == fingerprint(str(path))
@@ -0,0 +1,130 @@
+"""Check that batched coefficient calculations match the per-region dictionaries.
+"""
+
+import pytest
+import numpy as np
+import numpy.testing as npt
+from adaptation import curvegen_known
+
+
+@pytest.fixture
+def csvv():
+    return dict(variables={'tas': {'unit': 'C'}, 'tas2': {'unit': 'C^2'}},
+                prednames=['tas', 'tas', 'tas', 'tas2', 'tas2', 'tas2'],
+                covarnames=['1', 'climtas', 'loggdppc', '1', 'loggdppc', 'climtas'],
+                gamma=np.array([.1, .02, -.01, .001, .0005, -.0002]))
+
+
+@pytest.fixture
+def covariateses():
+    rng = np.random.default_rng(3)
+    return [{'climtas': rng.uniform(0, 30), 'loggdppc': rng.uniform(6, 11), 'year': 2020} for rr in range(7)]
+
+
+def make_curvegen(csvv, betalimits=None):
+    return curvegen_known.PolynomialCurveGenerator(['C'], 'widgets', 'tas', 2, csvv, betalimits=betalimits, ignore_units=True)
+
+
+def test_coefficients_matrix(csvv, covariateses):
+    """Batched coefficients match get_coefficients for each region"""
+    curvegen = make_curvegen(csvv)
+    matrix = curvegen.get_coefficients_matrix(curvegen.covariates_matrix(covariateses))
+    assert matrix.shape == (len(covariateses), 2)
+    for rr, covariates in enumerate(covariateses):
+        coefficients = curvegen.get_coefficients(covariates)
+        npt.assert_allclose(matrix[rr], [coefficients[predname] for predname in curvegen.prednames], rtol=1e-12)
+
+
+def test_coefficients_matrix_unused_nan(covariateses):
+    """A missing covariate only affects the predictors that use it"""
+    csvv = dict(variables={}, prednames=['tas', 'tas', 'tas2', 'tas2'],
+                covarnames=['1', 'climtas', '1', 'loggdppc'], gamma=np.array([.1, .02, .001, .0005]))
+    curvegen = make_curvegen(csvv)
+    covariateses[0]['loggdppc'] = np.nan
+    covariateses[1]['climtas'] = np.inf
+    matrix = curvegen.get_coefficients_matrix(curvegen.covariates_matrix(covariateses))
+    assert np.isnan(matrix[0, 1]) and np.isinf(matrix[1, 0])
+    for rr, covariates in enumerate(covariateses):
+        coefficients = curvegen.get_coefficients(covariates)
+        npt.assert_array_equal(matrix[rr], [coefficients[predname] for predname in curvegen.prednames])
+
+
+def test_coefficients_matrix_covarnames(csvv, covariateses):
+    """Columns can be given in any order, with extra covariates"""
+    curvegen = make_curvegen(csvv)
+    covarnames = ['year', 'loggdppc', 'climtas']
+    covariates = np.array([[covars[covar] for covar in covarnames] for covars in covariateses])
+    npt.assert_allclose(curvegen.get_coefficients_matrix(covariates, covarnames),
+                        curvegen.get_coefficients_matrix(curvegen.covariates_matrix(covariateses)))
+
+
+def test_coefficients_matrix_betalimits(csvv, covariateses):
+    """Clipping and the derivative of clipped betas match the per-region logic"""
+    curvegen = make_curvegen(csvv, betalimits={'tas': [-np.inf, 0.3]})
+    matrix = curvegen.get_coefficients_matrix(curvegen.covariates_matrix(covariateses))
+    assert np.all(matrix[:, 0] <= 0.3) and np.any(matrix[:, 0] == 0.3)
+
+    derivgen = curvegen.get_partial_derivative_curvegen('climtas', 'C')
+    covarnames = ['climtas', 'loggdppc', 'year']
+    covariates = np.array([[covars[covar] for covar in covarnames] for covars in covariateses])
+    derivmatrix = derivgen.get_coefficients_matrix(covariates, covarnames)
+    for rr, covars in enumerate(covariateses):
+        prederiv = curvegen.get_coefficients(covars)
+        expected = derivgen.curvegen.get_coefficients(covars)
+        if prederiv['tas'] == 0.3:
+            expected['tas'] = 0
+        npt.assert_allclose(derivmatrix[rr], [expected[predname] for predname in derivgen.curvegen.prednames], rtol=1e-12)
+
+
+def test_coefficients_matrix_refill(csvv, covariateses):
+    """Refilling the marginals rebuilds the gamma tensor"""
+    curvegen = make_curvegen(csvv)
+    before = curvegen.get_coefficients_matrix(curvegen.covariates_matrix(covariateses))
+    curvegen.csvv = dict(csvv, gamma=csvv['gamma'] * 2)
+    curvegen.fill_marginals()
+    npt.assert_allclose(curvegen.get_coefficients_matrix(curvegen.covariates_matrix(covariateses)), 2 * before)
+
+
+def test_coefficients_matrix_by_time(covariateses):
+    """Sum-by-time gammas give a coefficient for each predictor and timestep"""
+    csvv = dict(variables={}, prednames=['tas-1', 'tas-1', 'tas-2', 'tas-2', 'tas2-1', 'tas2-1', 'tas2-2', 'tas2-2'],
+                covarnames=['1', 'climtas'] * 4, gamma=np.array([.1, .02, .2, .01, .001, -.0002, .002, -.0001]))
+    polycurvegen = curvegen_known.PolynomialCurveGenerator(['C'], 'widgets', 'tas', 2, csvv, ignore_units=True)
+    curvegen = curvegen_known.SumByTimePolynomialCurveGenerator(csvv, polycurvegen, ['1', '2'])
+    matrix = curvegen.get_coefficients_matrix(curvegen.covariates_matrix(covariateses))
+    assert matrix.shape == (len(covariateses), 2, 2)
+    for rr, covariates in enumerate(covariateses):
+        coefficients = curvegen.get_coefficients(covariates)
+        npt.assert_allclose(matrix[rr], [coefficients[predname] for predname in curvegen.prednames], rtol=1e-12)
+
+
+def test_get_curves(csvv, covariateses):
+    """Curves made in a batch have the same coefficients as those made one at a time"""
+    curvegen = make_curvegen(csvv, betalimits={'tas': [-np.inf, 0.3]})
+    regions = ['R%d' % rr for rr in range(len(covariateses))]
+    curves = curvegen.get_curves(regions, 2005, covariateses)
+    for region, covariates, curve in zip(regions, covariateses, curves):
+        npt.assert_allclose(curve.coeffs, curvegen.get_curve(region, 2005, covariates).coeffs, rtol=1e-12)
+
+
+class DummyCovariator(object):
+    def __init__(self, covariateses):
+        self.covariates = dict(covariateses)
+
+    def get_current(self, region):
+        return self.covariates[region]
+
+
+def test_baseline_curves(csvv, covariateses):
+    """Baseline curves are made in a batch, or one at a time if any covariates are missing"""
+    from adaptation import constraints
+    curvegen = make_curvegen(csvv)
+    regions = ['R%d' % rr for rr in range(len(covariateses))]
+    curves = constraints.get_baseline_curves(regions + ['missing'], curvegen, DummyCovariator(zip(regions, covariateses)))
+    assert sorted(curves) == regions
+
+    del covariateses[0]['loggdppc']
+    curves = constraints.get_baseline_curves(regions, curvegen, DummyCovariator(zip(regions, covariateses)))
+    assert sorted(curves) == regions[1:]
+    for region, covariates in zip(regions[1:], covariateses[1:]):
+        npt.assert_allclose(curves[region].coeffs, curvegen.get_curve(region, 2005, covariates).coeffs, rtol=1e-12)
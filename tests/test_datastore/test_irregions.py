@@ -1,6 +1,8 @@
 import pytest
 import pandas as pd
-from datastore.irregions import contains_region
+import pickle
+import numpy as np
+from datastore.irregions import contains_region, RegionIndex, country_matrix
 
 
 @pytest.fixture
@@ -33,3 +35,39 @@ def test_contains_region(hierid_df, query_parent, query_child, expected):
     """
     actual = contains_region(query_parent, query_child, hierid_df)
     assert actual is expected
+
+
+def test_regionindex_lookup():
+    """RegionIndex matches list.index and behaves as a list"""
+    regions = ["USA.1.1", "USA.1.2", "CAN.1", "USA.1.1"]
+    region_index = RegionIndex(regions)
+    assert region_index == regions
+    assert region_index.index("CAN.1") == regions.index("CAN.1")
+    assert region_index.index("USA.1.1") == 0
+    assert list(region_index.indices(["CAN.1", "USA.1.2"])) == [2, 1]
+    assert "CAN.1" in region_index and "MEX" not in region_index
+    with pytest.raises(ValueError):
+        region_index.index("MEX")
+
+
+def test_regionindex_immutable():
+    """RegionIndex cannot be modified, but can be shared and pickled"""
+    region_index = RegionIndex.of(["A", "B"])
+    with pytest.raises(TypeError):
+        region_index.append("C")
+    with pytest.raises(TypeError):
+        region_index[0] = "C"
+    assert RegionIndex.of(["A", "B"]) is region_index
+    assert RegionIndex.of(region_index) is region_index
+    assert pickle.loads(pickle.dumps(region_index)).index("B") == 1
+
+
+def test_country_matrix():
+    """Test country_matrix gives weighted country averages, with equal weights where all are 0"""
+    regions = ["AAA.1", "BBB.1", "AAA.2", "BBB.2", "CCC"]
+    countries, matrix = country_matrix(regions, [1, 0, 3, 0, 2])
+    assert list(countries) == ["AAA", "BBB", "CCC"]
+
+    values = np.array([[1., 10.], [2., 20.], [3., 30.], [4., 40.], [5., 50.]])
+    np.testing.assert_allclose(matrix @ values, [[2.5, 25.], [3., 30.], [5., 50.]])
+
@@ -0,0 +1,30 @@
+import numpy as np
+from generate import effectset, agglib
+
+def loop_variance(bcde, vcv):
+    variance = np.zeros(bcde.shape[1:])
+    for yy in range(bcde.shape[1]):
+        for rr in range(bcde.shape[2]):
+            for ii in range(bcde.shape[0]):
+                for jj in range(bcde.shape[0]):
+                    variance[yy, rr] += vcv[ii, jj] * bcde[ii, yy, rr] * bcde[jj, yy, rr]
+    return variance
+
+def test_deltamethod_variance():
+    bcde = np.random.normal(size=(4, 7, 5))
+    vcv = np.random.normal(size=(4, 4))
+    vcv = np.dot(vcv, vcv.T)
+
+    expected = loop_variance(bcde, vcv)
+    np.testing.assert_allclose(agglib.deltamethod_variance(bcde, vcv), expected)
+    # Chunked over one year at a time
+    np.testing.assert_allclose(agglib.deltamethod_variance(bcde, vcv, maxbytes=1), expected)
+
+def test_finish_ncdf_data():
+    vcv = np.eye(3)
+    columndata = [np.full((2, 2), np.nan), np.full((3, 2, 2), np.nan)]
+    effectset.store_ncdf_result(columndata, 0, 1, [np.array([1., 2., 3.])], deltamethod_vcv=vcv)
+    effectset.finish_ncdf_data(columndata, deltamethod_vcv=vcv)
+
+    assert columndata[0][0, 1] == 14
+    assert np.isnan(columndata[0][0, 0]) and np.isnan(columndata[0][1, 1])
@@ -31,5 +31,16 @@ class TestForecastReader(unittest.TestCase):
             self.assertAlmostEqual(ds1['z-scores'][3], ds2['mean'][3])
             return
 
+    def test_country_means(self):
+        regions = ['AAA.1', 'AAA.2', 'AAA.3', 'BBB.1', 'BBB.2', 'CCC']
+        values = np.arange(18.).reshape(3, 6)
+        values[1, 1] = np.nan # left out of AAA
+        values[0, 3] = values[0, 4] = np.nan # all of BBB missing
+
+        bycountry = forecasts.get_means(regions, lambda ii: values[:, ii])
+        means = forecasts.get_country_means(regions, values)
+        for jj, country in enumerate(['AAA', 'BBB', 'CCC']):
+            testing.assert_allclose(means[:, jj], bycountry[country])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+from climate.dailyreader import get_gddkdd
+
+tmin = np.array([[0., 10., 20., 35.], [5., 8., 30., 25.]])
+tmax = np.array([[5., 25., 33., 40.], [8., 20., 36., 25.]])
+
+def sine_integral(tmin, tmax, lower, upper, steps=100000):
+    temps = (tmax + tmin) / 2 + (tmax - tmin) / 2 * np.sin(2 * np.pi * (np.arange(steps) + .5) / steps)
+    return np.mean(np.clip(temps, lower, upper) - lower), np.mean(np.maximum(temps - upper, 0))
+
+def test_sine_integral():
+    gdd, kdd = get_gddkdd(tmin, tmax, 8, 31)
+    assert gdd.shape == tmin.shape
+    for ii in range(tmin.shape[0]):
+        for jj in range(tmin.shape[1]):
+            expected = sine_integral(tmin[ii, jj], tmax[ii, jj], 8, 31)
+            np.testing.assert_allclose([gdd[ii, jj], kdd[ii, jj]], expected, atol=1e-6)
+
+def test_reference_values():
+    """Closed-form single sine degree-days, between 8 and 31 C"""
+    tmin = np.array([0., 10., 35., 25., 21., 0., -2., np.nan, 35.])
+    tmax = np.array([5., 20., 40., 25., 41., 16., 42., 30., np.nan])
+    gdd, kdd = get_gddkdd(tmin, tmax, 8, 31)
+    expected_gdd = [0., 7., 23., 17., 23 - 10 / np.pi, 8 / np.pi, 11.675108520818483, np.nan, np.nan]
+    expected_kdd = [0., 0., 6.5, 0., 10 / np.pi, 0., 2.397951182973046, np.nan, np.nan]
+    np.testing.assert_allclose(gdd, expected_gdd, atol=1e-12)
+    np.testing.assert_allclose(kdd, expected_kdd, atol=1e-12)
+
+def test_matches_per_region():
+    gddkdd = pytest.importorskip('impactcommon.math.gddkdd')
+    gdd, kdd = get_gddkdd(tmin, tmax, 8, 31)
+    for jj in range(tmin.shape[1]):
+        regiongdd, regionkdd = gddkdd.get_gddkdd(tmin[:, jj], tmax[:, jj], 8, 31)
+        np.testing.assert_allclose(gdd[:, jj], regiongdd)
+        np.testing.assert_allclose(kdd[:, jj], regionkdd)
@@ -0,0 +1,46 @@
+import os, json
+from climate import reader
+
+def make_files(dirpath, names):
+    os.makedirs(dirpath, exist_ok=True)
+    for name in names:
+        open(os.path.join(dirpath, name), 'w').close()
+
+def test_find_templated(tmpdir):
+    make_files(str(tmpdir.join('tas_2000')), ['1.0.nc4', '1.10.nc4', '1.2.nc4'])
+    make_files(str(tmpdir.join('tas_2001')), ['1.0.nc4'])
+
+    listings = reader.DirectoryListings()
+    template = str(tmpdir.join('tas_%d', '%v.nc4'))
+    assert listings.find_templated(template, 2000) == str(tmpdir.join('tas_2000', '1.10.nc4'))
+    assert listings.find_templated(template, 2001) == str(tmpdir.join('tas_2001', '1.0.nc4'))
+    assert listings.find_templated(template, 2002) == str(tmpdir.join('tas_2002', 'unknown.nc4'))
+
+    # Results are memoized
+    make_files(str(tmpdir.join('tas_2001')), ['1.5.nc4'])
+    assert listings.find_templated(template, 2001) == str(tmpdir.join('tas_2001', '1.0.nc4'))
+    listings.clear()
+    assert listings.find_templated(template, 2001) == str(tmpdir.join('tas_2001', '1.5.nc4'))
+
+def test_manifest(tmpdir):
+    datadir = str(tmpdir.join('data'))
+    make_files(datadir, ['tas_2000.nc', 'tas_2001.nc'])
+    manifest = str(tmpdir.join('manifest.json'))
+
+    listings = reader.DirectoryListings()
+    listings.use_manifest(manifest)
+    assert listings.exists(os.path.join(datadir, 'tas_2001.nc'))
+    assert not listings.exists(os.path.join(datadir, 'tas_2002.nc'))
+    with open(manifest) as fp:
+        assert sorted(json.load(fp)[datadir][1]) == ['tas_2000.nc', 'tas_2001.nc']
+
+    # A new run reuses the manifest while the directory is unchanged
+    listings = reader.DirectoryListings()
+    listings.use_manifest(manifest)
+    assert listings.list(datadir) == {'tas_2000.nc', 'tas_2001.nc'}
+
+    make_files(datadir, ['tas_2002.nc'])
+    os.utime(datadir, (0, 0))
+    listings = reader.DirectoryListings()
+    listings.use_manifest(manifest)
+    assert listings.exists(os.path.join(datadir, 'tas_2002.nc'))
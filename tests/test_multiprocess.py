@@ -0,0 +1,131 @@
+import threading, multiprocessing
+import numpy as np
+import xarray as xr
+import pytest
+from multiprocessing import shared_memory
+from generate import multiprocess
+from adaptation import columnar
+
+## Determine what the result should look like
+weather = np.random.normal(size=(30, 4))
+weathersum = np.cumsum(weather, axis=0)
+covars = np.array([weathersum[9]] * 10 + list(weathersum[10:]))
+results_true = np.sum(weather * covars, axis=1)
+
+class MyTestFoldedActionsProcessLockstepParallelDriver(multiprocess.FoldedActionsProcessLockstepParallelDriver):
+    def __init__(self, mcdraws):
+        super(MyTestFoldedActionsProcessLockstepParallelDriver, self).__init__(mcdraws)
+        self.covarval = 0
+        self.weatheriter = None
+
+    def setup_iterate_weather(self, count):
+        assert self.weatheriter is None
+        self.weatheriter = iter(weather[:count])
+
+    def iterate_weather(self, outputs, count):
+        try:
+            return {'weather': next(self.weatheriter).copy()}
+        except StopIteration:
+            self.weatheriter = None
+            return None # stop this and following actions
+
+    def setup_calc_covar(self, baseline):
+        self.covarval = np.array(baseline)
+
+    def calc_covar(self, outputs, baseline):
+        self.covarval = self.covarval + outputs['weather']
+        return {'covar': self.covarval}
+
+    def instant_get_label(self, label):
+        return label.upper()
+
+def weatherbundle(driver, local, count=len(weather)):
+    while True:
+        outputs = driver.request_action(local, 'iterate_weather', count)
+        if 'weather' not in outputs:
+            driver.end_timestep(local)
+            break
+        yield outputs['weather']
+
+def worker_process(proc, driver, results):
+    # Create the process local data
+    local = threading.local()
+
+    label = driver.instant_action('get_label', 'ok')
+
+    # Calculate baseline covar
+    baseline = 0
+    for values in weatherbundle(driver, local, 10):
+        baseline = baseline + values
+        driver.end_timestep(local)
+
+    # Calculate results
+    year = 0
+    myresults = []
+    for values in weatherbundle(driver, local):
+        year += 1
+        if year > 10:
+            covar = driver.request_action(local, 'calc_covar', tuple(baseline))['covar']
+            myresults.append(np.sum(values * covar))
+        else:
+            myresults.append(np.sum(values * baseline))
+        driver.end_timestep(local)
+
+    results.put((proc, label, myresults))
+    driver.end_worker()
+
+def test_folded_processes():
+    results = multiprocessing.get_context('fork').Queue()
+    driver = MyTestFoldedActionsProcessLockstepParallelDriver(3)
+    driver.loop(worker_process, results)
+
+    for ii in range(3):
+        proc, label, myresults = results.get(timeout=10)
+        assert label == 'OK'
+        np.testing.assert_allclose(myresults, results_true)
+
+def failing_worker(proc, driver):
+    driver.lockstep_pause()
+    raise ValueError("Worker failure")
+
+def test_worker_exception():
+    driver = MyTestFoldedActionsProcessLockstepParallelDriver(2)
+    with pytest.raises(ValueError):
+        driver.loop(failing_worker)
+
+def test_shared_memory_roundtrip():
+    ds = xr.Dataset({'tas': (('time', 'region'), np.random.normal(size=(365, 3)))},
+                    coords={'time': np.arange(365), 'region': ['A', 'B', 'C']}, attrs={'source': 'test'})
+    store = columnar.ColumnarCovariateStore(['A', 'B', 'C'])
+    store.set('B', {'loggdppc': 9.5, 'climtas': 12.}, 2020)
+    value = {'year': 2020, 'ds': ds, 'curr_store': store, 'array': np.arange(5.), 'tuple': ('a', [1, 2])}
+
+    publisher = multiprocess.SharedMemoryPublisher()
+    reader = multiprocess.SharedMemoryReader()
+    result = reader.read(publisher.publish(value))
+
+    assert result['year'] == 2020
+    assert result['tuple'] == ('a', [1, 2])
+    np.testing.assert_equal(result['array'], np.arange(5.))
+    xr.testing.assert_identical(result['ds'], ds)
+    assert result['curr_store'].get_current('B') == {'loggdppc': 9.5, 'climtas': 12.}
+    assert result['curr_store'].get_yearcovar('B') == 2020
+
+    # Unchanged values are not exported again
+    assert publisher.publish(value) == publisher.publish(value)
+    assert publisher.retired == []
+
+    # Dropped values are unlinked
+    blocknames = [block.name for valueid in publisher.exports for block in publisher.exports[valueid][2]]
+    del value['ds'], value['curr_store'], value['array'], result
+    reader.read(publisher.publish(value))
+    publisher.unlink_retired()
+    assert reader.closing == []
+    for name in blocknames:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+
+    publisher.close()
+
+if __name__ == '__main__':
+    test_folded_processes()
@@ -0,0 +1,76 @@
+import time
+import pytest
+from generate import prefetch
+
+
+def slow_years(years, delay=0):
+    for year in years:
+        time.sleep(delay)
+        yield year, {'year': year}
+
+
+def test_prefetched_order():
+    """Prefetching returns the same items in the same order"""
+    expected = list(slow_years(range(1981, 1991)))
+    assert list(prefetch.prefetched(slow_years(range(1981, 1991)), 2)) == expected
+
+
+def test_prefetched_passthrough():
+    """A depth of 0 does not start a thread"""
+    iterator = slow_years(range(3))
+    assert len(list(prefetch.prefetched(iterator, 0))) == 3
+
+
+def test_prefetch_stalls():
+    """Consumer stalls are counted when reads are slower than processing"""
+    prefetcher = prefetch.PrefetchIterator(slow_years(range(5), delay=.02), 2)
+    assert len(list(prefetcher)) == 5
+    assert prefetcher.count == 5
+    assert prefetcher.stalls >= 1
+
+
+def test_prefetch_exception():
+    """Exceptions in the reader are raised to the consumer"""
+    def failing():
+        yield 1
+        raise IOError("Cannot read year")
+
+    with pytest.raises(IOError):
+        list(prefetch.prefetched(failing(), 3))
+
+
+def test_prefetch_early_stop():
+    """Stopping early shuts down the background thread"""
+    prefetcher = prefetch.PrefetchIterator(slow_years(range(1000)), 1)
+    assert next(prefetcher) == (0, {'year': 0})
+    prefetcher.close()
+    assert not prefetcher.thread.is_alive()
+
+
+def test_prefetch_netcdf_lock():
+    """Items are not read while another thread holds the netCDF lock"""
+    reading = []
+    def checked_years():
+        for year in range(5):
+            reading.append(prefetch.netcdf_lock._is_owned())
+            yield year, {'year': year}
+
+    with prefetch.netcdf_lock:
+        prefetcher = prefetch.PrefetchIterator(checked_years(), 2)
+        time.sleep(.05)
+        assert prefetcher.queue.empty()
+    assert len(list(prefetcher)) == 5
+    assert all(reading)
+
+
+def test_prefetch_base_exception():
+    """Exceptions not derived from Exception still end the iteration"""
+    class Abort(BaseException):
+        pass
+
+    def aborting():
+        yield 1
+        raise Abort()
+
+    with pytest.raises(Abort):
+        list(prefetch.prefetched(aborting(), 3))
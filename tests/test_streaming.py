@@ -0,0 +1,70 @@
+import pytest
+import numpy as np
+from netCDF4 import Dataset
+from generate import effectset
+
+class MockWeatherBundle(object):
+    version = 'TEST-WEATHER'
+    dependencies = []
+
+    def get_years(self):
+        return list(range(2000, 2005))
+
+class MockCalculation(object):
+    unitses = ['deaths', 'deaths']
+
+    def column_info(self):
+        return [{'name': 'rebased', 'title': "Rebased", 'description': "Rebased results"},
+                {'name': 'original', 'title': "Original", 'description': "Original results"}]
+
+def test_streaming_writer(tmpdir):
+    regions = ['A', 'B', 'C']
+    writer = effectset.StreamingNcdfWriter(str(tmpdir), 'test', MockWeatherBundle(), MockCalculation(), "Test", [], regions, flush_years=2)
+
+    # Years 0 and 1 are reported out of order; region C never reports year 3
+    for yearii in [1, 0, 2, 3]:
+        for regionii in range(3):
+            if yearii == 3 and regionii == 2:
+                continue
+            writer.store(yearii, regionii, [yearii + regionii, -yearii])
+        if yearii == 1:
+            # Year 0 has not been reported yet
+            assert not writer.written[0] and writer.written[1]
+            assert writer.years_complete == 0
+
+    assert writer.years_complete == 3
+    assert list(writer.pending.keys()) == [3]
+    writer.close()
+
+    rootgrp = Dataset(str(tmpdir.join('test.nc4')))
+    assert rootgrp.years_complete == 5
+    rebased = rootgrp.variables['rebased'][:, :]
+    np.testing.assert_equal(rebased[:3, :], np.arange(3)[:, np.newaxis] + np.arange(3)[np.newaxis, :])
+    np.testing.assert_equal(rebased[3, :2], [3, 4])
+    assert np.isnan(rebased[3, 2]) and np.all(np.isnan(rebased[4, :]))
+    np.testing.assert_equal(rootgrp.variables['original'][:3, 0], [0, -1, -2])
+    rootgrp.close()
+
+def test_streaming_deltamethod(tmpdir):
+    vcv = np.array([[2., 0.], [0., 1.]])
+    writer = effectset.StreamingNcdfWriter(str(tmpdir), 'test', MockWeatherBundle(), MockCalculation(), "Test", [], ['A'], deltamethod_vcv=vcv)
+    writer.store(0, 0, [np.array([1., 2.]), np.array([3., 0.])])
+    writer.close()
+
+    rootgrp = Dataset(str(tmpdir.join('test.nc4')))
+    assert rootgrp.variables['rebased'][0, 0] == 6
+    assert rootgrp.variables['original'][0, 0] == 18
+    np.testing.assert_equal(rootgrp.variables['rebased_bcde'][:, 0, 0], [1, 2])
+    rootgrp.close()
+
+def test_multiplexed_config():
+    """Jobs' model configurations are used, and must agree on the options of the pass"""
+    outer = {'stream-output': False}
+    jobs = [dict(basename='a', config={'stream-output': True, 'filter-region': 'USA', 'only-a': 1}),
+            dict(basename='b', config={'stream-output': True, 'filter-region': 'USA'})]
+    assert effectset.get_multiplexed_config(jobs, outer) is jobs[0]['config']
+    assert effectset.get_multiplexed_config([dict(basename='a')], outer) is outer
+
+    jobs[1]['config']['filter-region'] = 'CAN'
+    with pytest.raises(ValueError):
+        effectset.get_multiplexed_config(jobs, outer)
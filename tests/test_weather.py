@@ -219,6 +219,65 @@ class TestRollingYearTransformer:
         )
 
 
+    def test_push_windows(self):
+        """Test RollingYearTransformer.push() windows over many years, with a gap
+
+        Windows must be unaffected by later years, since they are views
+        onto the transformer's buffer.
+        """
+        transformer = weather.RollingYearTransformer(rolling_years=3)
+
+        def make_year(year):
+            return xr.Dataset({"temp": (("time", "region"), np.full((2, 2), float(year)))},
+                              coords={"time": year * 1000 + np.arange(1, 3), "region": ["a", "b"]})
+
+        years = list(range(1000, 1012)) + list(range(1020, 1025))
+        outputs = [output for year in years for output in transformer.push(year, make_year(year))]
+
+        assert [year for year, ds in outputs] == list(range(1000, 1010)) + list(range(1020, 1023))
+        for year, ds in outputs:
+            npt.assert_allclose(ds["temp"].values[:, 0], np.repeat(np.arange(year, year + 3), 2))
+            npt.assert_equal(ds["time"].values[::2], np.arange(year, year + 3) * 1000 + 1)
+
+    def test_push_leap_years(self):
+        """Test RollingYearTransformer.push() windows over years of different lengths
+
+        Each year is one day per day-of-year, with an extra day in leap
+        years, so windows are found by the years' cumulative lengths.
+        """
+        transformer = weather.RollingYearTransformer(rolling_years=3)
+
+        def make_year(year):
+            days = 366 if year % 4 == 0 else 365
+            return xr.Dataset({"temp": (("time", "region"), np.full((days, 2), float(year)))},
+                              coords={"time": year * 1000 + np.arange(1, days + 1), "region": ["a", "b"]})
+
+        years = list(range(1995, 2015))
+        outputs = [output for year in years for output in transformer.push(year, make_year(year))]
+
+        assert [year for year, ds in outputs] == list(range(1995, 2013))
+        assert transformer.buffered == len(years)
+        for year, ds in outputs:
+            expected = np.concatenate([make_year(yy)["temp"].values[:, 0] for yy in range(year, year + 3)])
+            npt.assert_equal(ds["temp"].values[:, 0], expected)
+            npt.assert_equal(ds["time"].values, np.concatenate([make_year(yy)["time"].values for yy in range(year, year + 3)]))
+
+
+    def test_settings_unchanged_by_push(self):
+        """Test RollingYearTransformer's baseline cache description is not affected by its iteration"""
+        from generate import baselinecache
+        transformer = weather.RollingYearTransformer(rolling_years=3)
+        before = baselinecache.describe_transformer(transformer)
+        for year in range(2000, 2005):
+            ds = xr.Dataset({"temp": (("time", "region"), np.full((365, 2), float(year)))},
+                            coords={"time": year * 1000 + np.arange(1, 366), "region": ["a", "b"]})
+            list(transformer.push(year, ds))
+
+        assert transformer.buffered > 0
+        assert baselinecache.describe_transformer(transformer) == before
+        assert before == ['RollingYearTransformer', [('rolling_years', 3)]]
+
+
 class TestHistoricalWeatherBundle:
     """Unit tests for basic behavior of generate.weather.HistoricalWeatherBundle
     """
@@ -0,0 +1,71 @@
+import pytest
+import numpy as np
+from generate import weightcache
+from datastore import spacetime
+
+class CountingHalfweight(object):
+    """Halfweight which counts its loads."""
+    def __init__(self, stweight):
+        self.stweight = stweight
+        self.loads = 0
+
+    def load(self, year0, year1, model, scenario):
+        self.loads += 1
+        return self.stweight
+
+def test_materialized():
+    regions = ['A', 'B', 'C']
+    stweight = spacetime.SpaceTimeLoadedData(2000, 2002, ['A', 'B'], np.array([[1., 2.], [3., 4.], [5., 6.]]))
+    array = weightcache.materialize(stweight, regions[:2])
+    np.testing.assert_equal(array, [[1., 2.], [3., 4.], [5., 6.]])
+
+    # Regions without weights are an error
+    with pytest.raises(ValueError):
+        weightcache.materialize(stweight, regions)
+
+    # Constant weights are a single row, returned as scalars
+    weights = weightcache.MaterializedWeights(2000, 2002, regions, weightcache.materialize(spacetime.SpaceTimeConstantData(2.), regions))
+    assert weights.array.shape == (1, 3)
+    assert weights.get_time('B') == 2.
+    assert weights.get_time('D') is None
+
+def test_weight_cache(tmpdir):
+    regions = ['A', 'B']
+    halfweight = CountingHalfweight(spacetime.SpaceTimeLoadedData(2000, 2002, regions, np.array([[1., 2.], [3., 4.], [5., 6.]])))
+
+    cache = weightcache.WeightCache(cachedir=str(tmpdir.join('weights')))
+    cache.describe(halfweight, 'population')
+    weights = cache.get_materialized(halfweight, ('high', 'SSP3'), 2000, 2002, regions)
+    np.testing.assert_equal(weights.get_time('B'), [2., 4., 6.])
+    assert cache.get_materialized(halfweight, ('high', 'SSP3'), 2000, 2002, regions) is weights
+    assert halfweight.loads == 1
+    assert cache.stats == dict(hits=1, misses=1, evictions=0, diskhits=0)
+    assert cache.nbytes >= 6 * 8
+
+    # A new cache reads the saved weights
+    cache = weightcache.WeightCache(cachedir=str(tmpdir.join('weights')))
+    cache.describe(halfweight, 'population')
+    np.testing.assert_equal(cache.get_materialized(halfweight, ('high', 'SSP3'), 2000, 2002, regions).array, weights.array)
+    assert halfweight.loads == 1
+    assert cache.stats['diskhits'] == 1
+
+    # Other arguments are loaded separately
+    cache.get_materialized(halfweight, ('low', 'SSP3'), 2000, 2002, regions)
+    assert halfweight.loads == 2
+
+def test_weight_cache_limit():
+    cache = weightcache.WeightCache(limit_mb=2.5e-3) # room for two 1 kB arrays
+    for key in ['a', 'b', 'c']:
+        cache.get(key, lambda: np.zeros(125))
+    assert list(cache.entries) == ['b', 'c']
+    assert cache.stats['evictions'] == 1
+
+    # Using an entry makes it the most recent
+    cache.get('b', lambda: None)
+    cache.get('d', lambda: np.zeros(125))
+    assert list(cache.entries) == ['b', 'd']
+    assert cache.nbytes == 2000
+
+    # Entries larger than the limit are not kept
+    cache.get('e', lambda: np.zeros(1000))
+    assert 'e' not in cache.entries
@@ -0,0 +1,37 @@
+import numpy as np
+import xarray as xr
+from climate.reader import YearCache, dataset_nbytes
+
+def make_year(year):
+    return xr.Dataset({'tas': (('time', 'region'), np.full((365, 10), float(year)))},
+                      coords={'time': year * 1000 + np.arange(1, 366), 'region': np.arange(10)})
+
+def test_lru():
+    loads = []
+    def load(year):
+        loads.append(year)
+        return make_year(year)
+
+    nbytes = dataset_nbytes(make_year(2000))
+    cache = YearCache('test', limit_mb=2.5 * nbytes / 1e6) # holds 2 years
+    for year in [2000, 2001, 2000, 2002, 2001, 2000]:
+        ds = cache.get(year, lambda: load(year))
+        assert ds['tas'].values[0, 0] == year
+
+    # 2001 is evicted by 2002, and then 2000 by 2001
+    assert loads == [2000, 2001, 2002, 2001, 2000]
+    assert (cache.hits, cache.misses) == (1, 5)
+    assert cache.nbytes == 2 * nbytes
+
+def test_relabel_copy():
+    cache = YearCache('test', limit_mb=10)
+    ds = cache.get(2000, lambda: make_year(2000))
+    ds['time'] = ds['time'].values + 5000
+    assert cache.get(2000, lambda: None)['time'].values[0] == 2000001
+
+def test_disabled():
+    cache = YearCache('test', limit_mb=0)
+    cache.get(2000, lambda: make_year(2000))
+    cache.get(2000, lambda: make_year(2000))
+    assert cache.entries == {}
+    assert (cache.hits, cache.misses) == (0, 0)
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+from climate.yearlyreader import YearlyWeatherReader, YearlyDayLikeWeatherReader, RandomYearlyAccess
+from climate.reader import RegionReorderWeatherReader, FakeRepeaterReader
+from datastore import irregions
+
+def write_yearly(path):
+    years = np.arange(2000, 2010)
+    ds = xr.Dataset({'tas': (('time', 'region'), years[:, np.newaxis] + np.arange(3)[np.newaxis, :] / 10.)},
+                    coords={'time': pd.to_datetime(["%d-07-01" % year for year in years]), 'region': ['A', 'B', 'C']},
+                    attrs={'version': '1.0'})
+    ds['tas'].attrs['units'] = 'C'
+    ds.to_netcdf(path)
+
+def test_read_year(tmpdir):
+    path = str(tmpdir.join('tas.nc4'))
+    write_yearly(path)
+
+    reader = YearlyWeatherReader(path, 'tas')
+    ds = reader.read_year(2004)
+    assert int(ds['time.year']) == 2004
+    np.testing.assert_allclose(ds['tas'].values, [2004, 2004.1, 2004.2])
+    assert reader.read_year(1990) is None
+
+    # Years agree with the sequential iterator
+    for ds, year in zip(reader.read_iterator(), range(2000, 2010)):
+        np.testing.assert_equal(ds['tas'].values, reader.read_year(year)['tas'].values)
+
+    # Out-of-order access
+    access = RandomYearlyAccess(reader)
+    for year in [2005, 2002, 2002, 2008]:
+        np.testing.assert_allclose(access.get_values(year, 'tas'), year + np.arange(3) / 10.)
+
+def test_subset_regions(tmpdir):
+    path = str(tmpdir.join('tas.nc4'))
+    write_yearly(path)
+
+    reader = YearlyWeatherReader(path, 'tas', regionvar='region')
+    assert reader.can_subset_regions()
+    reader.subset_regions([2, 0])
+    assert list(reader.get_regions()) == ['C', 'A']
+    np.testing.assert_allclose(reader.read_year(2003)['tas'].values, [2003.2, 2003])
+
+    # Indices are always relative to the full set of regions
+    reader.subset_regions([1])
+    assert list(reader.get_regions()) == ['B']
+    np.testing.assert_allclose(reader.read_year(2003)['tas'].values, [2003.1])
+
+def test_fake_repeater(tmpdir):
+    path = str(tmpdir.join('tas.nc4'))
+    write_yearly(path)
+
+    reader = FakeRepeaterReader(YearlyWeatherReader(path, 'tas', regionvar='region'))
+    assert reader.get_dimension() == reader.reader.get_dimension()
+    assert list(reader.get_regions()) == ['A', 'B', 'C']
+
+def test_subset_yearly_split(tmpdir):
+    for year in [2000, 2001]:
+        ds = xr.Dataset({'tas': (('hierid',), year + np.arange(5) / 10.)}, coords={'hierid': ['A', 'B', 'C', 'D', 'E']},
+                        attrs={'version': '1.0'})
+        ds['tas'].attrs['units'] = 'C'
+        ds.to_netcdf(str(tmpdir.join('tas_%d.nc4' % year)))
+
+    reader = YearlyDayLikeWeatherReader(str(tmpdir.join('tas_%d.nc4')), 2000, 'hierid', 'tas')
+    reader.subset_regions([1, 2, 3]) # read as a single hyperslab
+    assert list(reader.get_regions()) == ['B', 'C', 'D']
+    ds = reader.read_year(2001)
+    assert list(ds.region.values) == ['B', 'C', 'D']
+    np.testing.assert_allclose(ds['tas'].values, [[2001.1, 2001.2, 2001.3]])
+
+def test_region_reorder(tmpdir, monkeypatch):
+    path = str(tmpdir.join('tas.nc4'))
+    write_yearly(path)
+
+    monkeypatch.setattr(irregions, 'load_regions', lambda hierarchy, dependencies: ['C', 'A', 'B'])
+    reader = RegionReorderWeatherReader(YearlyWeatherReader(path, 'tas', regionvar='region'))
+    assert not reader.is_identity
+    ds = reader.read_year(2003)
+    assert list(ds.region.values) == ['C', 'A', 'B']
+    np.testing.assert_allclose(ds['tas'].values, [2003.2, 2003, 2003.1])
+    assert reader.reorder_count == 1
+
+    # Regions already in order are passed through
+    monkeypatch.setattr(irregions, 'load_regions', lambda hierarchy, dependencies: ['A', 'B', 'C'])
+    reader = RegionReorderWeatherReader(YearlyWeatherReader(path, 'tas', regionvar='region'))
+    assert reader.is_identity
+    np.testing.assert_allclose(reader.read_year(2003)['tas'].values, [2003, 2003.1, 2003.2])
+
+    # Subsets keep the desired order
+    reader.subset_regions([2, 0])
+    assert not reader.is_identity
+    np.testing.assert_allclose(reader.read_year(2003)['tas'].values, [2003.2, 2003])